@@ -1,14 +1,34 @@
 from fastapi import APIRouter
-from . import routes_auth, routes_categories, routes_licenses, routes_users
+from ..config import get_settings
 
-api_router = APIRouter()
+def build_api_router(asynchronous: bool) -> APIRouter:
+    """Router dell'API con gli handler sincroni o asincroni (ASYNC_DB)"""
+    if asynchronous:
+        # Router asincroni su AsyncEngine (asyncpg / aiosqlite)
+        from . import (
+            routes_auth_async as routes_auth,
+            routes_categories_async as routes_categories,
+            routes_events_async as routes_events,
+            routes_licenses_async as routes_licenses,
+            routes_sync_async as routes_sync,
+            routes_users_async as routes_users,
+        )
+    else:
+        from . import routes_auth, routes_categories, routes_events, routes_licenses, routes_sync, routes_users
 
-# Health check endpoint
-@api_router.get("/health")
-async def health_check():
-    return {"status": "healthy", "message": "MyKeyManager API is running"}
+    api_router = APIRouter()
 
-api_router.include_router(routes_auth.router, prefix="/auth", tags=["auth"])
-api_router.include_router(routes_categories.router, prefix="/categories", tags=["categories"])
-api_router.include_router(routes_licenses.router, prefix="/licenses", tags=["licenses"])
-api_router.include_router(routes_users.router, prefix="/users", tags=["users"])
+    # Health check endpoint
+    @api_router.get("/health")
+    async def health_check():
+        return {"status": "healthy", "message": "MyKeyManager API is running"}
+
+    api_router.include_router(routes_auth.router, prefix="/auth", tags=["auth"])
+    api_router.include_router(routes_categories.router, prefix="/categories", tags=["categories"])
+    api_router.include_router(routes_licenses.router, prefix="/licenses", tags=["licenses"])
+    api_router.include_router(routes_users.router, prefix="/users", tags=["users"])
+    api_router.include_router(routes_sync.router, prefix="/sync", tags=["sync"])
+    api_router.include_router(routes_events.router, prefix="/events", tags=["events"])
+    return api_router
+
+api_router = build_api_router(get_settings().ASYNC_DB)
@@ -1,77 +1,75 @@
 from fastapi import APIRouter, Depends, HTTPException, Form
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy import select, update
 from sqlalchemy.orm import Session
 from .. import schemas, security, models
-from ..database import get_db
+from ..database import get_db, deferred_write
 from ..config import get_settings
+from ..cache import invalidate_user
 
 router = APIRouter()
 settings = get_settings()
 
-@router.post('/login', response_model=schemas.Token)
-def login(
-    form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
-):
-    """Login endpoint che accetta form data (standard OAuth2)"""
-    # Cerca utente per username o email
-    user = db.query(models.User).filter(
-        (models.User.username == form_data.username) | 
-        (models.User.email == form_data.username)
-    ).first()
-    
+def login_statement(login: str):
+    """Cerca utente per username o email"""
+    return select(models.User).where(
+        (models.User.username == login) |
+        (models.User.email == login)
+    )
+
+def check_login_user(user: models.User | None):
     if not user:
         raise HTTPException(
-            status_code=400, 
+            status_code=400,
             detail="Utente non trovato"
         )
-    
+
     if not user.is_active:
         raise HTTPException(
-            status_code=400, 
+            status_code=400,
             detail="Utente disattivato"
         )
-    
-    if not security.verify_password(form_data.password, user.password_hash):
+
+def issue_token(username: str, password_ok: bool) -> dict:
+    """Crea il token di accesso se la password è corretta"""
+    if not password_ok:
         raise HTTPException(
-            status_code=400, 
+            status_code=400,
             detail="Password non corretta"
         )
-    
+
     # Crea token
-    token = security.create_access_token(sub=user.username)
+    token = security.create_access_token(sub=username)
     return {"access_token": token, "token_type": "bearer"}
 
-@router.post('/login-json', response_model=schemas.Token)  
+def authenticate(db: Session, login: str, password: str) -> dict:
+    user = db.scalars(login_statement(login)).first()
+    check_login_user(user)
+    user_id, username, password_hash = user.id, user.username, user.password_hash
+    # Chiude la lettura prima di bcrypt: la scrittura dell'hash parte in una transazione nuova
+    db.rollback()
+    password_ok, new_hash = security.verify_and_update_password(password, password_hash)
+    if password_ok and new_hash:
+        # Costo bcrypt cambiato: salva l'hash rigenerato
+        db.execute(update(models.User).where(models.User.id == user_id).values(password_hash=new_hash))
+        db.commit()
+        invalidate_user(username)
+    return issue_token(username, password_ok)
+
+@router.post('/login', response_model=schemas.Token)
+@deferred_write
+def login(
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    db: Session = Depends(get_db)
+):
+    """Login endpoint che accetta form data (standard OAuth2)"""
+    return authenticate(db, form_data.username, form_data.password)
+
+@router.post('/login-json', response_model=schemas.Token)
+@deferred_write
 def login_json(
     login_data: schemas.LoginRequest,
     db: Session = Depends(get_db)
 ):
     """Login endpoint alternativo che accetta JSON"""
-    # Cerca utente per username o email
-    user = db.query(models.User).filter(
-        (models.User.username == login_data.username) | 
-        (models.User.email == login_data.username)
-    ).first()
-    
-    if not user:
-        raise HTTPException(
-            status_code=400, 
-            detail="Utente non trovato"
-        )
-    
-    if not user.is_active:
-        raise HTTPException(
-            status_code=400, 
-            detail="Utente disattivato"
-        )
-    
-    if not security.verify_password(login_data.password, user.password_hash):
-        raise HTTPException(
-            status_code=400, 
-            detail="Password non corretta"
-        )
-    
-    # Crea token
-    token = security.create_access_token(sub=user.username)
-    return {"access_token": token, "token_type": "bearer"}
+    return authenticate(db, login_data.username, login_data.password)
@@ -0,0 +1,40 @@
+from fastapi import APIRouter, Depends
+from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import schemas, security, models
+from ..database import get_async_db, deferred_write
+from ..cache import invalidate_user
+from .routes_auth import login_statement, check_login_user, issue_token
+
+router = APIRouter()
+
+async def authenticate(db: AsyncSession, login: str, password: str) -> dict:
+    user = (await db.scalars(login_statement(login))).first()
+    check_login_user(user)
+    user_id, username, password_hash = user.id, user.username, user.password_hash
+    await db.rollback()
+    password_ok, new_hash = await security.verify_and_update_password_async(password, password_hash)
+    if password_ok and new_hash:
+        await db.execute(update(models.User).where(models.User.id == user_id).values(password_hash=new_hash))
+        await db.commit()
+        invalidate_user(username)
+    return issue_token(username, password_ok)
+
+@router.post('/login', response_model=schemas.Token)
+@deferred_write
+async def login(
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Login endpoint che accetta form data (standard OAuth2)"""
+    return await authenticate(db, form_data.username, form_data.password)
+
+@router.post('/login-json', response_model=schemas.Token)
+@deferred_write
+async def login_json(
+    login_data: schemas.LoginRequest,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Login endpoint alternativo che accetta JSON"""
+    return await authenticate(db, login_data.username, login_data.password)
@@ -1,26 +1,49 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from .. import schemas, models
-from ..database import get_db
+from .. import schemas, models, category_summary, events
+from ..config import get_settings
+from ..database import get_db, replica_read
 from ..deps import get_current_user
+from ..models import CATEGORY_COLUMNS
+from ..response_cache import CATEGORIES, LICENSES, cached_json, invalidate, rows_json
+
+settings = get_settings()
 
 router = APIRouter()
 
+
 @router.post('/', response_model=schemas.CategoryRead)
 def create_category(data: schemas.CategoryCreate, db: Session = Depends(get_db), user=Depends(get_current_user)):
     cat = models.Category(name=data.name, icon=data.icon)
     db.add(cat)
+    db.flush()
+    events.publish(db, "created", "category", [cat.id], user)
     db.commit()
+    invalidate(CATEGORIES)
     db.refresh(cat)
     return cat
 
 @router.get('/', response_model=list[schemas.CategoryRead])
-def list_categories(db: Session = Depends(get_db), user=Depends(get_current_user)):
-    return db.query(models.Category).all()
+@replica_read
+def list_categories(request: Request, db: Session = Depends(get_db), user=Depends(get_current_user)):
+    def build():
+        rows = db.execute(select(*CATEGORY_COLUMNS)).all()
+        return rows_json(rows), {}
+    return cached_json(request, db, (CATEGORIES,), build)
+
+@router.get('/summary', response_model=list[schemas.CategorySummary])
+@replica_read
+def list_category_summaries(request: Request, db: Session = Depends(get_db), user=Depends(get_current_user)):
+    """Categorie con numero di licenze, vendor distinti e ultimo utilizzo, in una sola query"""
+    def build():
+        rows = db.execute(category_summary.summary_statement(settings.CATEGORY_SUMMARY_MATERIALIZED)).all()
+        return rows_json(rows), {}
+    return cached_json(request, db, (CATEGORIES, LICENSES), build)
 
 @router.put('/{category_id}', response_model=schemas.CategoryRead)
 def update_category(category_id: int, data: schemas.CategoryCreate, db: Session = Depends(get_db), user=Depends(get_current_user)):
-    cat = db.query(models.Category).filter(models.Category.id == category_id).first()
+    cat = db.get(models.Category, category_id)
     if not cat:
         raise HTTPException(status_code=404, detail="Category not found")
     
@@ -28,16 +51,21 @@ def update_category(category_id: int, data: schemas.CategoryCreate, db: Session
     if data.icon:
         cat.icon = data.icon
     
+    events.publish(db, "updated", "category", [cat.id], user)
     db.commit()
+    invalidate(CATEGORIES)
     db.refresh(cat)
     return cat
 
 @router.delete('/{category_id}')
 def delete_category(category_id: int, db: Session = Depends(get_db), user=Depends(get_current_user)):
-    cat = db.query(models.Category).filter(models.Category.id == category_id).first()
+    cat = db.get(models.Category, category_id)
     if not cat:
         raise HTTPException(status_code=404, detail="Category not found")
     
     db.delete(cat)
+    events.publish(db, "deleted", "category", [category_id], user)
     db.commit()
+    # Le licenze della categoria vengono eliminate in cascata
+    invalidate(CATEGORIES, LICENSES)
     return {"message": "Category deleted successfully"}
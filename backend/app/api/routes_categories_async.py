@@ -0,0 +1,69 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import schemas, models, category_summary, events
+from ..config import get_settings
+from ..database import get_async_db, replica_read
+from ..deps_async import get_current_user_async
+from ..models import CATEGORY_COLUMNS
+from ..response_cache import CATEGORIES, LICENSES, cached_json_async, invalidate_async, rows_json
+
+settings = get_settings()
+
+router = APIRouter()
+
+@router.post('/', response_model=schemas.CategoryRead)
+async def create_category(data: schemas.CategoryCreate, db: AsyncSession = Depends(get_async_db), user=Depends(get_current_user_async)):
+    cat = models.Category(name=data.name, icon=data.icon)
+    db.add(cat)
+    await db.flush()
+    events.publish(db, "created", "category", [cat.id], user)
+    await db.commit()
+    await invalidate_async(CATEGORIES)
+    await db.refresh(cat)
+    return cat
+
+@router.get('/', response_model=list[schemas.CategoryRead])
+@replica_read
+async def list_categories(request: Request, db: AsyncSession = Depends(get_async_db), user=Depends(get_current_user_async)):
+    async def build():
+        rows = (await db.execute(select(*CATEGORY_COLUMNS))).all()
+        return rows_json(rows), {}
+    return await cached_json_async(request, db, (CATEGORIES,), build)
+
+@router.get('/summary', response_model=list[schemas.CategorySummary])
+@replica_read
+async def list_category_summaries(request: Request, db: AsyncSession = Depends(get_async_db), user=Depends(get_current_user_async)):
+    """Riepilogo per categoria (vedi routes_categories.list_category_summaries)"""
+    async def build():
+        rows = (await db.execute(category_summary.summary_statement(settings.CATEGORY_SUMMARY_MATERIALIZED))).all()
+        return rows_json(rows), {}
+    return await cached_json_async(request, db, (CATEGORIES, LICENSES), build)
+
+@router.put('/{category_id}', response_model=schemas.CategoryRead)
+async def update_category(category_id: int, data: schemas.CategoryCreate, db: AsyncSession = Depends(get_async_db), user=Depends(get_current_user_async)):
+    cat = await db.get(models.Category, category_id)
+    if not cat:
+        raise HTTPException(status_code=404, detail="Category not found")
+    
+    cat.name = data.name
+    if data.icon:
+        cat.icon = data.icon
+    
+    events.publish(db, "updated", "category", [cat.id], user)
+    await db.commit()
+    await invalidate_async(CATEGORIES)
+    await db.refresh(cat)
+    return cat
+
+@router.delete('/{category_id}')
+async def delete_category(category_id: int, db: AsyncSession = Depends(get_async_db), user=Depends(get_current_user_async)):
+    cat = await db.get(models.Category, category_id)
+    if not cat:
+        raise HTTPException(status_code=404, detail="Category not found")
+    
+    await db.delete(cat)
+    events.publish(db, "deleted", "category", [category_id], user)
+    await db.commit()
+    await invalidate_async(CATEGORIES, LICENSES)
+    return {"message": "Category deleted successfully"}
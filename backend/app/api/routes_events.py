@@ -0,0 +1,29 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
+from .. import events, schemas, security
+from ..config import get_settings
+from ..deps import get_current_user, get_stream_user
+
+router = APIRouter()
+settings = get_settings()
+
+@router.post('/token', response_model=schemas.EventsToken)
+def event_stream_token(user=Depends(get_current_user)):
+    """Token breve per aprire il feed da un browser: `new EventSource('/api/v1/events/?token=...')`.
+
+    EventSource non può inviare l'header Authorization. Il token vale
+    EVENTS_TOKEN_EXPIRE_SECONDS e solo per /events: quando la connessione
+    cade dopo la scadenza, il client ne chiede uno nuovo e riapre il feed.
+    """
+    return {"token": security.create_events_token(user.username), "expires_in": settings.EVENTS_TOKEN_EXPIRE_SECONDS}
+
+@router.get('/')
+def event_stream(user=Depends(get_stream_user)):
+    """Feed Server-Sent Events delle modifiche a licenze e categorie.
+
+    Autenticazione con l'header Bearer oppure, da browser, con ?token= ottenuto
+    da POST /events/token. Eventi created, updated, deleted e used con entity e
+    ids; "resync" quando alcuni eventi sono andati persi (il client si aggiorna
+    con /sync). Nessuna sessione del database resta aperta durante lo stream.
+    """
+    return StreamingResponse(events.stream(), media_type="text/event-stream", headers=events.STREAM_HEADERS)
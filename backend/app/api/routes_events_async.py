@@ -0,0 +1,18 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
+from .. import events, schemas, security
+from ..config import get_settings
+from ..deps_async import get_current_user_async, get_stream_user_async
+
+router = APIRouter()
+settings = get_settings()
+
+@router.post('/token', response_model=schemas.EventsToken)
+async def event_stream_token(user=Depends(get_current_user_async)):
+    """Token breve per EventSource (vedi routes_events.event_stream_token)"""
+    return {"token": security.create_events_token(user.username), "expires_in": settings.EVENTS_TOKEN_EXPIRE_SECONDS}
+
+@router.get('/')
+async def event_stream(user=Depends(get_stream_user_async)):
+    """Feed Server-Sent Events delle modifiche (vedi routes_events.event_stream)"""
+    return StreamingResponse(events.stream(), media_type="text/event-stream", headers=events.STREAM_HEADERS)
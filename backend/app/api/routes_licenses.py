@@ -1,16 +1,72 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from datetime import datetime
-from .. import schemas, models, email_utils
-from ..database import get_db
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, tuple_, update
+from sqlalchemy.orm import Session, joinedload, selectinload
+from datetime import date, datetime
+import csv
+import io
+import logging
+import orjson
+from .. import schemas, models, email_utils, email_queue, bulk_import, events, search, usage
+from ..database import get_db, SessionLocal, replica_read
 from ..deps import get_current_user
+from ..models import LICENSE_COLUMNS
+from ..pagination import encode_cursor, decode_cursor
+from ..response_cache import LICENSES, cached_json, invalidate, rows_json
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Colonne ammesse per l'ordinamento (prefisso "-" per ordine decrescente)
+SORT_COLUMNS = {
+    "updated_at": models.License.updated_at,
+    "created_at": models.License.created_at,
+    "product_name": models.License.product_name,
+    "id": models.License.id,
+}
+SORT_PATTERN = r"^-?(updated_at|created_at|product_name|id)$"
+MAX_PAGE_SIZE = 500
+EXPORT_BATCH_SIZE = 1000
+# Campi di LicenseRead (models.LICENSE_COLUMNS): intestazione dell'export
+EXPORT_FIELDS = list(schemas.LicenseRead.model_fields)
+BUCKET_PATTERN = f"^({'|'.join(usage.BUCKETS)})$"
+GROUP_PATTERN = f"^({'|'.join(usage.GROUPS)})$"
+
+class LicenseFilters:
+    """Filtri lato server condivisi dagli endpoint che elencano licenze"""
+    def __init__(
+        self,
+        category_id: int | None = None,
+        vendor: str | None = None,
+        product_name: str | None = Query(None, description="Prefisso del nome prodotto"),
+        used_after: datetime | None = None,
+        used_before: datetime | None = None,
+    ):
+        self.category_id = category_id
+        self.vendor = vendor
+        self.product_name = product_name
+        self.used_after = used_after
+        self.used_before = used_before
+
+    def apply(self, query):
+        License = models.License
+        if self.category_id is not None:
+            query = query.filter(License.category_id == self.category_id)
+        if self.vendor:
+            query = query.filter(License.vendor == self.vendor)
+        if self.product_name:
+            query = query.filter(License.product_name.startswith(self.product_name, autoescape=True))
+        if self.used_after is not None:
+            query = query.filter(License.last_used_at >= self.used_after)
+        if self.used_before is not None:
+            query = query.filter(License.last_used_at < self.used_before)
+        return query
 
 @router.post('/', response_model=schemas.LicenseRead)
 def create_license(data: schemas.LicenseCreate, db: Session = Depends(get_db), user=Depends(get_current_user)):
     # Converti i dati in un dizionario e gestisci il campo iso_url
-    license_data = data.dict()
+    license_data = data.model_dump()
     
     # Se iso_url è presente e non è già una stringa, convertilo
     if license_data.get('iso_url') is not None:
@@ -18,52 +74,310 @@ def create_license(data: schemas.LicenseCreate, db: Session = Depends(get_db), u
     
     lic = models.License(**license_data)
     db.add(lic)
+    db.flush()
+    events.publish(db, "created", "license", [lic.id], user)
     db.commit()
+    invalidate(LICENSES)
     db.refresh(lic)
     return lic
 
+@router.post('/bulk', response_model=schemas.BulkImportReport)
+async def bulk_import_licenses(request: Request, db: Session = Depends(get_db), user=Depends(get_current_user)):
+    """Import massivo: array JSON oppure upload NDJSON (application/x-ndjson) o CSV (text/csv).
+
+    Le righe sono validate con LicenseCreate e inserite a blocchi; il report
+    indica per ogni riga se è stata inserita, duplicata o non valida.
+    """
+    importer = await run_in_threadpool(bulk_import.BulkImporter, db, user)
+
+    async def process_chunk(rows):
+        await run_in_threadpool(importer.process_chunk, rows)
+
+    try:
+        await bulk_import.import_request(request, process_chunk)
+    finally:
+        # I blocchi già importati sono committati anche se la richiesta si interrompe
+        invalidate(LICENSES)
+    return importer.finish()
+
+def list_statement(filters: LicenseFilters, sort: str, cursor: str | None):
+    """Costruisce la SELECT filtrata e ordinata su (colonna di ordinamento, id).
+
+    Seleziona le colonne di LicenseRead e non l'entità: righe semplici,
+    senza oggetti ORM da costruire e validare.
+    """
+    descending = sort.startswith("-")
+    column = SORT_COLUMNS[sort.lstrip("-")]
+    key = tuple_(column, models.License.id)
+
+    stmt = filters.apply(select(*LICENSE_COLUMNS))
+    if cursor:
+        value, last_id = decode_cursor(cursor, sort, column.type.python_type)
+        bound = tuple_(value, last_id)
+        stmt = stmt.where(key < bound if descending else key > bound)
+    if descending:
+        return stmt.order_by(column.desc(), models.License.id.desc())
+    return stmt.order_by(column.asc(), models.License.id.asc())
+
+def set_next_cursor(headers, rows: list, limit: int, sort: str) -> list:
+    """Tronca la pagina a `limit` righe e imposta X-Next-Cursor se ci sono altri risultati"""
+    if len(rows) <= limit:
+        return rows
+    rows = rows[:limit]
+    last = rows[-1]
+    headers["X-Next-Cursor"] = encode_cursor(getattr(last, sort.lstrip("-")), last.id, sort)
+    return rows
+
 @router.get('/', response_model=list[schemas.LicenseRead])
-def list_licenses(db: Session = Depends(get_db), user=Depends(get_current_user)):
-    return db.query(models.License).all()
+@replica_read
+def list_licenses(
+    request: Request,
+    filters: LicenseFilters = Depends(),
+    sort: str = Query("-updated_at", pattern=SORT_PATTERN),
+    limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    db: Session = Depends(get_db),
+    user=Depends(get_current_user),
+):
+    """Elenco licenze con filtri e paginazione keyset su (colonna di ordinamento, id).
+
+    Senza `limit` restituisce tutte le licenze filtrate; con `limit` restituisce
+    una pagina e, se ci sono altri risultati, il cursore della pagina successiva
+    nell'header `X-Next-Cursor`. Le risposte hanno un ETag e vengono riusate
+    finché le licenze non cambiano (vedi response_cache).
+    """
+    def build():
+        stmt = list_statement(filters, sort, cursor)
+        headers = {}
+        if limit is None:
+            rows = db.execute(stmt).all()
+        else:
+            rows = set_next_cursor(headers, db.execute(stmt.limit(limit + 1)).all(), limit, sort)
+        return rows_json(rows), headers
+    return cached_json(request, db, (LICENSES,), build)
+
+@router.get('/search', response_model=list[schemas.LicenseSearchHit])
+@replica_read
+def search_licenses(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    mode: str = Query("full", pattern="^(full|prefix)$"),
+    fuzzy: bool = True,
+    category_id: int | None = None,
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    db: Session = Depends(get_db),
+    user=Depends(get_current_user),
+):
+    """Ricerca per rilevanza su prodotto, vendor, edizione e versione.
+
+    `mode=prefix` tratta ogni termine come prefisso (typeahead); con `fuzzy`
+    vengono trovati anche termini simili (errori di battitura). Il cursore
+    della pagina successiva è nell'header `X-Next-Cursor`.
+    """
+    results, next_cursor = search.search_licenses(db, q, mode == "prefix", fuzzy, category_id, limit, cursor)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return results
+
+class UsageFilters:
+    """Parametri delle statistiche di utilizzo"""
+    def __init__(
+        self,
+        bucket: str = Query("day", pattern=BUCKET_PATTERN),
+        group: str = Query("license", pattern=GROUP_PATTERN),
+        since: date | None = None,
+        until: date | None = Query(None, description="Ultimo giorno incluso"),
+        license_id: int | None = None,
+        category_id: int | None = None,
+    ):
+        self.bucket = bucket
+        self.group = group
+        self.since = since
+        self.until = until
+        self.license_id = license_id
+        self.category_id = category_id
+
+    def statement(self, dialect: str):
+        return usage.usage_statement(
+            dialect, self.bucket, self.group, self.since, self.until, self.license_id, self.category_id
+        )
+
+    def report(self, rows) -> bytes:
+        return schemas.UsageReport(bucket=self.bucket, group=self.group, rows=usage.usage_rows(rows)).model_dump_json().encode()
+
+@router.get('/usage', response_model=schemas.UsageReport)
+def license_usage(
+    request: Request,
+    filters: UsageFilters = Depends(),
+    db: Session = Depends(get_db),
+    user=Depends(get_current_user),
+):
+    """Utilizzi per licenza o categoria, raggruppati per giorno, settimana (da lunedì) o mese.
+
+    Letti dai rollup giornalieri; la cache segue le licenze perché ogni uso
+    le invalida.
+    """
+    def build():
+        rows = db.execute(filters.statement(db.get_bind().dialect.name)).all()
+        return filters.report(rows), {}
+    return cached_json(request, db, (LICENSES,), build)
+
+def _export_rows(filters: LicenseFilters):
+    """Legge le licenze a blocchi con un cursore lato server.
+
+    La sessione è aperta qui e non tramite get_db perché il generatore viene
+    consumato dopo la chiusura delle dipendenze della richiesta.
+    """
+    db = SessionLocal()
+    try:
+        stmt = (
+            filters.apply(select(*LICENSE_COLUMNS))
+            .order_by(models.License.id)
+            .execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        batch = []
+        for row in db.execute(stmt):
+            batch.append(row)
+            if len(batch) == EXPORT_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        db.close()
+
+def export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def _ndjson_stream(filters: LicenseFilters):
+    for batch in _export_rows(filters):
+        yield b"".join(orjson.dumps(row._asdict()) + b"\n" for row in batch)
+
+def _csv_stream(filters: LicenseFilters):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    yield buffer.getvalue()
+    for batch in _export_rows(filters):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([export_value(v) for v in row] for row in batch)
+        yield buffer.getvalue()
+
+@router.get('/export')
+def export_licenses(
+    filters: LicenseFilters = Depends(),
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    user=Depends(get_current_user),
+):
+    """Esporta in streaming l'inventario licenze in formato NDJSON o CSV"""
+    if format == "csv":
+        stream, media_type = _csv_stream(filters), "text/csv; charset=utf-8"
+    else:
+        stream, media_type = _ndjson_stream(filters), "application/x-ndjson"
+    return StreamingResponse(
+        stream,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="licenses.{format}"'},
+    )
+
+def license_email_data(lic: models.License, req: schemas.LicenseUseRequest | schemas.LicenseBatchUseRequest | None) -> dict:
+    """Dati per l'email di notifica; richiede lic.category già caricata"""
+    return {
+        'product_name': lic.product_name,
+        'version': lic.version or 'N/A',
+        'vendor': lic.vendor or 'N/A', 
+        'category_name': lic.category.name if lic.category else 'N/A',
+        'iso_download': req.iso_download if req else False
+    }
+
+def batch_use_statement(ids: list[int]):
+    """Un solo UPDATE ... RETURNING per più licenze, con le categorie già caricate"""
+    return (
+        update(models.License)
+        .where(models.License.id.in_(ids))
+        .values(last_used_at=datetime.utcnow())
+        .returning(models.License)
+        .options(selectinload(models.License.category))
+        .execution_options(synchronize_session=False)
+    )
+
+def batch_use_result(ids: list[int], licenses) -> schemas.LicenseBatchUseResult:
+    """Risultato nell'ordine richiesto; va costruito prima del commit, che scade gli oggetti"""
+    found = {lic.id: lic for lic in licenses}
+    return schemas.LicenseBatchUseResult(
+        licenses=[schemas.LicenseRead.model_validate(found[i], from_attributes=True) for i in ids if i in found],
+        missing=[i for i in ids if i not in found],
+    )
+
+def commit_use(db: Session, outbox: models.EmailOutbox | None):
+    """Commit dell'uso licenze e notifica del messaggio accodato al dispatcher email.
+
+    L'id della outbox viene letto dopo il flush: dopo il commit l'oggetto è
+    scaduto e leggerlo costerebbe un'altra SELECT.
+    """
+    db.flush()
+    outbox_id = outbox.id if outbox is not None else None
+    db.commit()
+    invalidate(LICENSES)
+    if outbox_id is not None:
+        email_queue.dispatcher.notify(outbox_id)
+
+@router.post('/use', response_model=schemas.LicenseBatchUseResult)
+def use_licenses(req: schemas.LicenseBatchUseRequest, db: Session = Depends(get_db), user=Depends(get_current_user)):
+    """Uso di più licenze insieme (es. deploy di un'immagine): un'unica email riepilogativa"""
+    ids = list(dict.fromkeys(req.ids))
+    licenses = db.scalars(batch_use_statement(ids)).all()
+    result = batch_use_result(ids, licenses)
+
+    outbox = None
+    if licenses:
+        try:
+            outbox = email_utils.queue_license_digest_email(db, [license_email_data(lic, req) for lic in licenses], user)
+        except Exception as e:
+            logger.warning("Impossibile accodare email notifica: %s", e)
+
+    usage.record_usage(db, licenses, user.id, req.iso_download)
+    events.publish(db, "used", "license", [lic.id for lic in licenses], user)
+    commit_use(db, outbox)
+    return result
 
 @router.post('/{license_id}/use', response_model=schemas.LicenseRead)
 def use_license(license_id: int, req: schemas.LicenseUseRequest, db: Session = Depends(get_db), user=Depends(get_current_user)):
-    lic = db.query(models.License).filter(models.License.id == license_id).first()
+    # La categoria serve per l'email: caricata nella stessa query
+    lic = db.get(models.License, license_id, options=[joinedload(models.License.category)])
     if not lic:
         raise HTTPException(status_code=404, detail="License not found")
     
     # Aggiorna timestamp utilizzo
     lic.last_used_at = datetime.utcnow()
-    db.commit()
-    db.refresh(lic)
     
-    # Prepara i dati per l'email (opzionale)
+    # Accoda l'email di notifica (opzionale): viene salvata nella stessa
+    # transazione e inviata in background, senza attendere il server SMTP
+    outbox = None
     try:
-        license_data = {
-            'product_name': lic.product_name,
-            'version': lic.version or 'N/A',
-            'vendor': lic.vendor or 'N/A', 
-            'category_name': lic.category.name if lic.category else 'N/A',
-            'iso_download': req.iso_download if req else False
-        }
-        
-        # Invia email solo se configurata (non blocca se fallisce)
-        email_utils.send_license_email(license_data, user)
+        outbox = email_utils.queue_license_email(db, license_email_data(lic, req), user)
     except Exception as e:
         # Log dell'errore ma continua l'operazione
-        print(f"Avviso: impossibile inviare email notifica: {e}")
+        logger.warning("Impossibile accodare email notifica: %s", e)
         # Non sollevare eccezione per non bloccare l'uso della licenza
     
-    return lic
+    usage.record_usage(db, [lic], user.id, req.iso_download)
+    events.publish(db, "used", "license", [lic.id], user)
+    db.flush()
+    result = schemas.LicenseRead.model_validate(lic, from_attributes=True)
+    commit_use(db, outbox)
+    return result
 
 @router.put('/{license_id}', response_model=schemas.LicenseRead)
 def update_license(license_id: int, data: schemas.LicenseUpdate, db: Session = Depends(get_db), user=Depends(get_current_user)):
-    lic = db.query(models.License).filter(models.License.id == license_id).first()
+    lic = db.get(models.License, license_id)
     if not lic:
         raise HTTPException(status_code=404, detail="License not found")
     
     # Aggiorna solo i campi forniti
-    update_data = data.dict(exclude_unset=True)
+    update_data = data.model_dump(exclude_unset=True)
     
     # Converti iso_url in stringa se presente
     if 'iso_url' in update_data and update_data['iso_url'] is not None:
@@ -72,16 +386,20 @@ def update_license(license_id: int, data: schemas.LicenseUpdate, db: Session = D
     for field, value in update_data.items():
         setattr(lic, field, value)
     
+    events.publish(db, "updated", "license", [lic.id], user)
     db.commit()
+    invalidate(LICENSES)
     db.refresh(lic)
     return lic
 
 @router.delete('/{license_id}')
 def delete_license(license_id: int, db: Session = Depends(get_db), user=Depends(get_current_user)):
-    lic = db.query(models.License).filter(models.License.id == license_id).first()
+    lic = db.get(models.License, license_id)
     if not lic:
         raise HTTPException(status_code=404, detail="License not found")
     
     db.delete(lic)
+    events.publish(db, "deleted", "license", [license_id], user)
     db.commit()
+    invalidate(LICENSES)
     return {"message": "License deleted successfully"}
@@ -0,0 +1,227 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from datetime import datetime
+import csv
+import io
+import logging
+import orjson
+from .. import schemas, models, email_utils, email_queue, bulk_import, events, search, usage
+from ..database import get_async_db, AsyncSessionLocal, replica_read
+from ..deps_async import get_current_user_async
+from ..models import LICENSE_COLUMNS
+from ..response_cache import LICENSES, cached_json_async, invalidate_async, rows_json
+from .routes_licenses import (
+    LicenseFilters, SORT_PATTERN, MAX_PAGE_SIZE, EXPORT_BATCH_SIZE, EXPORT_FIELDS,
+    list_statement, set_next_cursor, license_email_data, export_value,
+    batch_use_statement, batch_use_result, UsageFilters,
+)
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+@router.post('/', response_model=schemas.LicenseRead)
+async def create_license(data: schemas.LicenseCreate, db: AsyncSession = Depends(get_async_db), user=Depends(get_current_user_async)):
+    license_data = data.model_dump()
+    if license_data.get('iso_url') is not None:
+        license_data['iso_url'] = str(license_data['iso_url'])
+    
+    lic = models.License(**license_data)
+    db.add(lic)
+    await db.flush()
+    events.publish(db, "created", "license", [lic.id], user)
+    await db.commit()
+    await invalidate_async(LICENSES)
+    await db.refresh(lic)
+    return lic
+
+@router.post('/bulk', response_model=schemas.BulkImportReport)
+async def bulk_import_licenses(request: Request, db: AsyncSession = Depends(get_async_db), user=Depends(get_current_user_async)):
+    """Import massivo: array JSON oppure upload NDJSON (application/x-ndjson) o CSV (text/csv)"""
+    importer = await db.run_sync(bulk_import.BulkImporter, user)
+
+    async def process_chunk(rows):
+        await db.run_sync(lambda _: importer.process_chunk(rows))
+
+    try:
+        await bulk_import.import_request(request, process_chunk)
+    finally:
+        await invalidate_async(LICENSES)
+    return importer.finish()
+
+@router.get('/', response_model=list[schemas.LicenseRead])
+@replica_read
+async def list_licenses(
+    request: Request,
+    filters: LicenseFilters = Depends(),
+    sort: str = Query("-updated_at", pattern=SORT_PATTERN),
+    limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    db: AsyncSession = Depends(get_async_db),
+    user=Depends(get_current_user_async),
+):
+    """Elenco licenze con filtri e paginazione keyset (vedi routes_licenses.list_licenses)"""
+    async def build():
+        stmt = list_statement(filters, sort, cursor)
+        headers = {}
+        if limit is None:
+            rows = (await db.execute(stmt)).all()
+        else:
+            rows = set_next_cursor(headers, (await db.execute(stmt.limit(limit + 1))).all(), limit, sort)
+        return rows_json(rows), headers
+    return await cached_json_async(request, db, (LICENSES,), build)
+
+@router.get('/search', response_model=list[schemas.LicenseSearchHit])
+@replica_read
+async def search_licenses(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    mode: str = Query("full", pattern="^(full|prefix)$"),
+    fuzzy: bool = True,
+    category_id: int | None = None,
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    db: AsyncSession = Depends(get_async_db),
+    user=Depends(get_current_user_async),
+):
+    """Ricerca per rilevanza (vedi routes_licenses.search_licenses)"""
+    results, next_cursor = await db.run_sync(
+        lambda session: search.search_licenses(session, q, mode == "prefix", fuzzy, category_id, limit, cursor)
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return results
+
+@router.get('/usage', response_model=schemas.UsageReport)
+async def license_usage(
+    request: Request,
+    filters: UsageFilters = Depends(),
+    db: AsyncSession = Depends(get_async_db),
+    user=Depends(get_current_user_async),
+):
+    """Utilizzi per periodo dai rollup giornalieri (vedi routes_licenses.license_usage)"""
+    async def build():
+        rows = (await db.execute(filters.statement(db.bind.dialect.name))).all()
+        return filters.report(rows), {}
+    return await cached_json_async(request, db, (LICENSES,), build)
+
+async def _export_rows(filters: LicenseFilters):
+    """Legge le licenze a blocchi in streaming dal driver asincrono"""
+    async with AsyncSessionLocal() as db:
+        stmt = filters.apply(select(*LICENSE_COLUMNS)).order_by(models.License.id)
+        result = await db.stream(stmt.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        async for batch in result.partitions():
+            yield batch
+
+async def _ndjson_stream(filters: LicenseFilters):
+    async for batch in _export_rows(filters):
+        yield b"".join(orjson.dumps(row._asdict()) + b"\n" for row in batch)
+
+async def _csv_stream(filters: LicenseFilters):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    yield buffer.getvalue()
+    async for batch in _export_rows(filters):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([export_value(v) for v in row] for row in batch)
+        yield buffer.getvalue()
+
+@router.get('/export')
+async def export_licenses(
+    filters: LicenseFilters = Depends(),
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    user=Depends(get_current_user_async),
+):
+    """Esporta in streaming l'inventario licenze in formato NDJSON o CSV"""
+    if format == "csv":
+        stream, media_type = _csv_stream(filters), "text/csv; charset=utf-8"
+    else:
+        stream, media_type = _ndjson_stream(filters), "application/x-ndjson"
+    return StreamingResponse(
+        stream,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="licenses.{format}"'},
+    )
+
+@router.post('/use', response_model=schemas.LicenseBatchUseResult)
+async def use_licenses(req: schemas.LicenseBatchUseRequest, db: AsyncSession = Depends(get_async_db), user=Depends(get_current_user_async)):
+    """Uso di più licenze insieme (vedi routes_licenses.use_licenses)"""
+    ids = list(dict.fromkeys(req.ids))
+    licenses = (await db.scalars(batch_use_statement(ids))).all()
+    result = batch_use_result(ids, licenses)
+
+    outbox = None
+    if licenses:
+        try:
+            outbox = email_utils.queue_license_digest_email(db, [license_email_data(lic, req) for lic in licenses], user)
+        except Exception as e:
+            logger.warning("Impossibile accodare email notifica: %s", e)
+
+    await db.run_sync(usage.record_usage, licenses, user.id, req.iso_download)
+    events.publish(db, "used", "license", [lic.id for lic in licenses], user)
+    await db.commit()
+    await invalidate_async(LICENSES)
+    if outbox is not None:
+        email_queue.dispatcher.notify(outbox.id)
+    return result
+
+@router.post('/{license_id}/use', response_model=schemas.LicenseRead)
+async def use_license(license_id: int, req: schemas.LicenseUseRequest, db: AsyncSession = Depends(get_async_db), user=Depends(get_current_user_async)):
+    # La categoria serve per l'email: caricata subito, niente lazy load in async
+    lic = await db.get(models.License, license_id, options=[joinedload(models.License.category)])
+    if not lic:
+        raise HTTPException(status_code=404, detail="License not found")
+    
+    lic.last_used_at = datetime.utcnow()
+    
+    outbox = None
+    try:
+        outbox = email_utils.queue_license_email(db, license_email_data(lic, req), user)
+    except Exception as e:
+        logger.warning("Impossibile accodare email notifica: %s", e)
+    
+    await db.run_sync(usage.record_usage, [lic], user.id, req.iso_download)
+    events.publish(db, "used", "license", [lic.id], user)
+    # Risposta costruita prima del commit, come nella versione sincrona
+    await db.flush()
+    result = schemas.LicenseRead.model_validate(lic, from_attributes=True)
+    await db.commit()
+    await invalidate_async(LICENSES)
+    if outbox is not None:
+        email_queue.dispatcher.notify(outbox.id)
+    return result
+
+@router.put('/{license_id}', response_model=schemas.LicenseRead)
+async def update_license(license_id: int, data: schemas.LicenseUpdate, db: AsyncSession = Depends(get_async_db), user=Depends(get_current_user_async)):
+    lic = await db.get(models.License, license_id)
+    if not lic:
+        raise HTTPException(status_code=404, detail="License not found")
+    
+    update_data = data.model_dump(exclude_unset=True)
+    if 'iso_url' in update_data and update_data['iso_url'] is not None:
+        update_data['iso_url'] = str(update_data['iso_url'])
+    
+    for field, value in update_data.items():
+        setattr(lic, field, value)
+    
+    events.publish(db, "updated", "license", [lic.id], user)
+    await db.commit()
+    await invalidate_async(LICENSES)
+    await db.refresh(lic)
+    return lic
+
+@router.delete('/{license_id}')
+async def delete_license(license_id: int, db: AsyncSession = Depends(get_async_db), user=Depends(get_current_user_async)):
+    lic = await db.get(models.License, license_id)
+    if not lic:
+        raise HTTPException(status_code=404, detail="License not found")
+    
+    await db.delete(lic)
+    events.publish(db, "deleted", "license", [license_id], user)
+    await db.commit()
+    await invalidate_async(LICENSES)
+    return {"message": "License deleted successfully"}
@@ -0,0 +1,23 @@
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.orm import Session
+from .. import schemas, sync
+from ..database import get_db
+from ..deps import get_current_user
+
+router = APIRouter()
+
+@router.get('/', response_model=schemas.SyncChanges)
+def sync_changes(
+    since: str | None = Query(None, description="Token restituito dalla sincronizzazione precedente"),
+    limit: int = Query(1000, ge=1, le=sync.MAX_SYNC_PAGE),
+    db: Session = Depends(get_db),
+    user=Depends(get_current_user),
+):
+    """Licenze e categorie create, modificate o eliminate dopo il token `since`.
+
+    Senza `since` (o con un token troppo vecchio) restituisce tutto
+    l'inventario con `reset=true`. Finché `has_more` è vero va richiamato
+    subito con il nuovo token.
+    """
+    return ORJSONResponse(sync.changes(db, since, limit))
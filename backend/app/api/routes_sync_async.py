@@ -0,0 +1,18 @@
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import schemas, sync
+from ..database import get_async_db
+from ..deps_async import get_current_user_async
+
+router = APIRouter()
+
+@router.get('/', response_model=schemas.SyncChanges)
+async def sync_changes(
+    since: str | None = Query(None, description="Token restituito dalla sincronizzazione precedente"),
+    limit: int = Query(1000, ge=1, le=sync.MAX_SYNC_PAGE),
+    db: AsyncSession = Depends(get_async_db),
+    user=Depends(get_current_user_async),
+):
+    """Modifiche successive al token (vedi routes_sync.sync_changes)"""
+    return ORJSONResponse(await db.run_sync(sync.changes, since, limit))
@@ -1,31 +1,75 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from .. import models, schemas
-from ..database import get_db
-from ..deps import get_current_user
+from ..database import get_db, replica_read, deferred_write, begin_write
+from ..deps import get_current_user, get_current_db_user
+from ..cache import invalidate_user
 from ..security import get_password_hash, verify_password
 
 router = APIRouter()
 
+def user_conflict_statement(column, value, user_id: int):
+    """SELECT di un altro utente che usa già `value` nella colonna indicata"""
+    return select(models.User).where(column == value, models.User.id != user_id)
+
+def apply_profile_update(current_user: models.User, user_update: schemas.UserUpdate, password_hash: str | None = None):
+    """Aggiorna i campi del profilo se forniti; `password_hash` è l'hash già calcolato della nuova password"""
+    if user_update.username:
+        current_user.username = user_update.username
+    if user_update.email:
+        current_user.email = user_update.email
+    if user_update.full_name:
+        current_user.full_name = user_update.full_name
+    if password_hash:
+        current_user.password_hash = password_hash
+    if user_update.is_active is not None:
+        current_user.is_active = user_update.is_active
+
+def apply_smtp_update(current_user: models.User, smtp_update: schemas.UserSMTPUpdate):
+    """Aggiorna i campi SMTP se forniti"""
+    if smtp_update.smtp_host is not None:
+        current_user.smtp_host = smtp_update.smtp_host
+    if smtp_update.smtp_port is not None:
+        current_user.smtp_port = smtp_update.smtp_port
+    if smtp_update.smtp_username is not None:
+        current_user.smtp_username = smtp_update.smtp_username
+    if smtp_update.smtp_password is not None:
+        current_user.smtp_password = smtp_update.smtp_password
+    if smtp_update.smtp_from is not None:
+        current_user.smtp_from = smtp_update.smtp_from
+    if smtp_update.smtp_use_tls is not None:
+        current_user.smtp_use_tls = smtp_update.smtp_use_tls
+
+def reset_smtp_fields(current_user: models.User):
+    current_user.smtp_host = None
+    current_user.smtp_port = None
+    current_user.smtp_username = None
+    current_user.smtp_password = None
+    current_user.smtp_from = None
+    current_user.smtp_use_tls = True
+
 @router.get("/me", response_model=schemas.UserRead)
+@replica_read
 def get_current_user_profile(current_user: models.User = Depends(get_current_user)):
     """Get current user profile"""
     return current_user
 
 @router.put("/me", response_model=schemas.UserRead)
+@deferred_write
 def update_current_user_profile(
     user_update: schemas.UserUpdate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: models.User = Depends(get_current_db_user)
 ):
     """Update current user profile"""
+    # bcrypt prima di prendere il lock di scrittura
+    password_hash = get_password_hash(user_update.password) if user_update.password else None
+    begin_write(db)
+
     # Verifica se lo username è già in uso da un altro utente
     if user_update.username and user_update.username != current_user.username:
-        existing_user = db.query(models.User).filter(
-            models.User.username == user_update.username,
-            models.User.id != current_user.id
-        ).first()
-        if existing_user:
+        if db.scalars(user_conflict_statement(models.User.username, user_update.username, current_user.id)).first():
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Username già in uso"
@@ -33,37 +77,26 @@ def update_current_user_profile(
     
     # Verifica se l'email è già in uso da un altro utente
     if user_update.email and user_update.email != current_user.email:
-        existing_user = db.query(models.User).filter(
-            models.User.email == user_update.email,
-            models.User.id != current_user.id
-        ).first()
-        if existing_user:
+        if db.scalars(user_conflict_statement(models.User.email, user_update.email, current_user.id)).first():
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Email già in uso"
             )
     
-    # Aggiorna i campi se forniti
-    if user_update.username:
-        current_user.username = user_update.username
-    if user_update.email:
-        current_user.email = user_update.email
-    if user_update.full_name:
-        current_user.full_name = user_update.full_name
-    if user_update.password:
-        current_user.password_hash = get_password_hash(user_update.password)
-    if user_update.is_active is not None:
-        current_user.is_active = user_update.is_active
+    previous_username = current_user.username
+    apply_profile_update(current_user, user_update, password_hash)
     
     db.commit()
     db.refresh(current_user)
+    invalidate_user(previous_username, current_user.username)
     return current_user
 
 @router.post("/change-password")
+@deferred_write
 def change_password(
     password_request: schemas.ChangePasswordRequest,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: models.User = Depends(get_current_db_user)
 ):
     """Change user password"""
     # Verifica la password attuale
@@ -73,9 +106,13 @@ def change_password(
             detail="Password attuale non corretta"
         )
     
-    # Aggiorna la password
-    current_user.password_hash = get_password_hash(password_request.new_password)
+    # Aggiorna la password: l'hash è calcolato prima di prendere il lock di scrittura
+    password_hash = get_password_hash(password_request.new_password)
+    username = current_user.username
+    begin_write(db)
+    current_user.password_hash = password_hash
     db.commit()
+    invalidate_user(username)
     
     return {"message": "Password aggiornata con successo"}
 
@@ -95,42 +132,27 @@ def get_smtp_settings(current_user: models.User = Depends(get_current_user)):
 def update_smtp_settings(
     smtp_update: schemas.UserSMTPUpdate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: models.User = Depends(get_current_db_user)
 ):
     """Update current user SMTP settings"""
-    # Aggiorna i campi SMTP se forniti
-    if smtp_update.smtp_host is not None:
-        current_user.smtp_host = smtp_update.smtp_host
-    if smtp_update.smtp_port is not None:
-        current_user.smtp_port = smtp_update.smtp_port
-    if smtp_update.smtp_username is not None:
-        current_user.smtp_username = smtp_update.smtp_username
-    if smtp_update.smtp_password is not None:
-        current_user.smtp_password = smtp_update.smtp_password
-    if smtp_update.smtp_from is not None:
-        current_user.smtp_from = smtp_update.smtp_from
-    if smtp_update.smtp_use_tls is not None:
-        current_user.smtp_use_tls = smtp_update.smtp_use_tls
+    apply_smtp_update(current_user, smtp_update)
     
     db.commit()
     db.refresh(current_user)
+    invalidate_user(current_user.username)
     
     return {"message": "Impostazioni SMTP aggiornate con successo"}
 
 @router.delete("/me/smtp")
 def reset_smtp_settings(
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: models.User = Depends(get_current_db_user)
 ):
     """Reset SMTP settings to default (use system settings)"""
-    current_user.smtp_host = None
-    current_user.smtp_port = None
-    current_user.smtp_username = None
-    current_user.smtp_password = None
-    current_user.smtp_from = None
-    current_user.smtp_use_tls = True
+    reset_smtp_fields(current_user)
     
     db.commit()
+    invalidate_user(current_user.username)
     
     return {"message": "Impostazioni SMTP resettate alle impostazioni di sistema"}
 
@@ -0,0 +1,116 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import models, schemas
+from ..database import get_async_db, replica_read, deferred_write, begin_write
+from ..deps_async import get_current_user_async, get_current_db_user_async
+from ..cache import invalidate_user
+from ..security import get_password_hash_async, verify_password_async
+from . import routes_users
+from .routes_users import user_conflict_statement, apply_profile_update, apply_smtp_update, reset_smtp_fields
+
+router = APIRouter()
+
+@router.get("/me", response_model=schemas.UserRead)
+@replica_read
+async def get_current_user_profile(current_user: models.User = Depends(get_current_user_async)):
+    """Get current user profile"""
+    return current_user
+
+@router.put("/me", response_model=schemas.UserRead)
+@deferred_write
+async def update_current_user_profile(
+    user_update: schemas.UserUpdate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(get_current_db_user_async)
+):
+    """Update current user profile"""
+    password_hash = await get_password_hash_async(user_update.password) if user_update.password else None
+    await db.run_sync(begin_write)
+    await db.refresh(current_user)
+
+    if user_update.username and user_update.username != current_user.username:
+        if (await db.scalars(user_conflict_statement(models.User.username, user_update.username, current_user.id))).first():
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Username già in uso"
+            )
+    
+    if user_update.email and user_update.email != current_user.email:
+        if (await db.scalars(user_conflict_statement(models.User.email, user_update.email, current_user.id))).first():
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Email già in uso"
+            )
+    
+    previous_username = current_user.username
+    apply_profile_update(current_user, user_update, password_hash)
+    
+    await db.commit()
+    await db.refresh(current_user)
+    invalidate_user(previous_username, current_user.username)
+    return current_user
+
+@router.post("/change-password")
+@deferred_write
+async def change_password(
+    password_request: schemas.ChangePasswordRequest,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(get_current_db_user_async)
+):
+    """Change user password"""
+    if not await verify_password_async(password_request.current_password, current_user.password_hash):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Password attuale non corretta"
+        )
+    
+    password_hash = await get_password_hash_async(password_request.new_password)
+    username = current_user.username
+    await db.run_sync(begin_write)
+    current_user.password_hash = password_hash
+    await db.commit()
+    invalidate_user(username)
+    
+    return {"message": "Password aggiornata con successo"}
+
+@router.get("/me/smtp", response_model=schemas.SMTPSettings)
+async def get_smtp_settings(current_user: models.User = Depends(get_current_user_async)):
+    """Get current user SMTP settings"""
+    return routes_users.get_smtp_settings(current_user)
+
+@router.put("/me/smtp")
+async def update_smtp_settings(
+    smtp_update: schemas.UserSMTPUpdate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(get_current_db_user_async)
+):
+    """Update current user SMTP settings"""
+    apply_smtp_update(current_user, smtp_update)
+    
+    await db.commit()
+    invalidate_user(current_user.username)
+    
+    return {"message": "Impostazioni SMTP aggiornate con successo"}
+
+@router.delete("/me/smtp")
+async def reset_smtp_settings(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(get_current_db_user_async)
+):
+    """Reset SMTP settings to default (use system settings)"""
+    reset_smtp_fields(current_user)
+    
+    await db.commit()
+    invalidate_user(current_user.username)
+    
+    return {"message": "Impostazioni SMTP resettate alle impostazioni di sistema"}
+
+@router.post("/me/smtp/test")
+async def test_smtp_connection(
+    smtp_test: schemas.UserSMTPUpdate,
+    current_user: models.User = Depends(get_current_user_async)
+):
+    """Test SMTP connection with provided settings without sending email"""
+    # smtplib è bloccante: il test gira nel threadpool
+    return await run_in_threadpool(routes_users.test_smtp_connection, smtp_test, current_user)
@@ -0,0 +1,210 @@
+"""
+Import massivo di licenze: validazione a blocchi e INSERT multi-riga
+con ON CONFLICT (license_key) DO NOTHING
+"""
+import codecs
+import csv
+import json
+from collections import deque
+from fastapi import HTTPException, Request
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+from . import events, models, schemas
+from .database import upsert_insert
+
+CHUNK_SIZE = 1000
+
+class BulkImporter:
+    """Accumula il report di un import elaborando le righe a blocchi"""
+
+    def __init__(self, db: Session, user=None):
+        self.db = db
+        self.user = user
+        self.report = schemas.BulkImportReport()
+        self.seen_keys: set[str] = set()
+        self.category_ids = set(db.scalars(select(models.Category.id)))
+        # Nessuna transazione aperta mentre si legge l'upload: con SQLite terrebbe il
+        # lock di scrittura (BEGIN IMMEDIATE) finché il client non ha inviato il primo blocco
+        db.rollback()
+        self.row_number = 0
+
+    def _add(self, row: int, status: str, **kwargs):
+        self.report.rows.append(schemas.BulkImportRow(row=row, status=status, **kwargs))
+        if status == "inserted":
+            self.report.inserted += 1
+        elif status == "duplicate":
+            self.report.duplicates += 1
+        else:
+            self.report.invalid += 1
+
+    def process_chunk(self, raw_rows: list):
+        """Valida un blocco di righe e inserisce quelle valide con un'unica transazione"""
+        pending = []  # (numero riga, dati validati)
+        for raw in raw_rows:
+            self.row_number += 1
+            row = self.row_number
+            if not isinstance(raw, dict):
+                self._add(row, "invalid", errors=["Riga non valida: atteso un oggetto"])
+                continue
+            try:
+                data = schemas.LicenseCreate.model_validate(raw).model_dump()
+            except ValidationError as e:
+                errors = [f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()]
+                key = raw.get("license_key")
+                self._add(row, "invalid", license_key=key if isinstance(key, str) else None, errors=errors)
+                continue
+            if data["category_id"] not in self.category_ids:
+                self._add(row, "invalid", license_key=data["license_key"], errors=["category_id: Category not found"])
+                continue
+            if data["license_key"] in self.seen_keys:
+                self._add(row, "duplicate", license_key=data["license_key"])
+                continue
+            self.seen_keys.add(data["license_key"])
+            pending.append((row, data))
+
+        if not pending:
+            return
+        inserted = self._insert([data for _, data in pending])
+        for row, data in pending:
+            key = data["license_key"]
+            if key in inserted:
+                self._add(row, "inserted", id=inserted[key], license_key=key)
+            else:
+                self._add(row, "duplicate", license_key=key)
+
+    def finish(self) -> schemas.BulkImportReport:
+        self.report.rows.sort(key=lambda r: r.row)
+        return self.report
+
+    def _insert(self, rows: list[dict]) -> dict[str, int]:
+        """Esegue l'INSERT multi-riga e restituisce {license_key: id} delle righe inserite"""
+        License = models.License
+        dialect_insert = upsert_insert(self.db)
+        if dialect_insert is not None:
+            stmt = dialect_insert(License).on_conflict_do_nothing(index_elements=[License.license_key])
+        else:
+            existing = set(self.db.scalars(
+                select(License.license_key).where(License.license_key.in_([r["license_key"] for r in rows]))
+            ))
+            rows = [r for r in rows if r["license_key"] not in existing]
+            stmt = insert(License)
+        if not rows:
+            return {}
+        result = self.db.execute(stmt.values(rows).returning(License.license_key, License.id))
+        inserted = {key: id_ for key, id_ in result}
+        events.publish(self.db, "created", "license", list(inserted.values()), self.user)
+        self.db.commit()
+        return inserted
+
+def _parse_ndjson(lines: list[str]) -> list:
+    rows = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            rows.append(json.loads(line))
+        except ValueError:
+            rows.append(None)  # segnalata come riga non valida
+    return rows
+
+def _parse_csv(rows: list[list[str]], header: list[str]) -> list[dict]:
+    # Le celle vuote diventano None così i campi opzionali restano non impostati
+    return [{k: (v if v != "" else None) for k, v in zip(header, values)} for values in rows]
+
+async def _line_batches(stream):
+    """Righe complete del corpo della richiesta, una lista per ogni blocco letto in streaming"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for data in stream:
+        pending += decoder.decode(data)
+        *complete, pending = pending.split("\n")
+        if complete:
+            yield complete
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield [pending]
+
+async def _line_chunks(stream, size: int):
+    """Raggruppa in blocchi di `size` righe il corpo della richiesta letto in streaming"""
+    lines: list[str] = []
+    async for batch in _line_batches(stream):
+        lines.extend(batch)
+        while len(lines) >= size:
+            yield lines[:size]
+            lines = lines[size:]
+    if lines:
+        yield lines
+
+class _RecordFeed:
+    """Sorgente di un csv.reader riempita man mano con record completi"""
+
+    def __init__(self):
+        self.records: deque[str] = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if not self.records:
+            raise StopIteration
+        return self.records.popleft()
+
+async def _csv_chunks(stream, size: int):
+    """Righe CSV non vuote in blocchi di `size`, lette da un unico csv.reader.
+
+    Le righe fisiche vengono unite finché le virgolette non sono bilanciate,
+    così un campo tra virgolette con degli a capo arriva intero al reader
+    anche quando attraversa due blocchi letti dalla rete.
+    """
+    feed = _RecordFeed()
+    reader = csv.reader(feed)
+    rows: list[list[str]] = []
+    record: list[str] = []
+    quotes = 0
+    async for batch in _line_batches(stream):
+        for line in batch:
+            record.append(line)
+            quotes += line.count('"')
+            if quotes % 2 == 0:
+                feed.records.append("\n".join(record) + "\n")
+                record, quotes = [], 0
+        rows.extend(values for values in reader if values)
+        while len(rows) >= size:
+            yield rows[:size]
+            rows = rows[size:]
+    if record:
+        # Virgolette non chiuse in fondo al file: il reader chiude il campo
+        feed.records.append("\n".join(record))
+        rows.extend(values for values in reader if values)
+    if rows:
+        yield rows
+
+async def import_request(request: Request, process_chunk):
+    """Importa un array JSON, oppure un upload NDJSON/CSV letto in streaming.
+
+    `process_chunk` è una coroutine che esegue BulkImporter.process_chunk
+    (nel threadpool con sessione sincrona, o tramite AsyncSession.run_sync).
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type == "text/csv":
+        header = None
+        async for rows in _csv_chunks(request.stream(), CHUNK_SIZE):
+            if header is None:
+                header, rows = rows[0], rows[1:]
+            await process_chunk(_parse_csv(rows, header))
+        return
+    if content_type == "application/x-ndjson":
+        async for lines in _line_chunks(request.stream(), CHUNK_SIZE):
+            await process_chunk(_parse_ndjson(lines))
+        return
+
+    try:
+        payload = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    if not isinstance(payload, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array of licenses")
+    for start in range(0, len(payload), CHUNK_SIZE):
+        await process_chunk(payload[start:start + CHUNK_SIZE])
@@ -0,0 +1,125 @@
+"""
+Cache in-process con scadenza (TTL) e politica LRU, con invalidazione
+opzionale condivisa tra i worker tramite Redis pub/sub
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from .config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+class TTLCache:
+    """Cache LRU thread-safe con scadenza per voce"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+class RedisInvalidation:
+    """Propaga le invalidazioni agli altri worker tramite un canale Redis.
+
+    Ogni processo ascolta il canale in un thread dedicato; se la connessione
+    cade la cache locale viene svuotata, perché potrebbe aver perso messaggi.
+    """
+
+    def __init__(self, url: str, channel: str, cache: TTLCache):
+        self.url = url
+        self.channel = channel
+        self.cache = cache
+        self._client = None
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    def _redis(self):
+        if self._client is None:
+            import redis
+            self._client = redis.Redis.from_url(self.url, socket_timeout=2, socket_connect_timeout=2)
+        return self._client
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen, name=f"cache-{self.channel}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def publish(self, key: str):
+        try:
+            self._redis().publish(self.channel, key)
+        except Exception as e:
+            logger.warning("Invalidazione cache via Redis non riuscita: %s", e)
+
+    def _listen(self):
+        while not self._stop.is_set():
+            pubsub = None
+            try:
+                pubsub = self._redis().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                while not self._stop.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message["type"] == "message":
+                        self.cache.delete(message["data"].decode())
+            except Exception as e:
+                logger.warning("Canale Redis %s non disponibile: %s", self.channel, e)
+                self.cache.clear()
+                self._stop.wait(5)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+# Utenti autenticati, indicizzati per subject del token (username)
+user_cache = TTLCache(maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL)
+user_cache_invalidation = (
+    RedisInvalidation(settings.REDIS_URL, "mykeymanager:user-cache", user_cache)
+    if settings.USER_CACHE_REDIS else None
+)
+
+def invalidate_user(*usernames: str):
+    """Rimuove gli utenti dalla cache di questo worker e, se configurato, di tutti gli altri"""
+    for username in usernames:
+        if not username:
+            continue
+        user_cache.delete(username)
+        if user_cache_invalidation is not None:
+            user_cache_invalidation.publish(username)
@@ -0,0 +1,216 @@
+"""
+Riepilogo per categoria: numero di licenze, vendor distinti e ultimo utilizzo.
+
+Di default è una GROUP BY su licenses. Con CATEGORY_SUMMARY_MATERIALIZED gli
+aggregati vengono letti da category_vendor_stats, una riga per (categoria,
+vendor) aggiornata da trigger del database a ogni INSERT, UPDATE o DELETE
+su licenses (anche import massivi ed eliminazioni in cascata): la query
+del riepilogo resta proporzionale al numero di categorie e vendor.
+
+Dopo aver attivato l'opzione su un database già migrato:
+
+    python -m app.migrate category-summary   # installa i trigger e ricalcola
+"""
+from sqlalchemy import delete, distinct, func, insert, select, text
+from sqlalchemy.engine import Connection
+from .models import Category, CategoryVendorStats, License
+
+# Ricalcolo di last_used_at quando una licenza esce da un gruppo
+INDEX_SQL = (
+    "CREATE INDEX IF NOT EXISTS ix_licenses_category_vendor_used "
+    "ON licenses (category_id, vendor, last_used_at)"
+)
+
+# Stesso gruppo e last_used_at non all'indietro: basta aggiornare il massimo
+_POSTGRES_SAME_GROUP = (
+    "n.category_id = o.category_id AND COALESCE(n.vendor, '') = COALESCE(o.vendor, '') "
+    "AND (o.last_used_at IS NULL OR (n.last_used_at IS NOT NULL AND n.last_used_at >= o.last_used_at))"
+)
+
+POSTGRES_DROP_TRIGGERS = [
+    "DROP TRIGGER IF EXISTS licenses_stats_insert ON licenses",
+    "DROP TRIGGER IF EXISTS licenses_stats_delete ON licenses",
+    "DROP TRIGGER IF EXISTS licenses_stats_update ON licenses",
+]
+
+# PostgreSQL: trigger per istruzione con transition table, un solo aggiornamento
+# per gruppo anche per UPDATE/INSERT su molte righe
+POSTGRES_TRIGGERS = [
+    """
+    CREATE OR REPLACE FUNCTION category_vendor_stats_add() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO category_vendor_stats AS s (category_id, vendor, license_count, last_used_at)
+        SELECT category_id, COALESCE(vendor, ''), count(*), max(last_used_at)
+        FROM new_rows GROUP BY 1, 2
+        ON CONFLICT (category_id, vendor) DO UPDATE SET
+            license_count = s.license_count + EXCLUDED.license_count,
+            last_used_at = GREATEST(s.last_used_at, EXCLUDED.last_used_at);
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION category_vendor_stats_remove() RETURNS trigger AS $$
+    BEGIN
+        UPDATE category_vendor_stats s SET
+            license_count = s.license_count - d.n,
+            last_used_at = (
+                SELECT max(l.last_used_at) FROM licenses l
+                WHERE l.category_id = s.category_id AND COALESCE(l.vendor, '') = s.vendor
+            )
+        FROM (SELECT category_id, COALESCE(vendor, '') AS vendor, count(*) AS n FROM old_rows GROUP BY 1, 2) d
+        WHERE s.category_id = d.category_id AND s.vendor = d.vendor;
+        DELETE FROM category_vendor_stats WHERE license_count <= 0;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql
+    """,
+    f"""
+    CREATE OR REPLACE FUNCTION category_vendor_stats_update() RETURNS trigger AS $$
+    BEGIN
+        -- Uso di licenze (stesso gruppo, last_used_at in avanti): basta il massimo
+        UPDATE category_vendor_stats s SET last_used_at = GREATEST(s.last_used_at, u.last_used_at)
+        FROM (
+            SELECT n.category_id, COALESCE(n.vendor, '') AS vendor, max(n.last_used_at) AS last_used_at
+            FROM new_rows n JOIN old_rows o ON o.id = n.id
+            WHERE {_POSTGRES_SAME_GROUP}
+            GROUP BY 1, 2
+        ) u
+        WHERE s.category_id = u.category_id AND s.vendor = u.vendor;
+
+        -- Cambio di categoria o vendor: si tolgono le righe vecchie e si aggiungono le nuove
+        UPDATE category_vendor_stats s SET
+            license_count = s.license_count - d.removed,
+            last_used_at = (
+                SELECT max(l.last_used_at) FROM licenses l
+                WHERE l.category_id = s.category_id AND COALESCE(l.vendor, '') = s.vendor
+            )
+        FROM (
+            SELECT o.category_id, COALESCE(o.vendor, '') AS vendor, count(*) AS removed
+            FROM old_rows o JOIN new_rows n ON n.id = o.id
+            WHERE NOT ({_POSTGRES_SAME_GROUP})
+            GROUP BY 1, 2
+        ) d
+        WHERE s.category_id = d.category_id AND s.vendor = d.vendor;
+        DELETE FROM category_vendor_stats WHERE license_count <= 0;
+
+        INSERT INTO category_vendor_stats AS s (category_id, vendor, license_count, last_used_at)
+        SELECT n.category_id, COALESCE(n.vendor, ''), count(*), max(n.last_used_at)
+        FROM new_rows n JOIN old_rows o ON o.id = n.id
+        WHERE NOT ({_POSTGRES_SAME_GROUP})
+        GROUP BY 1, 2
+        ON CONFLICT (category_id, vendor) DO UPDATE SET
+            license_count = s.license_count + EXCLUDED.license_count,
+            last_used_at = GREATEST(s.last_used_at, EXCLUDED.last_used_at);
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql
+    """,
+    *POSTGRES_DROP_TRIGGERS,
+    "CREATE TRIGGER licenses_stats_insert AFTER INSERT ON licenses REFERENCING NEW TABLE AS new_rows "
+    "FOR EACH STATEMENT EXECUTE FUNCTION category_vendor_stats_add()",
+    "CREATE TRIGGER licenses_stats_delete AFTER DELETE ON licenses REFERENCING OLD TABLE AS old_rows "
+    "FOR EACH STATEMENT EXECUTE FUNCTION category_vendor_stats_remove()",
+    "CREATE TRIGGER licenses_stats_update AFTER UPDATE ON licenses REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows "
+    "FOR EACH STATEMENT EXECUTE FUNCTION category_vendor_stats_update()",
+]
+
+# Come _POSTGRES_SAME_GROUP, per i trigger per riga
+_SQLITE_SAME_GROUP = (
+    "NEW.category_id = OLD.category_id AND COALESCE(NEW.vendor, '') = COALESCE(OLD.vendor, '') "
+    "AND (OLD.last_used_at IS NULL OR (NEW.last_used_at IS NOT NULL AND NEW.last_used_at >= OLD.last_used_at))"
+)
+_SQLITE_ADD = """
+    INSERT INTO category_vendor_stats (category_id, vendor, license_count, last_used_at)
+    VALUES (NEW.category_id, COALESCE(NEW.vendor, ''), 1, NEW.last_used_at)
+    ON CONFLICT (category_id, vendor) DO UPDATE SET
+        license_count = license_count + 1,
+        last_used_at = CASE WHEN last_used_at IS NULL OR excluded.last_used_at > last_used_at
+                       THEN excluded.last_used_at ELSE last_used_at END;
+"""
+_SQLITE_REMOVE = """
+    UPDATE category_vendor_stats SET
+        license_count = license_count - 1,
+        last_used_at = (
+            SELECT max(last_used_at) FROM licenses
+            WHERE category_id = OLD.category_id AND COALESCE(vendor, '') = COALESCE(OLD.vendor, '')
+        )
+    WHERE category_id = OLD.category_id AND vendor = COALESCE(OLD.vendor, '');
+    DELETE FROM category_vendor_stats
+    WHERE category_id = OLD.category_id AND vendor = COALESCE(OLD.vendor, '') AND license_count <= 0;
+"""
+
+SQLITE_DROP_TRIGGERS = [
+    "DROP TRIGGER IF EXISTS licenses_stats_insert",
+    "DROP TRIGGER IF EXISTS licenses_stats_delete",
+    "DROP TRIGGER IF EXISTS licenses_stats_used",
+    "DROP TRIGGER IF EXISTS licenses_stats_moved",
+]
+
+# SQLite: solo trigger per riga
+SQLITE_TRIGGERS = [
+    *SQLITE_DROP_TRIGGERS,
+    f"CREATE TRIGGER licenses_stats_insert AFTER INSERT ON licenses BEGIN {_SQLITE_ADD} END",
+    f"CREATE TRIGGER licenses_stats_delete AFTER DELETE ON licenses BEGIN {_SQLITE_REMOVE} END",
+    f"""
+    CREATE TRIGGER licenses_stats_used AFTER UPDATE OF category_id, vendor, last_used_at ON licenses
+    WHEN {_SQLITE_SAME_GROUP} AND NEW.last_used_at IS NOT OLD.last_used_at
+    BEGIN
+        UPDATE category_vendor_stats SET last_used_at = NEW.last_used_at
+        WHERE category_id = NEW.category_id AND vendor = COALESCE(NEW.vendor, '')
+          AND (last_used_at IS NULL OR last_used_at < NEW.last_used_at);
+    END
+    """,
+    f"""
+    CREATE TRIGGER licenses_stats_moved AFTER UPDATE OF category_id, vendor, last_used_at ON licenses
+    WHEN NOT ({_SQLITE_SAME_GROUP})
+    BEGIN {_SQLITE_REMOVE} {_SQLITE_ADD} END
+    """,
+]
+
+def rebuild(conn: Connection):
+    """Ricalcola category_vendor_stats da licenses"""
+    vendor = func.coalesce(License.vendor, "").label("vendor")
+    conn.execute(delete(CategoryVendorStats))
+    conn.execute(insert(CategoryVendorStats).from_select(
+        ["category_id", "vendor", "license_count", "last_used_at"],
+        select(License.category_id, vendor, func.count(), func.max(License.last_used_at))
+        .group_by(License.category_id, vendor),
+    ))
+
+def install(conn: Connection):
+    """Crea la tabella degli aggregati, installa i trigger e la ricalcola.
+
+    Nella stessa transazione: su PostgreSQL CREATE TRIGGER blocca le scritture
+    su licenses fino al commit, quindi nessuna modifica sfugge al ricalcolo.
+    """
+    CategoryVendorStats.__table__.create(conn, checkfirst=True)
+    conn.execute(text(INDEX_SQL))
+    triggers = POSTGRES_TRIGGERS if conn.dialect.name == "postgresql" else SQLITE_TRIGGERS
+    for statement in triggers:
+        conn.execute(text(statement))
+    rebuild(conn)
+
+def uninstall(conn: Connection):
+    """Rimuove i trigger; la tabella degli aggregati resta ma non è più aggiornata"""
+    triggers = POSTGRES_DROP_TRIGGERS if conn.dialect.name == "postgresql" else SQLITE_DROP_TRIGGERS
+    for statement in triggers:
+        conn.execute(text(statement))
+
+def summary_statement(materialized: bool):
+    """Una riga per categoria: id, name, icon, license_count, vendor_count, last_used_at"""
+    columns = (Category.id, Category.name, Category.icon)
+    if materialized:
+        stats = CategoryVendorStats
+        stmt = select(
+            *columns,
+            func.coalesce(func.sum(stats.license_count), 0).label("license_count"),
+            func.count(func.nullif(stats.vendor, "")).label("vendor_count"),
+            func.max(stats.last_used_at).label("last_used_at"),
+        ).outerjoin(stats, stats.category_id == Category.id)
+    else:
+        stmt = select(
+            *columns,
+            func.count(License.id).label("license_count"),
+            # Vendor vuoto equivale a mancante, come nella tabella materializzata
+            func.count(distinct(func.nullif(License.vendor, ""))).label("vendor_count"),
+            func.max(License.last_used_at).label("last_used_at"),
+        ).outerjoin(License, License.category_id == Category.id)
+    return stmt.group_by(*columns).order_by(Category.id)
@@ -7,19 +7,86 @@ class Settings(BaseSettings):
     API_V1_PREFIX: str = "/api/v1"
     SECRET_KEY: str = "change-this-secret"  # override via env
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 8
+    EVENTS_TOKEN_EXPIRE_SECONDS: int = 120  # token di /events nella query string (EventSource)
+    # bcrypt: costo e pool di processi dedicato (0 = nel thread della richiesta)
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_QUEUE: int = 16  # operazioni in attesa oltre le quali si risponde 503
     POSTGRES_HOST: str = "db"
     POSTGRES_PORT: int = 5432
     POSTGRES_DB: str = "mykeymanager"
     POSTGRES_USER: str = "mykeymanager"
     POSTGRES_PASSWORD: str = "ChangeMe123"
     DATABASE_URL: str | None = None
+    # Applica le migrazioni all'avvio se lo schema non è aggiornato (altrimenti: python -m app.migrate)
+    MIGRATE_ON_STARTUP: bool = True
+    # Pool di connessioni (per worker: DB_POOL_SIZE + DB_MAX_OVERFLOW connessioni al massimo)
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: int = 30  # secondi di attesa per una connessione libera
+    DB_POOL_RECYCLE: int = 1800  # secondi, -1 per disattivare
+    DB_POOL_PRE_PING: bool = True  # SELECT 1 a ogni checkout
+    DB_STATEMENT_TIMEOUT_MS: int = 0  # solo PostgreSQL, 0 = nessun limite
+    # Repliche in sola lettura (URL separati da virgola) per liste, ricerca e riepiloghi
+    DB_REPLICA_URLS: str = ""
+    DB_REPLICA_STICKY_SECONDS: int = 5  # letture sul primario dopo una modifica dello stesso client
+    DB_REPLICA_STICKY_REDIS: bool = False  # client fissati sul primario condivisi tra worker via REDIS_URL
+    DB_REPLICA_CHECK_SECONDS: int = 10  # intervallo del controllo di salute delle repliche
+    DB_REPLICA_MAX_LAG_SECONDS: float = 5  # ritardo di replica oltre il quale la replica è esclusa
+    DB_REPLICA_RETRY_SECONDS: int = 30  # esclusione dopo un errore di connessione
+    # SQLite (DATABASE_URL=sqlite:///...): pragma applicati a ogni nuova connessione
+    SQLITE_WAL: bool = True  # letture concorrenti durante le scritture
+    SQLITE_SYNCHRONOUS: str = "NORMAL"  # con WAL: nessuna corruzione, al più perse le ultime transazioni
+    SQLITE_CACHE_SIZE_KB: int = 65536  # cache di pagine per connessione
+    SQLITE_MMAP_SIZE_MB: int = 256
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000  # attesa del lock di scrittura tenuto da un altro processo
+    # Una transazione di scrittura alla volta, in ordine di arrivo, solo nel processo:
+    # non serializza tra worker o script esterni (lì valgono BEGIN IMMEDIATE e busy_timeout)
+    SQLITE_SINGLE_WRITER: bool = True
+    # Stack asincrono opzionale (asyncpg / aiosqlite): engine e router async
+    ASYNC_DB: bool = False
     REDIS_URL: str = "redis://redis:6379/0"
-    RATE_LIMIT: str = "100/hour"
+    RATE_LIMIT: str = "100/hour"  # per utente autenticato, altrimenti per IP
+    RATE_LIMIT_LOGIN: str = "10/minute"  # per IP su /auth/login e /auth/login-json
+    RATE_LIMIT_ROUTES: str = ""  # limiti aggiuntivi per percorso: "/api/v1/licenses/bulk=10/minute;..."
+    RATE_LIMIT_REDIS: bool = False  # contatori condivisi tra worker via REDIS_URL
+    RATE_LIMIT_SYNC_BATCH: int = 10  # permessi prenotati da Redis per ogni round trip
+    # Cache degli utenti autenticati (0 per disattivarla)
+    USER_CACHE_TTL: int = 60
+    USER_CACHE_SIZE: int = 1024
+    USER_CACHE_REDIS: bool = False  # invalidazione condivisa tra worker via REDIS_URL
+    # Cache delle liste con ETag (categorie e licenze)
+    RESPONSE_CACHE_TTL: int = 300
+    RESPONSE_CACHE_SIZE: int = 256
+    RESPONSE_CACHE_REDIS: bool = False  # versioni e risposte condivise via REDIS_URL (senza: versione dal database)
+    # Senza Redis: riuso nel processo della versione letta dal database (i commit
+    # del processo la invalidano subito, quelli degli altri worker entro questo ritardo)
+    RESPONSE_CACHE_VERSION_MS: int = 1000
+    # Riepilogo categorie da aggregati mantenuti da trigger invece che GROUP BY su tutte le licenze
+    CATEGORY_SUMMARY_MATERIALIZED: bool = False
+    # Eliminazioni conservate per /sync (python -m app.migrate prune-tombstones)
+    SYNC_TOMBSTONE_DAYS: int = 90
+    # Storico utilizzi licenze partizionato per mese (solo PostgreSQL, vale alla creazione della tabella)
+    USAGE_PARTITIONING: bool = False
     SMTP_HOST: str = "smtp"
     SMTP_PORT: int = 587
     SMTP_USERNAME: str = "smtpuser"
     SMTP_PASSWORD: str = "smtppass"
     SMTP_FROM: str = "info@acwild.it"
+    SMTP_TIMEOUT: int = 10
+    # Coda email in background (outbox su database)
+    EMAIL_WORKERS: int = 2
+    EMAIL_BATCH_SIZE: int = 20
+    EMAIL_MAX_ATTEMPTS: int = 5
+    EMAIL_RETRY_BASE_SECONDS: int = 30
+    EMAIL_POLL_INTERVAL: int = 15
+    SMTP_IDLE_TIMEOUT: int = 60
+    METRICS_ENABLED: bool = True  # /metrics in formato Prometheus
+    # Log JSON su stdout scritti da un thread dedicato
+    LOG_LEVEL: str = "INFO"
+    LOG_JSON: bool = True  # false: una riga di testo per record
+    LOG_SAMPLE_RATE: float = 0.1  # quota registrata degli eventi frequenti (richieste riuscite, email inviate)
+    LOG_SLOW_REQUEST_MS: int = 500  # richieste più lente sempre registrate
     ALLOWED_ORIGINS: str = "http://localhost:5173"
 
     class Config:
@@ -35,6 +102,27 @@ class Settings(BaseSettings):
             f"@{self.POSTGRES_HOST}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
         )
 
+    @property
+    def replica_urls(self) -> list[str]:
+        return [url.strip() for url in self.DB_REPLICA_URLS.split(",") if url.strip()]
+
+    @property
+    def sqlalchemy_async_database_uri(self) -> str:
+        return async_database_uri(self.sqlalchemy_database_uri)
+
+def async_database_uri(uri: str) -> str:
+    """URI del database con il driver asincrono corrispondente"""
+    for sync_prefix, async_prefix in (
+        ("postgresql+psycopg2://", "postgresql+asyncpg://"),
+        ("postgresql://", "postgresql+asyncpg://"),
+        ("postgres://", "postgresql+asyncpg://"),
+        ("sqlite+pysqlite://", "sqlite+aiosqlite://"),
+        ("sqlite://", "sqlite+aiosqlite://"),
+    ):
+        if uri.startswith(sync_prefix):
+            return async_prefix + uri[len(sync_prefix):]
+    return uri
+
 @lru_cache
 def get_settings() -> Settings:
     return Settings()
@@ -0,0 +1,145 @@
+"""
+Fixture comuni dei test.
+
+Le variabili d'ambiente vanno impostate prima che app.config venga importato:
+i test usano un database SQLite temporaneo (o TEST_DATABASE_URL se definito).
+"""
+import os
+import tempfile
+
+_test_dir = tempfile.mkdtemp(prefix="mykeymanager-test-")
+os.environ["DATABASE_URL"] = os.environ.get("TEST_DATABASE_URL", f"sqlite:///{_test_dir}/test.db")
+os.environ["BCRYPT_ROUNDS"] = "4"
+os.environ["PASSWORD_HASH_WORKERS"] = "0"
+os.environ["RATE_LIMIT"] = "100000/hour"
+os.environ["RATE_LIMIT_LOGIN"] = "100000/hour"
+
+import pytest
+from contextlib import contextmanager
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+from fastapi.testclient import TestClient
+from sqlalchemy import delete, event
+from .api.router import build_api_router
+from .config import get_settings
+from .database import engine, SessionLocal
+from .main import app
+from .migrate import upgrade
+from .security import create_access_token
+from .cache import user_cache
+from .response_cache import response_cache
+from . import database, models
+
+settings = get_settings()
+
+class QueryCounter:
+    """Conta le istruzioni SQL eseguite sull'engine durante un blocco"""
+
+    def __init__(self):
+        self.statements: list[str] = []
+        self._active = False
+        # Anche l'engine asincrono, se la variante async dell'app è già stata creata
+        self.engines = [engine] + ([database.async_engine.sync_engine] if database.async_engine else [])
+        for target in self.engines:
+            event.listen(target, "before_cursor_execute", self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        # Il BEGIN esplicito di SQLite non è una query (con PostgreSQL lo emette il driver)
+        if self._active and not statement.startswith("BEGIN"):
+            self.statements.append(statement)
+
+    @contextmanager
+    def count(self, budget: int | None = None, label: str = ""):
+        """Esegue il blocco a cache fredde; se `budget` è indicato fallisce quando lo supera"""
+        user_cache.clear()
+        response_cache.bodies.clear()
+        response_cache.local_version.invalidate()
+        self.statements = []
+        self._active = True
+        try:
+            yield self
+        finally:
+            self._active = False
+        if budget is not None and len(self.statements) > budget:
+            listing = "\n".join(f"  {s.splitlines()[0][:120]}" for s in self.statements)
+            pytest.fail(f"{label}: {len(self.statements)} query, budget {budget}\n{listing}")
+
+    def close(self):
+        for target in self.engines:
+            event.remove(target, "before_cursor_execute", self._record)
+
+def _app_variant(asynchronous: bool):
+    """L'app con i router sincroni o asincroni, qualunque sia ASYNC_DB.
+
+    La variante non configurata riusa middleware, exception handler e route
+    fuori dall'API dell'app principale.
+    """
+    if asynchronous == settings.ASYNC_DB:
+        return app
+    if asynchronous and database.AsyncSessionLocal is None:
+        database.async_engine, database.AsyncSessionLocal = database.create_async_database()
+    variant = FastAPI(title=app.title, default_response_class=ORJSONResponse)
+    variant.user_middleware = list(app.user_middleware)
+    variant.exception_handlers = dict(app.exception_handlers)
+    own_paths = {route.path for route in variant.routes}
+    variant.router.routes.extend(
+        route for route in app.routes
+        if route.path not in own_paths and not route.path.startswith(settings.API_V1_PREFIX)
+    )
+    variant.include_router(build_api_router(asynchronous), prefix=settings.API_V1_PREFIX)
+    return variant
+
+@pytest.fixture(scope="session", params=["sync", "async"])
+def client(request):
+    """Client dell'app, una volta con i router sincroni e una con quelli asincroni (ASYNC_DB)"""
+    # Senza il context manager di TestClient gli eventi di startup non partono:
+    # niente worker email in background che interrogano il database durante i conteggi
+    upgrade(engine)
+    return TestClient(_app_variant(request.param == "async"))
+
+@pytest.fixture(scope="session")
+def auth_headers(client):
+    return {"Authorization": f"Bearer {create_access_token('admin')}"}
+
+@pytest.fixture
+def query_counter(client):
+    counter = QueryCounter()
+    yield counter
+    counter.close()
+
+@pytest.fixture
+def seed_licenses():
+    """Crea una categoria con `count` licenze e restituisce gli id delle licenze"""
+    created = []
+
+    def seed(count: int) -> list[int]:
+        db = SessionLocal()
+        try:
+            category = models.Category(name=f"Test {len(created)}-{os.urandom(4).hex()}")
+            db.add(category)
+            db.flush()
+            licenses = [
+                models.License(
+                    category_id=category.id,
+                    product_name=f"Product {i}",
+                    vendor="Vendor",
+                    license_key=f"KEY-{category.id}-{i:06d}",
+                )
+                for i in range(count)
+            ]
+            db.add_all(licenses)
+            db.commit()
+            created.append(category.id)
+            return [lic.id for lic in licenses]
+        finally:
+            db.close()
+
+    yield seed
+
+    db = SessionLocal()
+    try:
+        db.execute(delete(models.License).where(models.License.category_id.in_(created)))
+        db.execute(delete(models.Category).where(models.Category.id.in_(created)))
+        db.commit()
+    finally:
+        db.close()
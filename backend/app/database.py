@@ -1,17 +1,523 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
-from .config import get_settings
+import itertools
+import logging
+import threading
+from collections import deque
+import time
+import jwt
+from fastapi import Request, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session, sessionmaker, DeclarativeBase
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from .cache import TTLCache
+from .config import async_database_uri, get_settings
+from .security import ALGORITHM
 
 settings = get_settings()
-engine = create_engine(settings.sqlalchemy_database_uri, pool_pre_ping=True)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+logger = logging.getLogger(__name__)
+
+class PoolWaitStats:
+    """Tempi di attesa per ottenere una connessione dal pool"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+                "wait_seconds_avg": round(self.wait_seconds_total / self.checkouts, 6) if self.checkouts else 0.0,
+                "wait_seconds_max": round(self.wait_seconds_max, 6),
+            }
+
+class _TimedPoolMixin:
+    """Misura quanto tempo una richiesta attende una connessione libera"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_stats = PoolWaitStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            self.wait_stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        self.wait_stats.record(time.perf_counter() - start)
+        return conn
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+class TimedAsyncAdaptedQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+class SQLiteWriteQueue:
+    """Una sola transazione di scrittura SQLite alla volta nel processo.
+
+    Le connessioni in attesa sono servite in ordine di arrivo, invece di
+    contendersi il lock del file con busy_timeout; il turno viene preso al
+    BEGIN IMMEDIATE o alla prima istruzione di scrittura e rilasciato quando
+    la connessione torna al pool (dopo commit o rollback).
+
+    La coda non serializza tra processi: con più worker (o script esterni) resta
+    il lock del file con busy_timeout, e le transazioni delle richieste che
+    modificano dati partono con BEGIN IMMEDIATE per non fallire con
+    SQLITE_BUSY_SNAPSHOT (vedi configure_sqlite).
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.wait_stats = PoolWaitStats()
+        self._condition = threading.Condition()
+        self._waiting: deque = deque()
+        self._busy = False
+
+    def acquire(self):
+        start = time.perf_counter()
+        ticket = object()
+        with self._condition:
+            self._waiting.append(ticket)
+            ready = self._condition.wait_for(lambda: not self._busy and self._waiting[0] is ticket, self.timeout)
+            self._waiting.remove(ticket)
+            if not ready:
+                self._condition.notify_all()
+                self.wait_stats.record(time.perf_counter() - start, timed_out=True)
+                raise PoolTimeoutError(f"Scrittura SQLite in attesa da più di {self.timeout} s")
+            self._busy = True
+        self.wait_stats.record(time.perf_counter() - start)
+
+    def release(self):
+        with self._condition:
+            self._busy = False
+            self._condition.notify_all()
+
+# Istruzioni che richiedono il lock di scrittura del file
+SQLITE_WRITE_KEYWORDS = {"INSERT", "UPDATE", "DELETE", "REPLACE", "CREATE", "DROP", "ALTER"}
+# Opzione di esecuzione: modo del BEGIN delle transazioni SQLite (DEFERRED, IMMEDIATE)
+SQLITE_BEGIN_OPTION = "sqlite_begin"
+
+def _is_sqlite_write(statement: str) -> bool:
+    words = statement.split(None, 2)
+    if not words:
+        return False
+    keyword = words[0].upper()
+    if keyword == "BEGIN":
+        return len(words) > 1 and words[1].upper() in ("IMMEDIATE", "EXCLUSIVE")
+    return keyword in SQLITE_WRITE_KEYWORDS
+
+def configure_sqlite(engine, write_queue: SQLiteWriteQueue | None = None):
+    """Pragma di ogni connessione SQLite, BEGIN esplicito e, se indicata, coda delle scritture.
+
+    Il BEGIN lo emette SQLAlchemy e non il driver: una transazione che legge e
+    poi scrive, se un altro processo ha scritto nel frattempo, non può passare
+    dal proprio snapshot al lock di scrittura (SQLITE_BUSY_SNAPSHOT, senza
+    attesa di busy_timeout). Le connessioni con l'opzione SQLITE_BEGIN_OPTION
+    (sessioni delle richieste che modificano dati, vedi get_db) prendono il lock
+    subito con BEGIN IMMEDIATE.
+    """
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        # Niente BEGIN implicito del driver: lo emette _begin
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        if settings.SQLITE_WAL:
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA cache_size=-{settings.SQLITE_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA mmap_size={settings.SQLITE_MMAP_SIZE_MB * 1024 * 1024}")
+        cursor.execute(f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def _begin(conn):
+        mode = conn.get_execution_options().get(SQLITE_BEGIN_OPTION, "DEFERRED")
+        conn.exec_driver_sql(f"BEGIN {mode}")
+
+    if write_queue is None:
+        return
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _wait_for_write_turn(conn, cursor, statement, parameters, context, executemany):
+        info = conn.connection.info
+        if not info.get("sqlite_writer") and _is_sqlite_write(statement):
+            write_queue.acquire()
+            info["sqlite_writer"] = True
+
+    @event.listens_for(engine, "checkin")
+    def _end_write_turn(dbapi_connection, connection_record):
+        if connection_record.info.pop("sqlite_writer", False):
+            write_queue.release()
+
+def engine_options(uri: str, asynchronous: bool = False) -> dict:
+    """Opzioni di create_engine derivate dalle impostazioni del pool"""
+    options = {"pool_pre_ping": settings.DB_POOL_PRE_PING}
+    if uri.startswith("sqlite"):
+        # SQLite usa il pool di default del dialetto (nessuna connessione di rete)
+        return options
+    options.update(
+        poolclass=TimedAsyncAdaptedQueuePool if asynchronous else TimedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+    )
+    if settings.DB_STATEMENT_TIMEOUT_MS and uri.startswith("postgres"):
+        if asynchronous:
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(settings.DB_STATEMENT_TIMEOUT_MS)}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+def pool_status(engine) -> dict:
+    """Stato del pool: connessioni in uso, libere, in overflow e tempi di attesa"""
+    pool = engine.pool
+    status = {"pool_class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            idle=pool.checkedin(),
+            overflow=max(pool.overflow(), 0),
+            max_overflow=pool._max_overflow,
+            timeout=pool.timeout(),
+        )
+    if isinstance(pool, _TimedPoolMixin):
+        status["wait"] = pool.wait_stats.snapshot()
+    return status
+
+# Ritardo di una replica PostgreSQL: 0 se ha applicato tutto il WAL ricevuto
+REPLICA_LAG_SQL = """
+SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0) END
+"""
+# Cookie impostato dalle richieste di modifica: le letture successive del client restano sul primario
+PRIMARY_COOKIE = "mkm_primary"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+class ReplicaSet:
+    """Repliche in sola lettura scelte a turno.
+
+    Una replica viene esclusa quando una connessione fallisce (per
+    DB_REPLICA_RETRY_SECONDS) o quando il controllo periodico non riesce o
+    misura un ritardo oltre DB_REPLICA_MAX_LAG_SECONDS; il controllo successivo
+    riuscito la riammette. Senza repliche disponibili si legge dal primario.
+    """
+
+    def __init__(self, urls: list[str]):
+        self.urls = urls
+        self.engines = [create_engine(url, **engine_options(url)) for url in urls]
+        for replica in self.engines:
+            if replica.dialect.name == "sqlite":
+                configure_sqlite(replica)
+        self.async_engines = []
+        self._ejected_until = [0.0] * len(urls)
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+        for index, replica in enumerate(self.engines):
+            self._watch(index, replica)
+
+    def add_async_engines(self, create_async_engine):
+        for index, url in enumerate(self.urls):
+            uri = async_database_uri(url)
+            replica = create_async_engine(uri, **engine_options(uri, asynchronous=True))
+            if replica.dialect.name == "sqlite":
+                configure_sqlite(replica.sync_engine)
+            self.async_engines.append(replica)
+            self._watch(index, replica.sync_engine)
+
+    def _watch(self, index: int, replica):
+        @event.listens_for(replica, "handle_error")
+        def _eject_on_disconnect(context):
+            if context.is_disconnect or context.connection is None:
+                self.eject(index, context.original_exception, settings.DB_REPLICA_RETRY_SECONDS)
+
+    def choose(self, asynchronous: bool = False):
+        """Prossima replica disponibile (engine sincrono per le sessioni async), o None"""
+        engines = [e.sync_engine for e in self.async_engines] if asynchronous else self.engines
+        now = time.monotonic()
+        for _ in range(len(engines)):
+            index = next(self._counter) % len(engines)
+            if self._ejected_until[index] <= now:
+                return engines[index]
+        return None
+
+    def eject(self, index: int, reason, seconds: float):
+        with self._lock:
+            was_healthy = self._ejected_until[index] <= time.monotonic()
+            self._ejected_until[index] = time.monotonic() + seconds
+        if was_healthy:
+            logger.warning("Replica %s esclusa: %s", index, reason)
+
+    def admit(self, index: int):
+        with self._lock:
+            was_ejected = self._ejected_until[index] > time.monotonic()
+            self._ejected_until[index] = 0.0
+        if was_ejected:
+            logger.info("Replica %s di nuovo disponibile", index)
+
+    def check(self):
+        """Un giro di controlli: connessione e ritardo di replica (solo PostgreSQL)"""
+        for index, replica in enumerate(self.engines):
+            try:
+                with replica.connect() as conn:
+                    lag = conn.execute(text(REPLICA_LAG_SQL)).scalar() if replica.dialect.name == "postgresql" else 0
+            except Exception as e:
+                self.eject(index, e, settings.DB_REPLICA_CHECK_SECONDS * 2)
+                continue
+            if lag > settings.DB_REPLICA_MAX_LAG_SECONDS:
+                self.eject(index, f"ritardo di replica {lag:.1f} s", settings.DB_REPLICA_CHECK_SECONDS * 2)
+            else:
+                self.admit(index)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._monitor, name="replica-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def _monitor(self):
+        while not self._stop.is_set():
+            self.check()
+            self._stop.wait(settings.DB_REPLICA_CHECK_SECONDS)
+
+    def status(self) -> list[dict]:
+        now = time.monotonic()
+        return [
+            {"available": self._ejected_until[index] <= now, **pool_status(replica)}
+            for index, replica in enumerate(self.engines)
+        ]
+
+class RoutingSession(Session):
+    """Sessione che legge da una replica quando la richiesta lo consente.
+
+    Flush e istruzioni diverse da SELECT vanno sempre sul primario; dopo la
+    prima scrittura anche le letture della sessione restano sul primario.
+    """
+
+    def __init__(self, *args, replicas: ReplicaSet | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replicas = replicas
+        self.replica = None
+
+    def use_replica(self, asynchronous: bool = False):
+        if self.replicas is not None:
+            self.replica = self.replicas.choose(asynchronous)
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.replica is not None:
+            if self._flushing or (clause is not None and not getattr(clause, "is_select", False)):
+                self.replica = None
+            else:
+                return self.replica
+        return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+
+class PrimaryStickiness:
+    """Utenti (soggetto del token) che hanno appena scritto: leggono dal primario.
+
+    Copre i client senza cookie (token Bearer da script o app). Nel processo
+    con una TTLCache; con DB_REPLICA_STICKY_REDIS una chiave con scadenza su
+    Redis, così vale anche quando la lettura arriva a un altro worker.
+    """
+
+    PREFIX = "mykeymanager:primary-sticky"
+
+    def __init__(self, seconds: int, redis_url: str | None = None):
+        self.seconds = seconds
+        self.local = TTLCache(maxsize=10_000, ttl=seconds)
+        self.redis_url = redis_url
+        self._client = None
+
+    def _redis(self):
+        if self._client is None:
+            import redis
+            self._client = redis.Redis.from_url(self.redis_url, socket_timeout=1, socket_connect_timeout=1)
+        return self._client
+
+    def mark(self, subject: str):
+        self.local.set(subject, True)
+        if self.redis_url:
+            try:
+                self._redis().set(f"{self.PREFIX}:{subject}", 1, ex=self.seconds)
+            except Exception as e:
+                logger.warning("Marcatura lettura da primario su Redis non riuscita: %s", e)
+
+    def is_sticky(self, subject: str) -> bool:
+        if self.local.get(subject):
+            return True
+        if not self.redis_url:
+            return False
+        try:
+            return bool(self._redis().exists(f"{self.PREFIX}:{subject}"))
+        except Exception as e:
+            # Nel dubbio il primario: niente letture vecchie dopo una modifica
+            logger.warning("Lettura da primario su Redis non verificabile: %s", e)
+            return True
+
+primary_stickiness = PrimaryStickiness(
+    settings.DB_REPLICA_STICKY_SECONDS, settings.REDIS_URL if settings.DB_REPLICA_STICKY_REDIS else None,
+)
+
+def _token_subject(request: Request) -> str | None:
+    """Soggetto del token Bearer della richiesta, senza validarlo (lo fanno le dipendenze)"""
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except Exception:
+        return None
+
+def replica_read(endpoint):
+    """Segna un endpoint di sola lettura che può essere servito da una replica"""
+    endpoint.replica_read = True
+    return endpoint
+
+def deferred_write(endpoint):
+    """Segna un endpoint che modifica dati ma non deve prendere subito il lock di scrittura SQLite.
+
+    Per gli handler che prima fanno operazioni lente (es. bcrypt): dopo, la
+    scrittura va in una transazione nuova (begin_write, o una che inizia con
+    la scrittura stessa).
+    """
+    endpoint.deferred_write = True
+    return endpoint
+
+def begin_write(db: Session):
+    """Chiude la transazione in corso; la prossima prende subito il lock di scrittura SQLite.
+
+    Gli oggetti della sessione vengono ricaricati al primo accesso, nella nuova
+    transazione. Con AsyncSession: `await db.run_sync(begin_write)`.
+    """
+    db.rollback()
+    db.connection(execution_options={SQLITE_BEGIN_OPTION: "IMMEDIATE"})
+
+def _begins_immediate(request: Request, bind) -> bool:
+    """Con SQLite le richieste che modificano dati aprono le transazioni con BEGIN IMMEDIATE"""
+    return (
+        bind.dialect.name == "sqlite"
+        and request.method not in SAFE_METHODS
+        and not getattr(request.scope.get("endpoint"), "deferred_write", False)
+    )
+
+def _reads_from_replica(request: Request, response: Response) -> bool:
+    """Letture sicure su replica; ogni modifica fissa il client sul primario per qualche secondo.
+
+    Il client è riconosciuto dal cookie PRIMARY_COOKIE (browser) e dal soggetto
+    del token (primary_stickiness), perché molti client Bearer non conservano cookie.
+    """
+    if request.method not in SAFE_METHODS:
+        response.set_cookie(
+            PRIMARY_COOKIE, "1", max_age=settings.DB_REPLICA_STICKY_SECONDS, httponly=True, samesite="lax",
+        )
+        subject = _token_subject(request)
+        if subject:
+            primary_stickiness.mark(subject)
+        return False
+    if not getattr(request.scope.get("endpoint"), "replica_read", False) or PRIMARY_COOKIE in request.cookies:
+        return False
+    subject = _token_subject(request)
+    return not (subject and primary_stickiness.is_sticky(subject))
+
+engine = create_engine(settings.sqlalchemy_database_uri, **engine_options(settings.sqlalchemy_database_uri))
+sqlite_write_queue = None
+if engine.dialect.name == "sqlite":
+    if settings.SQLITE_SINGLE_WRITER:
+        sqlite_write_queue = SQLiteWriteQueue(timeout=settings.DB_POOL_TIMEOUT)
+    configure_sqlite(engine, sqlite_write_queue)
+replicas = ReplicaSet(settings.replica_urls) if settings.replica_urls else None
+SessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=engine, replicas=replicas)
+
+def upsert_insert(db: Session):
+    """Costrutto insert con ON CONFLICT per il dialetto della sessione, o None se non supportato"""
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        return pg_insert
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        return sqlite_insert
+    return None
 
 class Base(DeclarativeBase):
     pass
 
-def get_db():
-    db = SessionLocal()
+def get_db(request: Request, response: Response):
+    if _begins_immediate(request, engine):
+        db = SessionLocal(bind=engine.execution_options(**{SQLITE_BEGIN_OPTION: "IMMEDIATE"}))
+    else:
+        db = SessionLocal()
+    if replicas is not None and _reads_from_replica(request, response):
+        db.use_replica()
     try:
         yield db
     finally:
         db.close()
+
+def create_async_database():
+    """Engine e sessionmaker asincroni (richiede asyncpg o aiosqlite)"""
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    async_engine = create_async_engine(
+        settings.sqlalchemy_async_database_uri,
+        **engine_options(settings.sqlalchemy_async_database_uri, asynchronous=True),
+    )
+    if async_engine.dialect.name == "sqlite":
+        # Niente coda: un'attesa bloccante fermerebbe l'event loop, resta busy_timeout
+        configure_sqlite(async_engine.sync_engine)
+    if replicas is not None:
+        replicas.add_async_engines(create_async_engine)
+    # expire_on_commit=False: gli attributi restano leggibili dopo il commit senza lazy load
+    session_factory = async_sessionmaker(
+        async_engine, autoflush=False, expire_on_commit=False, sync_session_class=RoutingSession, replicas=replicas,
+    )
+    return async_engine, session_factory
+
+# Engine asincrono, creato solo con ASYNC_DB=true
+async_engine = None
+AsyncSessionLocal = None
+if settings.ASYNC_DB:
+    async_engine, AsyncSessionLocal = create_async_database()
+
+async def get_async_db(request: Request, response: Response):
+    if _begins_immediate(request, async_engine):
+        session = AsyncSessionLocal(bind=async_engine.execution_options(**{SQLITE_BEGIN_OPTION: "IMMEDIATE"}))
+    else:
+        session = AsyncSessionLocal()
+    async with session as db:
+        if replicas is not None:
+            # Con Redis il controllo del client fissato sul primario va nel threadpool
+            if primary_stickiness.redis_url:
+                use_replica = await run_in_threadpool(_reads_from_replica, request, response)
+            else:
+                use_replica = _reads_from_replica(request, response)
+            if use_replica:
+                db.sync_session.use_replica(asynchronous=True)
+        yield db
@@ -1,28 +1,75 @@
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import jwt
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from .security import ALGORITHM
+from .security import ALGORITHM, EVENTS_SCOPE
 from .config import get_settings
-from .database import get_db
+from .database import get_db, SessionLocal
 from .models import User
+from .cache import user_cache
 
 settings = get_settings()
 http_bearer = HTTPBearer(auto_error=False)
 
-def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(http_bearer),
-    db: Session = Depends(get_db),
-):
-    if credentials is None:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
-    token = credentials.credentials
+USER_COLUMNS = [c.key for c in User.__table__.columns]
+
+def _token_subject(token: str, scope: str | None) -> str:
+    """Utente del token JWT; `scope` deve coincidere (None: token di accesso normale)"""
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
     except Exception:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-    user = db.query(User).filter(User.username == username).first()
+    if payload.get("scope") != scope:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    return username
+
+def get_token_subject(credentials: HTTPAuthorizationCredentials = Depends(http_bearer)) -> str:
+    if credentials is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    return _token_subject(credentials.credentials, None)
+
+def get_stream_subject(
+    credentials: HTTPAuthorizationCredentials = Depends(http_bearer),
+    token: str | None = Query(None, description="Token di POST /events/token, per EventSource"),
+) -> str:
+    """Utente di /events: header Bearer oppure ?token= (EventSource non può inviare header)"""
+    if token is None:
+        return get_token_subject(credentials)
+    return _token_subject(token, EVENTS_SCOPE)
+
+def get_current_db_user(username: str = Depends(get_token_subject), db: Session = Depends(get_db)):
+    """Utente corrente letto dal database e legato alla sessione della richiesta.
+
+    Da usare negli endpoint che modificano l'utente; i dati letti aggiornano la cache.
+    """
+    user = db.scalars(select(User).where(User.username == username)).first()
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+    user_cache.set(username, {key: getattr(user, key) for key in USER_COLUMNS})
+    return user
+
+def get_current_user(username: str = Depends(get_token_subject), db: Session = Depends(get_db)):
+    """Utente corrente, servito dalla cache quando possibile.
+
+    L'oggetto restituito non è legato alla sessione: va usato in sola lettura.
+    """
+    cached = user_cache.get(username)
+    if cached is not None:
+        return User(**cached)
+    user = get_current_db_user(username, db)
+    db.expunge(user)
     return user
+
+def get_stream_user(username: str = Depends(get_stream_subject)):
+    """Utente di /events senza get_db: la sessione, se serve, viene chiusa subito.
+
+    Le dipendenze con yield restano aperte fino alla fine della risposta, cioè
+    per tutta la durata dello stream.
+    """
+    cached = user_cache.get(username)
+    if cached is not None:
+        return User(**cached)
+    with SessionLocal() as db:
+        return get_current_user(username, db)
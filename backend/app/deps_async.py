@@ -0,0 +1,36 @@
+"""
+Dipendenze per i router asincroni (ASYNC_DB=true)
+"""
+from fastapi import Depends, HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import database
+from .database import get_async_db
+from .models import User
+from .cache import user_cache
+from .deps import get_stream_subject, get_token_subject, USER_COLUMNS
+
+async def get_current_db_user_async(username: str = Depends(get_token_subject), db: AsyncSession = Depends(get_async_db)):
+    """Versione asincrona di deps.get_current_db_user"""
+    user = (await db.scalars(select(User).where(User.username == username))).first()
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+    user_cache.set(username, {key: getattr(user, key) for key in USER_COLUMNS})
+    return user
+
+async def get_current_user_async(username: str = Depends(get_token_subject), db: AsyncSession = Depends(get_async_db)):
+    """Versione asincrona di deps.get_current_user"""
+    cached = user_cache.get(username)
+    if cached is not None:
+        return User(**cached)
+    user = await get_current_db_user_async(username, db)
+    db.expunge(user)
+    return user
+
+async def get_stream_user_async(username: str = Depends(get_stream_subject)):
+    """Versione asincrona di deps.get_stream_user"""
+    cached = user_cache.get(username)
+    if cached is not None:
+        return User(**cached)
+    async with database.AsyncSessionLocal() as db:
+        return await get_current_user_async(username, db)
@@ -0,0 +1,239 @@
+"""
+Invio email in background: le richieste scrivono nella outbox su database e
+un pool di thread worker consegna i messaggi riutilizzando le connessioni SMTP
+"""
+import logging
+import queue
+import smtplib
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from sqlalchemy.orm import selectinload
+from .config import get_settings
+from .database import SessionLocal
+from .models import EmailOutbox
+from . import email_utils, metrics
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Durata del lease su un messaggio preso in carico da un worker
+LEASE_SECONDS = 300
+MAX_RETRY_DELAY_SECONDS = 3600
+
+class SMTPConnectionPool:
+    """Connessioni SMTP persistenti per (host, porta, utente).
+
+    Ogni worker ha il proprio pool perché gli oggetti smtplib non sono thread-safe.
+    """
+
+    def __init__(self, idle_timeout: int):
+        self.idle_timeout = idle_timeout
+        self._connections: dict[tuple, tuple[smtplib.SMTP, float]] = {}
+
+    def send(self, config: email_utils.SMTPConfig, message, recipients: list[str]):
+        start = time.perf_counter()
+        entry = self._connections.pop(config.pool_key, None)
+        smtp = entry[0] if entry else None
+        try:
+            if smtp is None:
+                smtp = email_utils.open_smtp_connection(config)
+                smtp.send_message(message, to_addrs=recipients)
+            else:
+                try:
+                    smtp.send_message(message, to_addrs=recipients)
+                except smtplib.SMTPServerDisconnected:
+                    # Il server ha chiuso la connessione inattiva: riapre e riprova
+                    smtp = email_utils.open_smtp_connection(config)
+                    smtp.send_message(message, to_addrs=recipients)
+        except Exception:
+            metrics.SMTP_SEND_FAILURES.inc()
+            self._close(smtp)
+            raise
+        metrics.SMTP_SEND_SECONDS.observe(time.perf_counter() - start)
+        self._connections[config.pool_key] = (smtp, time.monotonic())
+
+    def prune(self):
+        """Chiude le connessioni inattive da più di idle_timeout secondi"""
+        now = time.monotonic()
+        for key, (smtp, last_used) in list(self._connections.items()):
+            if now - last_used > self.idle_timeout:
+                del self._connections[key]
+                self._close(smtp)
+
+    def close_all(self):
+        for smtp, _ in self._connections.values():
+            self._close(smtp)
+        self._connections.clear()
+
+    @staticmethod
+    def _close(smtp):
+        if smtp is None:
+            return
+        try:
+            smtp.quit()
+        except Exception:
+            smtp.close()
+
+class EmailDispatcher:
+    """Coda in-process di id della outbox servita da un pool di thread worker.
+
+    Un thread di polling recupera i messaggi scaduti (retry con backoff, o
+    rimasti in sospeso dopo un riavvio). La presa in carico avviene con un
+    UPDATE condizionale, quindi più processi uvicorn possono condividere la outbox.
+    """
+
+    def __init__(self, workers: int, batch_size: int, poll_interval: int):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._queue: queue.Queue = queue.Queue()
+        self._stop = threading.Event()
+        self._threads: list[threading.Thread] = []
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        for i in range(self.workers):
+            self._threads.append(threading.Thread(target=self._worker, name=f"email-worker-{i}", daemon=True))
+        self._threads.append(threading.Thread(target=self._poller, name="email-poller", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        for _ in range(self.workers):
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def notify(self, outbox_id: int):
+        """Segnala un nuovo messaggio; se i worker non sono attivi lo recupera il polling"""
+        if self._threads:
+            self._queue.put(outbox_id)
+
+    def _poller(self):
+        while True:
+            try:
+                self._enqueue_due()
+            except Exception as e:
+                logger.error("Errore lettura outbox email: %s", e)
+            if self._stop.wait(self.poll_interval):
+                return
+
+    def _enqueue_due(self):
+        db = SessionLocal()
+        try:
+            ids = db.scalars(
+                select(EmailOutbox.id)
+                .where(EmailOutbox.status == "pending", EmailOutbox.next_attempt_at <= datetime.utcnow())
+                .order_by(EmailOutbox.next_attempt_at)
+                .limit(self.batch_size * self.workers * 10)
+            ).all()
+        finally:
+            db.close()
+        for outbox_id in ids:
+            self._queue.put(outbox_id)
+
+    def _worker(self):
+        pool = SMTPConnectionPool(settings.SMTP_IDLE_TIMEOUT)
+        try:
+            while not self._stop.is_set():
+                try:
+                    first = self._queue.get(timeout=5)
+                except queue.Empty:
+                    pool.prune()
+                    continue
+                if first is None:
+                    return
+                batch = [first]
+                while len(batch) < self.batch_size:
+                    try:
+                        outbox_id = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if outbox_id is None:
+                        self._queue.put(None)
+                        break
+                    batch.append(outbox_id)
+                try:
+                    self._deliver(batch, pool)
+                except Exception as e:
+                    logger.exception("Errore consegna email: %s", e)
+                pool.prune()
+        finally:
+            pool.close_all()
+
+    def _deliver(self, ids: list[int], pool: SMTPConnectionPool):
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            claimed = db.scalars(
+                update(EmailOutbox)
+                .where(
+                    EmailOutbox.id.in_(set(ids)),
+                    EmailOutbox.status == "pending",
+                    EmailOutbox.next_attempt_at <= now,
+                )
+                .values(
+                    next_attempt_at=now + timedelta(seconds=LEASE_SECONDS),
+                    attempts=EmailOutbox.attempts + 1,
+                )
+                .returning(EmailOutbox.id)
+            ).all()
+            db.commit()
+            if not claimed:
+                return
+
+            # Raggruppa per connessione SMTP così ogni gruppo usa una sola sessione
+            groups = defaultdict(list)
+            query = select(EmailOutbox).options(selectinload(EmailOutbox.user)).where(EmailOutbox.id.in_(claimed))
+            for message in db.scalars(query):
+                config = email_utils.resolve_smtp_config(message.user)
+                if config is None:
+                    message.status = "failed"
+                    message.last_error = "SMTP non configurato"
+                    continue
+                groups[config].append(message)
+
+            for config, messages in groups.items():
+                for message in messages:
+                    recipients = [r.strip() for r in message.recipients.split(",") if r.strip()]
+                    msg = email_utils.build_message(message.sender, recipients, message.subject, message.body)
+                    try:
+                        pool.send(config, msg, recipients)
+                    except Exception as e:
+                        self._schedule_retry(message, e)
+                    else:
+                        message.status = "sent"
+                        message.sent_at = datetime.utcnow()
+                        message.last_error = None
+                db.commit()
+        finally:
+            db.close()
+
+    @staticmethod
+    def _schedule_retry(message: EmailOutbox, error: Exception):
+        message.last_error = str(error)[:1000]
+        if message.attempts >= settings.EMAIL_MAX_ATTEMPTS:
+            message.status = "failed"
+            logger.error(
+                "Errore invio email %s, tentativi esauriti: %s", message.id, error, extra={"outbox_id": message.id},
+            )
+            return
+        delay = min(settings.EMAIL_RETRY_BASE_SECONDS * 2 ** (message.attempts - 1), MAX_RETRY_DELAY_SECONDS)
+        message.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+        logger.warning(
+            "Errore invio email %s, nuovo tentativo tra %ss: %s", message.id, delay, error,
+            extra={"outbox_id": message.id, "attempts": message.attempts},
+        )
+
+dispatcher = EmailDispatcher(
+    workers=settings.EMAIL_WORKERS,
+    batch_size=settings.EMAIL_BATCH_SIZE,
+    poll_interval=settings.EMAIL_POLL_INTERVAL,
+)
@@ -1,47 +1,54 @@
+import logging
 import smtplib
-from email.message import EmailMessage
-from .config import get_settings
-from .models import User
-
-settings = get_settings()
-
-import smtplib
+from typing import NamedTuple
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime
+from sqlalchemy.orm import Session
 from .config import get_settings
+from .models import EmailOutbox
+from .logs import SAMPLED
 
-def send_license_email(license_data: dict, user=None):
-    """Invia email di notifica uso licenza"""
-    try:
-        settings = get_settings()
-        
-        # Utilizza le impostazioni SMTP dell'utente se disponibili, altrimenti quelle di sistema
-        smtp_host = user.smtp_host if user and user.smtp_host else settings.SMTP_HOST
-        smtp_port = user.smtp_port if user and user.smtp_port else settings.SMTP_PORT
-        smtp_username = user.smtp_username if user and user.smtp_username else settings.SMTP_USERNAME
-        smtp_password = user.smtp_password if user and user.smtp_password else settings.SMTP_PASSWORD
-        smtp_from = user.smtp_from if user and user.smtp_from else settings.SMTP_FROM
-        smtp_use_tls = user.smtp_use_tls if user and hasattr(user, 'smtp_use_tls') and user.smtp_use_tls is not None else True
-        
-        # Se non ci sono configurazioni SMTP, salta l'invio email
-        if not smtp_host or not smtp_from:
-            print("SMTP non configurato, salto invio email")
-            return True
-            
-        msg = MIMEMultipart()
-        msg["Subject"] = f"Licenza utilizzata: {license_data['product_name']}"
-        msg["From"] = smtp_from
-        
-        # Determina i destinatari
-        recipients = [smtp_from]
-        if user and user.email and user.email != smtp_from:
-            recipients.append(user.email)
-        
-        msg["To"] = ", ".join(recipients)
-        
-        # Corpo del messaggio
-        body = f"""
+logger = logging.getLogger(__name__)
+
+class SMTPConfig(NamedTuple):
+    host: str
+    port: int
+    username: str | None
+    password: str | None
+    sender: str
+    use_tls: bool
+
+    @property
+    def pool_key(self) -> tuple:
+        """Chiave con cui le connessioni SMTP vengono riutilizzate"""
+        return (self.host, self.port, self.username)
+
+def resolve_smtp_config(user=None) -> SMTPConfig | None:
+    """Impostazioni SMTP dell'utente se disponibili, altrimenti quelle di sistema"""
+    settings = get_settings()
+    smtp_host = user.smtp_host if user and user.smtp_host else settings.SMTP_HOST
+    smtp_port = user.smtp_port if user and user.smtp_port else settings.SMTP_PORT
+    smtp_username = user.smtp_username if user and user.smtp_username else settings.SMTP_USERNAME
+    smtp_password = user.smtp_password if user and user.smtp_password else settings.SMTP_PASSWORD
+    smtp_from = user.smtp_from if user and user.smtp_from else settings.SMTP_FROM
+    smtp_use_tls = user.smtp_use_tls if user and hasattr(user, 'smtp_use_tls') and user.smtp_use_tls is not None else True
+
+    # Se non ci sono configurazioni SMTP, l'invio email viene saltato
+    if not smtp_host or not smtp_from:
+        return None
+    return SMTPConfig(smtp_host, smtp_port, smtp_username, smtp_password, smtp_from, smtp_use_tls)
+
+def license_email_recipients(config: SMTPConfig, user=None) -> list[str]:
+    recipients = [config.sender]
+    if user and user.email and user.email != config.sender:
+        recipients.append(user.email)
+    return recipients
+
+def license_email_content(license_data: dict) -> tuple[str, str]:
+    """Oggetto e corpo dell'email di notifica uso licenza"""
+    subject = f"Licenza utilizzata: {license_data['product_name']}"
+    body = f"""
 Salve,
 
 È stata utilizzata una licenza nel sistema:
@@ -57,20 +64,79 @@ Data utilizzo: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
 Cordiali saluti,
 Sistema di gestione licenze
         """
-        
-        msg.attach(MIMEText(body, "plain"))
-        
-        with smtplib.SMTP(smtp_host, smtp_port) as s:
-            if smtp_use_tls:
-                s.starttls()
-            if smtp_username and smtp_password:
-                s.login(smtp_username, smtp_password)
-            s.send_message(msg, to_addrs=recipients)
-            
-        print("Email di notifica inviata con successo")
-        return True
-        
-    except Exception as e:
-        print(f"Errore invio email: {e}")
-        # Non sollevare eccezione per non bloccare l'operazione principale
-        return False
+    return subject, body
+
+def license_digest_content(licenses_data: list[dict]) -> tuple[str, str]:
+    """Oggetto e corpo di un'unica email per più licenze utilizzate insieme"""
+    subject = f"Licenze utilizzate: {len(licenses_data)}"
+    lines = "\n".join(
+        f"- {data['product_name']} {data.get('version', 'N/A')} "
+        f"({data.get('vendor', 'N/A')}, {data.get('category_name', 'N/A')})"
+        for data in licenses_data
+    )
+    iso_download = any(data.get('iso_download') for data in licenses_data)
+    body = f"""
+Salve,
+
+Sono state utilizzate {len(licenses_data)} licenze nel sistema:
+
+{lines}
+
+Data utilizzo: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}
+
+{'Download ISO richiesto' if iso_download else 'Nessun download ISO richiesto'}
+
+Cordiali saluti,
+Sistema di gestione licenze
+        """
+    return subject, body
+
+def build_message(sender: str, recipients: list[str], subject: str, body: str) -> MIMEMultipart:
+    msg = MIMEMultipart()
+    msg["Subject"] = subject
+    msg["From"] = sender
+    msg["To"] = ", ".join(recipients)
+    msg.attach(MIMEText(body, "plain"))
+    return msg
+
+def open_smtp_connection(config: SMTPConfig) -> smtplib.SMTP:
+    """Apre una connessione SMTP autenticata, con timeout"""
+    smtp = smtplib.SMTP(config.host, config.port, timeout=get_settings().SMTP_TIMEOUT)
+    try:
+        if config.use_tls:
+            smtp.starttls()
+        if config.username and config.password:
+            smtp.login(config.username, config.password)
+    except Exception:
+        smtp.close()
+        raise
+    return smtp
+
+def queue_license_email(db: Session, license_data: dict, user=None) -> EmailOutbox | None:
+    """Accoda l'email di notifica uso licenza nella outbox.
+
+    La riga viene aggiunta alla sessione senza commit, così viene salvata nella
+    stessa transazione dell'operazione che l'ha generata; dopo il commit
+    l'id va passato a email_queue.dispatcher.notify().
+    """
+    return _queue_email(db, license_email_content(license_data), user)
+
+def queue_license_digest_email(db: Session, licenses_data: list[dict], user=None) -> EmailOutbox | None:
+    """Come queue_license_email, con un solo messaggio per tutte le licenze"""
+    return _queue_email(db, license_digest_content(licenses_data), user)
+
+def _queue_email(db: Session, content: tuple[str, str], user=None) -> EmailOutbox | None:
+    config = resolve_smtp_config(user)
+    if config is None:
+        logger.info("SMTP non configurato, salto invio email", extra=SAMPLED)
+        return None
+    subject, body = content
+    outbox = EmailOutbox(
+        user_id=user.id if user else None,
+        sender=config.sender,
+        recipients=", ".join(license_email_recipients(config, user)),
+        subject=subject,
+        body=body,
+    )
+    db.add(outbox)
+    return outbox
@@ -0,0 +1,198 @@
+"""
+Eventi di modifica di licenze e categorie per il feed SSE /events.
+
+Gli handler registrano gli eventi nella sessione con publish(); vengono
+inviati solo se la transazione va a buon fine:
+
+- PostgreSQL: pg_notify nella stessa transazione (consegnato al commit) e un
+  solo LISTEN per worker, in un thread dedicato, che distribuisce a tutti i
+  client SSE del processo;
+- altri database (SQLite, sviluppo locale): consegna diretta ai client del
+  processo dopo il commit, senza propagazione agli altri worker.
+
+Gli eventi non sono persistenti: dopo una riconnessione, o se un client resta
+indietro, riceve un evento "resync" e deve aggiornarsi con /sync.
+
+I browser aprono il feed con EventSource, che non invia header: si autenticano
+con ?token= ottenuto da POST /events/token (breve, valido solo per il feed).
+"""
+import asyncio
+import json
+import logging
+import select
+import threading
+from datetime import datetime
+from sqlalchemy import event as sa_event, func
+from sqlalchemy import select as sa_select
+from sqlalchemy.orm import Session
+from .database import engine
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "mykeymanager_events"
+PENDING_KEY = "pending_events"
+# Oltre questo numero di id l'evento riporta solo il conteggio (limite di pg_notify: 8000 byte)
+MAX_EVENT_IDS = 200
+SUBSCRIBER_QUEUE_SIZE = 100
+HEARTBEAT_SECONDS = 15
+RECONNECT_SECONDS = 5
+# Niente cache né buffering dei proxy (nginx) sulla risposta SSE
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def publish(db, type_: str, entity: str, ids: list[int], user=None):
+    """Registra un evento (created, updated, deleted, used) da inviare al commit di `db`"""
+    if not ids:
+        return
+    event = {
+        "type": type_,
+        "entity": entity,
+        "count": len(ids),
+        "user": getattr(user, "username", None),
+        "at": datetime.utcnow().isoformat(),
+    }
+    if len(ids) <= MAX_EVENT_IDS:
+        event["ids"] = list(ids)
+    db.info.setdefault(PENDING_KEY, []).append(event)
+
+class Subscription:
+    """Coda di un client SSE, alimentata da qualsiasi thread"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def push(self, event: dict):
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            pass  # loop chiuso: il client si è già disconnesso
+
+    def _put(self, event: dict):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Client troppo lento: gli eventi in coda sono inutili, deve risincronizzarsi
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync"})
+
+class PostgresListener:
+    """Una connessione LISTEN per processo, fuori dal pool, in un thread dedicato"""
+
+    def __init__(self, channel: str, dispatch):
+        self.channel = channel
+        self.dispatch = dispatch
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen, name="events-listen", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def _listen(self):
+        connected_before = False
+        while not self._stop.is_set():
+            raw = None
+            try:
+                raw = engine.raw_connection()
+                # Connessione tenuta per tutta la vita del processo: non conta nel pool
+                raw.detach()
+                conn = raw.driver_connection
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {self.channel}")
+                if connected_before:
+                    # Le notifiche durante la disconnessione sono perse
+                    self.dispatch({"type": "resync"})
+                connected_before = True
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self.dispatch(json.loads(conn.notifies.pop(0).payload))
+            except Exception as e:
+                logger.warning("LISTEN %s non disponibile: %s", self.channel, e)
+                self._stop.wait(RECONNECT_SECONDS)
+            finally:
+                if raw is not None:
+                    try:
+                        raw.close()
+                    except Exception:
+                        pass
+
+class EventBroker:
+    """Distribuisce gli eventi ai client SSE del processo"""
+
+    def __init__(self):
+        self._subscribers: set[Subscription] = set()
+        self._lock = threading.Lock()
+        self.listener = (
+            PostgresListener(CHANNEL, self.dispatch) if engine.dialect.name == "postgresql" else None
+        )
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription(asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.add(subscription)
+        if self.listener is not None:
+            # LISTEN avviato al primo client, poi condiviso da tutti
+            self.listener.start()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def dispatch(self, event: dict):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.push(event)
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.stop()
+
+broker = EventBroker()
+
+@sa_event.listens_for(Session, "before_commit")
+def _notify_postgres(session: Session):
+    if session.get_bind().dialect.name != "postgresql":
+        return
+    for event in session.info.pop(PENDING_KEY, ()):
+        session.execute(sa_select(func.pg_notify(CHANNEL, json.dumps(event))))
+
+@sa_event.listens_for(Session, "after_commit")
+def _deliver_local(session: Session):
+    for event in session.info.pop(PENDING_KEY, ()):
+        broker.dispatch(event)
+
+@sa_event.listens_for(Session, "after_rollback")
+def _discard(session: Session):
+    session.info.pop(PENDING_KEY, None)
+
+def format_event(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+async def stream():
+    """Corpo della risposta SSE: eventi del broker e un commento periodico di keep-alive"""
+    subscription = broker.subscribe()
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            yield format_event(event)
+    finally:
+        broker.unsubscribe(subscription)
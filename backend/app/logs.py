@@ -0,0 +1,153 @@
+"""
+Log strutturati in JSON senza I/O nei thread delle richieste.
+
+I record vanno in una coda in memoria (QueueHandler) e un solo thread
+(QueueListener) li formatta in JSON e li scrive su stdout. Ogni record
+riceve l'id della richiesta in corso, impostato da RequestLogMiddleware e
+restituito al client nell'header X-Request-ID.
+
+Campionamento: un record con l'attributo `sample_rate` (es.
+extra={"sample_rate": 0.1}) viene tenuto con quella probabilità. Il log di
+accesso lo usa per le richieste riuscite e veloci; errori e richieste lente
+vengono sempre registrati.
+"""
+import logging
+import queue
+import random
+import re
+import secrets
+import sys
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+import orjson
+from .config import get_settings
+
+settings = get_settings()
+
+request_id_var: ContextVar[str | None] = ContextVar("request_id", default=None)
+REQUEST_ID_HEADER = "X-Request-ID"
+# Id ricevuti dal proxy: accettati solo se brevi e senza caratteri strani
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+# Attributi standard di LogRecord: il resto (extra=...) finisce nel JSON
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id", "sample_rate"}
+
+access_logger = logging.getLogger("app.access")
+# extra= per gli eventi frequenti
+SAMPLED = {"sample_rate": settings.LOG_SAMPLE_RATE}
+
+class RequestContextFilter(logging.Filter):
+    """Aggiunge l'id della richiesta e scarta i record non campionati.
+
+    Eseguito nel thread che emette il record, dove la ContextVar è visibile.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        sample_rate = getattr(record, "sample_rate", None)
+        if sample_rate is not None and random.random() >= sample_rate:
+            return False
+        record.request_id = request_id_var.get()
+        return True
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        data.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exception"] = record.exc_text
+        return orjson.dumps(data, default=str).decode()
+
+class _QueueHandler(QueueHandler):
+    """Come QueueHandler, ma lascia la formattazione (e l'eccezione) al listener"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+_listener: QueueListener | None = None
+
+def configure_logging(stream=None) -> QueueListener:
+    """Coda sul logger radice e thread di scrittura; idempotente"""
+    global _listener
+    if _listener is not None:
+        return _listener
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JSONFormatter() if settings.LOG_JSON else logging.Formatter(
+        "%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"
+    ))
+    # Coda non limitata: chi emette un log non aspetta mai
+    handler = _QueueHandler(queue.SimpleQueue())
+    handler.addFilter(RequestContextFilter())
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(settings.LOG_LEVEL)
+    _listener = QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+def stop_logging():
+    """Scrive i record ancora in coda e ferma il thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def _incoming_request_id(scope) -> str | None:
+    for name, value in scope.get("headers", ()):
+        if name == b"x-request-id":
+            value = value.decode("latin-1")
+            return value if _VALID_REQUEST_ID.match(value) else None
+    return None
+
+class RequestLogMiddleware:
+    """Middleware ASGI: id della richiesta, header X-Request-ID e log di accesso campionato"""
+
+    def __init__(self, app):
+        self.app = app
+        self.header = REQUEST_ID_HEADER.lower().encode("latin-1")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_id = _incoming_request_id(scope) or secrets.token_hex(8)
+        token = request_id_var.set(request_id)
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_with_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = [*message.get("headers", ()), (self.header, request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            always = status_code >= 500 or duration_ms >= settings.LOG_SLOW_REQUEST_MS
+            access_logger.info(
+                "%s %s %s", scope["method"], scope["path"], status_code,
+                extra={
+                    "method": scope["method"],
+                    "route": getattr(scope.get("route"), "path", None),
+                    "status": status_code,
+                    "duration_ms": round(duration_ms, 2),
+                    "sample_rate": None if always else settings.LOG_SAMPLE_RATE,
+                },
+            )
+            request_id_var.reset(token)
@@ -1,113 +1,101 @@
+import os
 from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse
 from .config import get_settings
 from .api.router import api_router
-from .database import Base, engine, SessionLocal
-from .models import User
-from .security import get_password_hash
-from .rate_limit import limiter
+from .database import engine, async_engine, pool_status, replicas, sqlite_write_queue
+from .security import password_hasher, PasswordHasherBusy
+from .migrate import ensure_schema
+from .rate_limit import RateLimitMiddleware
 from .security_headers import SecurityHeadersMiddleware
-from slowapi.middleware import SlowAPIMiddleware
+from .logs import RequestLogMiddleware, configure_logging, stop_logging
+from .email_queue import dispatcher as email_dispatcher
+from .cache import user_cache_invalidation
+from .events import broker as event_broker
+from . import metrics
 
 settings = get_settings()
+configure_logging()
 
-
-app = FastAPI(title=settings.PROJECT_NAME)
+# orjson per tutte le risposte serializzate da FastAPI (response_model)
+app = FastAPI(title=settings.PROJECT_NAME, default_response_class=ORJSONResponse)
 app.add_middleware(CORSMiddleware,
     allow_origins=[o.strip() for o in settings.ALLOWED_ORIGINS.split(',')],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "X-Request-ID"],
 )
+app.add_middleware(RateLimitMiddleware)
+# Esterno al rate limit: anche le risposte 429 ricevono gli header di sicurezza
 app.add_middleware(SecurityHeadersMiddleware)
-app.state.limiter = limiter
-app.add_middleware(SlowAPIMiddleware)
-
-def security_headers_middleware():  # lightweight custom headers
-    async def _mw(request: Request, call_next):
-        response: Response = await call_next(request)
-        response.headers.setdefault("X-Frame-Options", "DENY")
-        response.headers.setdefault("X-Content-Type-Options", "nosniff")
-        response.headers.setdefault("Referrer-Policy", "no-referrer")
-        # Basic CSP (frontend adds stricter headers in nginx)
-        response.headers.setdefault(
-            "Content-Security-Policy",
-            "default-src 'self'; img-src 'self' data:; style-src 'self' 'unsafe-inline' https://fonts.googleapis.com; style-src-elem 'self' 'unsafe-inline' https://fonts.googleapis.com; font-src 'self' https://fonts.gstatic.com; script-src 'self' https://unpkg.com; script-src-elem 'self' https://unpkg.com; object-src 'none'; frame-ancestors 'none'",
-        )
-        return response
-    return _mw
-
-app.middleware("http")(security_headers_middleware())
+# Id della richiesta per tutti i log emessi dai middleware interni e dagli handler
+app.add_middleware(RequestLogMiddleware)
+if settings.METRICS_ENABLED:
+    # Aggiunto per ultimo: è il middleware più esterno e misura l'intera richiesta
+    app.add_middleware(metrics.MetricsMiddleware)
+    metrics.instrument_engine(engine)
+    if async_engine is not None:
+        metrics.instrument_engine(async_engine.sync_engine)
 
 app.include_router(api_router, prefix=settings.API_V1_PREFIX)
 
-# Create tables & default user (single-user system)
-Base.metadata.create_all(bind=engine)
-
-# Run migration for user table fields
-def run_user_migration():
-    """Run migration to add new user fields if they don't exist"""
-    from sqlalchemy import text
-    from sqlalchemy.exc import ProgrammingError
-    
-    # List of columns to add
-    columns_to_add = [
-        "ALTER TABLE users ADD COLUMN IF NOT EXISTS email VARCHAR;",
-        "ALTER TABLE users ADD COLUMN IF NOT EXISTS full_name VARCHAR;", 
-        "ALTER TABLE users ADD COLUMN IF NOT EXISTS is_active BOOLEAN DEFAULT true;",
-        "ALTER TABLE users ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;",
-        "ALTER TABLE users ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;"
-    ]
-    
-    with engine.connect() as connection:
-        for sql in columns_to_add:
-            try:
-                connection.execute(text(sql))
-                connection.commit()
-                print(f"Migration executed: {sql}")
-            except ProgrammingError as e:
-                print(f"Migration error (may be expected if column exists): {e}")
-                continue
+@app.on_event("startup")
+def start_background_services():
+    # Migrazioni fuori dall'import: qui solo il controllo della versione dello schema
+    ensure_schema(engine)
+    email_dispatcher.start()
+    if user_cache_invalidation is not None:
+        user_cache_invalidation.start()
+    if replicas is not None:
+        replicas.start()
 
-run_user_migration()
+@app.on_event("shutdown")
+def stop_background_services():
+    email_dispatcher.stop()
+    if user_cache_invalidation is not None:
+        user_cache_invalidation.stop()
+    event_broker.stop()
+    if replicas is not None:
+        replicas.stop()
+    password_hasher.shutdown()
+    metrics.mark_process_dead()
+    stop_logging()
 
-def ensure_default_user():
-    db = SessionLocal()
-    try:
-        username = "admin"
-        password = "ChangeMe!123"
-        user = db.query(User).filter(User.username == username).first()
-        if not user:
-            user = User(
-                username=username, 
-                password_hash=get_password_hash(password),
-                email="admin@example.com",
-                full_name="Administrator",
-                is_active=True
-            )
-            db.add(user)
-            db.commit()
-        else:
-            # Update existing user with default values for new fields if they're missing
-            updated = False
-            if not hasattr(user, 'email') or not user.email:
-                user.email = "admin@example.com"
-                updated = True
-            if not hasattr(user, 'full_name') or not user.full_name:
-                user.full_name = "Administrator"
-                updated = True
-            if not hasattr(user, 'is_active') or user.is_active is None:
-                user.is_active = True
-                updated = True
-            
-            if updated:
-                db.commit()
-                print("Updated existing admin user with new fields")
-    finally:
-        db.close()
-
-ensure_default_user()
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Troppi accessi contemporanei, riprova tra qualche secondo"},
+        headers={"Retry-After": "2"},
+    )
 
 @app.get("/health")
 async def health():
     return {"status": "ok"}
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    data, content_type = metrics.render_latest()
+    return Response(content=data, media_type=content_type)
+
+@app.get("/metrics/db")
+async def db_pool_metrics():
+    """Stato del pool di connessioni di questo worker, per dimensionare DB_POOL_SIZE"""
+    workers = int(os.environ.get("UVICORN_WORKERS", "1"))
+    per_worker = settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW
+    data = {
+        "pid": os.getpid(),
+        "workers": workers,
+        "max_connections_per_worker": per_worker,
+        "max_connections_total": per_worker * workers,
+        "engine": pool_status(engine),
+    }
+    if async_engine is not None:
+        data["async_engine"] = pool_status(async_engine.sync_engine)
+    if replicas is not None:
+        data["replicas"] = replicas.status()
+    if sqlite_write_queue is not None:
+        data["sqlite_write_queue"] = sqlite_write_queue.wait_stats.snapshot()
+    return data
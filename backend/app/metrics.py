@@ -0,0 +1,116 @@
+"""
+Metriche Prometheus: richieste per route, query al database, bcrypt e SMTP.
+
+Con più worker uvicorn impostare PROMETHEUS_MULTIPROC_DIR su una directory
+vuota e scrivibile (condivisa dai worker e svuotata a ogni avvio, prima di
+lanciare uvicorn: vedi devops/Dockerfile.backend): ogni processo scrive i
+propri valori lì e /metrics li aggrega.
+"""
+import os
+import time
+from contextvars import ContextVar
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest,
+)
+from sqlalchemy import event
+
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUESTS = Counter(
+    "mkm_http_requests_total", "Richieste HTTP", ["method", "route", "status"]
+)
+REQUEST_LATENCY = Histogram(
+    "mkm_http_request_duration_seconds", "Durata delle richieste HTTP", ["method", "route"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUEST_DB_QUERIES = Histogram(
+    "mkm_http_request_db_queries", "Query SQL eseguite per richiesta", ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+REQUEST_DB_SECONDS = Histogram(
+    "mkm_http_request_db_seconds", "Tempo speso in query SQL per richiesta", ["method", "route"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_QUERIES = Counter("mkm_db_queries_total", "Query SQL eseguite (incluse quelle in background)")
+PASSWORD_VERIFY_SECONDS = Histogram(
+    "mkm_password_verify_seconds", "Durata della verifica bcrypt",
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 2, 5),
+)
+SMTP_SEND_SECONDS = Histogram(
+    "mkm_smtp_send_seconds", "Durata dell'invio di un messaggio SMTP",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+SMTP_SEND_FAILURES = Counter("mkm_smtp_send_failures_total", "Invii SMTP falliti")
+
+# Contatori SQL della richiesta in corso: [numero query, secondi]. La lista è
+# condivisa con i thread del threadpool, che ricevono una copia del contesto.
+_request_db_stats: ContextVar[list | None] = ContextVar("request_db_stats", default=None)
+
+def instrument_engine(engine):
+    """Registra gli event listener che contano query e tempo SQL"""
+
+    # L'inizio sta nel contesto di esecuzione della singola istruzione: se
+    # l'istruzione fallisce after_cursor_execute non arriva e non resta nulla
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_query_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._metrics_query_start
+        DB_QUERIES.inc()
+        stats = _request_db_stats.get()
+        if stats is not None:
+            stats[0] += 1
+            stats[1] += elapsed
+
+class MetricsMiddleware:
+    """Middleware ASGI che misura latenza e query SQL per template di route"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status_code = 500
+        stats = [0, 0.0]
+        token = _request_db_stats.set(stats)
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_db_stats.reset(token)
+            # Il template (es. /api/v1/licenses/{license_id}) limita la cardinalità delle label
+            route = getattr(scope.get("route"), "path", "unmatched")
+            method = scope["method"]
+            REQUESTS.labels(method, route, str(status_code)).inc()
+            REQUEST_LATENCY.labels(method, route).observe(elapsed)
+            REQUEST_DB_QUERIES.labels(method, route).observe(stats[0])
+            REQUEST_DB_SECONDS.labels(method, route).observe(stats[1])
+
+def render_latest() -> tuple[bytes, str]:
+    """Metriche in formato testo Prometheus, aggregate tra i processi se necessario"""
+    if MULTIPROCESS:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+def mark_process_dead():
+    if MULTIPROCESS:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(os.getpid())
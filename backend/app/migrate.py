@@ -0,0 +1,257 @@
+"""
+Migrazioni dello schema con tabella di versione.
+
+Da riga di comando (una sola volta per deploy):
+
+    python -m app.migrate            # applica le migrazioni mancanti
+    python -m app.migrate status     # mostra la versione corrente
+    python -m app.migrate partitions # partizioni mensili di license_usage (USAGE_PARTITIONING)
+    python -m app.migrate category-summary  # trigger e ricalcolo degli aggregati per categoria
+    python -m app.migrate prune-tombstones  # eliminazioni più vecchie di SYNC_TOMBSTONE_DAYS
+
+All'avvio ogni worker esegue solo ensure_schema(): una SELECT sulla versione.
+Se lo schema è indietro e MIGRATE_ON_STARTUP è attivo, le migrazioni vengono
+applicate da un solo processo alla volta (advisory lock su PostgreSQL, lock
+su un file accanto al database con SQLite).
+"""
+import logging
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import (
+    Column, DateTime, Integer, MetaData, String, Table, func, inspect, select, text,
+)
+from sqlalchemy.engine import Connection, Engine
+from .config import get_settings
+from .database import Base
+from . import models, search, usage, category_summary, sync
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+schema_metadata = MetaData()
+schema_version = Table(
+    "schema_version", schema_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(100), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+# Chiave arbitraria dell'advisory lock che serializza le migrazioni su PostgreSQL
+MIGRATION_LOCK_KEY = 727_100_001
+
+def add_column_if_missing(conn: Connection, table: str, column: str, ddl: str):
+    """ALTER TABLE ... ADD COLUMN solo se la colonna non esiste"""
+    existing = {c["name"] for c in inspect(conn).get_columns(table)}
+    if column not in existing:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+def _create_tables(conn: Connection):
+    # Solo le tabelle originali: quelle aggiunte dopo vengono create dalla propria migrazione
+    Base.metadata.create_all(conn, tables=[
+        models.Category.__table__,
+        models.License.__table__,
+        models.User.__table__,
+        models.EmailOutbox.__table__,
+    ])
+
+def _user_profile_fields(conn: Connection):
+    # Database creati prima dei campi profilo (vedi migrations/add_user_fields.py)
+    add_column_if_missing(conn, "users", "email", "VARCHAR(150)")
+    add_column_if_missing(conn, "users", "full_name", "VARCHAR(200)")
+    add_column_if_missing(conn, "users", "is_active", "BOOLEAN DEFAULT true")
+    add_column_if_missing(conn, "users", "created_at", "TIMESTAMP")
+    add_column_if_missing(conn, "users", "updated_at", "TIMESTAMP")
+    conn.execute(text(
+        "UPDATE users SET is_active = COALESCE(is_active, true), "
+        "created_at = COALESCE(created_at, CURRENT_TIMESTAMP), "
+        "updated_at = COALESCE(updated_at, CURRENT_TIMESTAMP)"
+    ))
+
+def _user_smtp_fields(conn: Connection):
+    # Database creati prima delle impostazioni SMTP per utente (vedi migrate_smtp.py)
+    add_column_if_missing(conn, "users", "smtp_host", "VARCHAR(255)")
+    add_column_if_missing(conn, "users", "smtp_port", "INTEGER")
+    add_column_if_missing(conn, "users", "smtp_username", "VARCHAR(255)")
+    add_column_if_missing(conn, "users", "smtp_password", "VARCHAR(255)")
+    add_column_if_missing(conn, "users", "smtp_from", "VARCHAR(255)")
+    add_column_if_missing(conn, "users", "smtp_use_tls", "BOOLEAN DEFAULT true")
+
+def _license_indexes(conn: Connection):
+    # create_all non aggiunge indici a tabelle già esistenti
+    for index in models.License.__table__.indexes:
+        index.create(conn, checkfirst=True)
+
+def _default_admin_user(conn: Connection):
+    from .security import get_password_hash
+
+    users = models.User.__table__
+    admin = conn.execute(select(users.c.id, users.c.email, users.c.full_name).where(users.c.username == "admin")).first()
+    if admin is None:
+        now = datetime.utcnow()
+        conn.execute(users.insert().values(
+            username="admin",
+            password_hash=get_password_hash("ChangeMe!123"),
+            email="admin@example.com",
+            full_name="Administrator",
+            is_active=True,
+            created_at=now,
+            updated_at=now,
+            smtp_use_tls=True,
+        ))
+        logger.info("Creato utente admin predefinito")
+    elif not admin.email or not admin.full_name:
+        conn.execute(users.update().where(users.c.id == admin.id).values(
+            email=admin.email or "admin@example.com",
+            full_name=admin.full_name or "Administrator",
+        ))
+
+def _license_search_index(conn: Connection):
+    # Solo PostgreSQL: con gli altri database la ricerca usa l'indice in memoria
+    if conn.dialect.name == "postgresql":
+        search.create_postgres_index(conn)
+
+def _license_usage(conn: Connection):
+    usage.create_tables(conn)
+
+def _category_summary(conn: Connection):
+    # I trigger servono solo con il riepilogo materializzato
+    if settings.CATEGORY_SUMMARY_MATERIALIZED:
+        category_summary.install(conn)
+    else:
+        models.CategoryVendorStats.__table__.create(conn, checkfirst=True)
+
+def _sync_change_seq(conn: Connection):
+    sync.install(conn)
+
+# (versione, nome, funzione): aggiungere in coda, non modificare quelle già rilasciate
+MIGRATIONS = [
+    (1, "create_tables", _create_tables),
+    (2, "user_profile_fields", _user_profile_fields),
+    (3, "user_smtp_fields", _user_smtp_fields),
+    (4, "license_indexes", _license_indexes),
+    (5, "default_admin_user", _default_admin_user),
+    (6, "license_search_index", _license_search_index),
+    (7, "license_usage", _license_usage),
+    (8, "category_summary", _category_summary),
+    (9, "sync_change_seq", _sync_change_seq),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def current_version(conn: Connection) -> int:
+    if not inspect(conn).has_table("schema_version"):
+        return 0
+    return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+@contextmanager
+def migration_lock(conn: Connection):
+    """Lock esclusivo tra processi per la durata di upgrade().
+
+    PostgreSQL: advisory lock di sessione. SQLite: flock su <database>.migrate.lock,
+    perché i worker che avviano insieme ensure_schema non vanno in errore sulle
+    stesse ALTER TABLE (il DDL di pysqlite non è transazionale).
+    """
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        conn.commit()
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+            conn.commit()
+        return
+    database = conn.engine.url.database
+    if conn.dialect.name != "sqlite" or not database or database == ":memory:":
+        yield
+        return
+    import fcntl
+    with open(f"{database}.migrate.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def upgrade(engine: Engine) -> list[str]:
+    """Applica le migrazioni mancanti, ognuna nella propria transazione"""
+    applied = []
+    with engine.connect() as conn, migration_lock(conn):
+        # Versione letta solo dopo il lock: un altro processo può averla appena aggiornata
+        schema_metadata.create_all(conn)
+        version = current_version(conn)
+        conn.commit()
+        for number, name, migration in MIGRATIONS:
+            if number <= version:
+                continue
+            start = time.perf_counter()
+            with conn.begin():
+                migration(conn)
+                conn.execute(schema_version.insert().values(
+                    version=number, name=name, applied_at=datetime.utcnow()
+                ))
+            applied.append(name)
+            logger.info(
+                "Migrazione %s (%s) applicata", number, name,
+                extra={"migration": name, "duration_ms": round((time.perf_counter() - start) * 1000, 2)},
+            )
+    return applied
+
+def ensure_schema(engine: Engine):
+    """Controllo all'avvio del worker: migra solo se lo schema non è aggiornato"""
+    with engine.connect() as conn:
+        version = current_version(conn)
+    if version >= LATEST_VERSION:
+        return
+    if not settings.MIGRATE_ON_STARTUP:
+        raise RuntimeError(
+            f"Schema del database alla versione {version}, richiesta {LATEST_VERSION}: "
+            "eseguire 'python -m app.migrate'"
+        )
+    upgrade(engine)
+
+def main(argv: list[str]) -> int:
+    from .database import engine
+
+    command = argv[0] if argv else "upgrade"
+    if command == "status":
+        with engine.connect() as conn:
+            print(f"Versione schema: {current_version(conn)} (ultima: {LATEST_VERSION})")
+        return 0
+    if command == "upgrade":
+        applied = upgrade(engine)
+        print(f"{len(applied)} migrazioni applicate" if applied else "Schema già aggiornato")
+        return 0
+    if command == "partitions":
+        with engine.begin() as conn:
+            if conn.dialect.name != "postgresql" or not settings.USAGE_PARTITIONING:
+                print("Partizionamento non attivo (richiede PostgreSQL e USAGE_PARTITIONING)")
+                return 0
+            created = usage.ensure_partitions(conn)
+        print(f"Partizioni create: {', '.join(created)}" if created else "Partizioni già presenti")
+        return 0
+    if command == "category-summary":
+        with engine.begin() as conn:
+            category_summary.install(conn)
+        print("Trigger installati e aggregati per categoria ricalcolati")
+        return 0
+    if command == "prune-tombstones":
+        with engine.begin() as conn:
+            removed = sync.prune_tombstones(conn, settings.SYNC_TOMBSTONE_DAYS)
+        print(f"{removed} eliminazioni rimosse")
+        return 0
+    print(
+        f"Comando sconosciuto: {command} "
+        "(usare 'upgrade', 'status', 'partitions', 'category-summary' o 'prune-tombstones')"
+    )
+    return 2
+
+if __name__ == "__main__":
+    from .logs import configure_logging, stop_logging
+
+    configure_logging()
+    try:
+        code = main(sys.argv[1:])
+    finally:
+        stop_logging()
+    sys.exit(code)
@@ -5,30 +5,39 @@ Migration script to add new fields to User table
 from sqlalchemy import text
 from sqlalchemy.exc import ProgrammingError
 from ..database import engine
+from ..migrate import add_column_if_missing
 
 def run_migration():
     """Run the migration to add new user fields"""
     
-    # List of columns to add
+    # Columns to add (checked first: SQLite has no ADD COLUMN IF NOT EXISTS
+    # and no non-constant defaults, timestamps are filled in below)
     columns_to_add = [
-        "ALTER TABLE users ADD COLUMN IF NOT EXISTS email VARCHAR;",
-        "ALTER TABLE users ADD COLUMN IF NOT EXISTS full_name VARCHAR;",
-        "ALTER TABLE users ADD COLUMN IF NOT EXISTS is_active BOOLEAN DEFAULT true;",
-        "ALTER TABLE users ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;",
-        "ALTER TABLE users ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;"
+        ("email", "VARCHAR"),
+        ("full_name", "VARCHAR"),
+        ("is_active", "BOOLEAN DEFAULT true"),
+        ("created_at", "TIMESTAMP"),
+        ("updated_at", "TIMESTAMP"),
     ]
     
     with engine.connect() as connection:
-        for sql in columns_to_add:
+        for column, ddl in columns_to_add:
             try:
-                connection.execute(text(sql))
+                add_column_if_missing(connection, "users", column, ddl)
                 connection.commit()
-                print(f"Executed: {sql}")
+                print(f"Checked column: {column}")
             except ProgrammingError as e:
-                print(f"Error executing {sql}: {e}")
+                print(f"Error adding column {column}: {e}")
                 # Continue with other columns even if one fails
                 continue
     
+    with engine.connect() as connection:
+        connection.execute(text(
+            "UPDATE users SET created_at = COALESCE(created_at, CURRENT_TIMESTAMP), "
+            "updated_at = COALESCE(updated_at, CURRENT_TIMESTAMP)"
+        ))
+        connection.commit()
+    
     # Update existing admin user with default values if they don't have them
     update_admin_sql = """
     UPDATE users 
@@ -1,13 +1,16 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Boolean
+from sqlalchemy import BigInteger, Column, Integer, String, Date, DateTime, ForeignKey, Text, Boolean, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
+from . import schemas
 
 class Category(Base):
     __tablename__ = "categories"
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(100), unique=True, nullable=False, index=True)
     icon = Column(String(255), nullable=True)
+    # Sequenza di modifica assegnata dai trigger del database (vedi sync)
+    change_seq = Column(BigInteger, nullable=True)
     licenses = relationship("License", back_populates="category", cascade="all,delete")
 
 class License(Base):
@@ -23,8 +26,15 @@ class License(Base):
     last_used_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    # Sequenza di modifica assegnata dai trigger del database (vedi sync)
+    change_seq = Column(BigInteger, nullable=True)
     category = relationship("Category", back_populates="licenses")
 
+    __table_args__ = (
+        # Indice per la paginazione keyset sull'ordinamento di default
+        Index("ix_licenses_updated_at_id", "updated_at", "id"),
+    )
+
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
@@ -43,3 +53,75 @@ class User(Base):
     smtp_password = Column(String(255), nullable=True)
     smtp_from = Column(String(255), nullable=True)
     smtp_use_tls = Column(Boolean, default=True)
+
+class EmailOutbox(Base):
+    """Email in attesa di invio, consegnate in background da email_queue"""
+    __tablename__ = "email_outbox"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    sender = Column(String(255), nullable=False)
+    recipients = Column(Text, nullable=False)
+    subject = Column(String(255), nullable=False)
+    body = Column(Text, nullable=False)
+    status = Column(String(20), default="pending", nullable=False)  # pending | sent | failed
+    attempts = Column(Integer, default=0, nullable=False)
+    # Prossimo tentativo; mentre un worker invia funge anche da lease
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    sent_at = Column(DateTime, nullable=True)
+    user = relationship("User")
+
+    __table_args__ = (
+        Index("ix_email_outbox_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+class LicenseUsage(Base):
+    """Evento di utilizzo di una licenza: solo inserimenti, mai aggiornamenti"""
+    __tablename__ = "license_usage"
+    id = Column(Integer, primary_key=True)
+    license_id = Column(Integer, ForeignKey("licenses.id", ondelete="CASCADE"), nullable=False)
+    # Categoria al momento dell'utilizzo
+    category_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    used_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    iso_download = Column(Boolean, default=False, nullable=False)
+
+    __table_args__ = (
+        Index("ix_license_usage_license_used_at", "license_id", "used_at"),
+        Index("ix_license_usage_used_at", "used_at"),
+    )
+
+class LicenseUsageDaily(Base):
+    """Rollup giornaliero di license_usage, incrementato insieme a ogni evento"""
+    __tablename__ = "license_usage_daily"
+    day = Column(Date, primary_key=True)
+    license_id = Column(Integer, ForeignKey("licenses.id", ondelete="CASCADE"), primary_key=True)
+    category_id = Column(Integer, nullable=False)
+    count = Column(Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        Index("ix_license_usage_daily_category_day", "category_id", "day"),
+    )
+
+class CategoryVendorStats(Base):
+    """Aggregati delle licenze per (categoria, vendor), mantenuti da trigger (vedi category_summary)"""
+    __tablename__ = "category_vendor_stats"
+    category_id = Column(Integer, primary_key=True)
+    # Vendor mancante o vuoto: ''
+    vendor = Column(String(120), primary_key=True)
+    license_count = Column(Integer, nullable=False)
+    last_used_at = Column(DateTime, nullable=True)
+
+class SyncTombstone(Base):
+    """Licenza o categoria eliminata, per la sincronizzazione incrementale (vedi sync)"""
+    __tablename__ = "sync_tombstones"
+    seq = Column(BigInteger, primary_key=True, autoincrement=False)
+    entity = Column(String(20), nullable=False)  # license | category | pruned
+    entity_id = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, nullable=False)
+
+# Colonne dei campi di LicenseRead / CategoryRead: liste, export e /sync leggono
+# righe semplici senza costruire oggetti ORM
+LICENSE_COLUMNS = [getattr(License, name) for name in schemas.LicenseRead.model_fields]
+CATEGORY_COLUMNS = [getattr(Category, name) for name in schemas.CategoryRead.model_fields]
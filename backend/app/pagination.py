@@ -0,0 +1,39 @@
+"""
+Helper per la paginazione keyset (cursor) delle liste
+"""
+import base64
+import json
+from datetime import datetime
+from fastapi import HTTPException
+
+def encode_cursor(value, last_id: int, key: str | None = None) -> str:
+    """Codifica (valore di ordinamento, id) in un cursore opaco.
+
+    `key` identifica l'ordinamento che ha prodotto il cursore (es. "-updated_at"):
+    decode_cursor rifiuta i cursori usati con un ordinamento diverso.
+    """
+    if isinstance(value, datetime):
+        value = {"dt": value.isoformat()}
+    payload = [value, last_id] if key is None else [value, last_id, key]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str, key: str | None = None, value_type: type | None = None) -> tuple:
+    """Decodifica un cursore prodotto da encode_cursor con la stessa `key`.
+
+    Con `value_type` verifica anche il tipo del valore di ordinamento, così un
+    cursore manomesso non arriva alla query con un tipo sbagliato.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, last_id, *rest = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if isinstance(value, dict):
+            value = datetime.fromisoformat(value["dt"])
+        last_id = int(last_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if rest != ([] if key is None else [key]):
+        raise HTTPException(status_code=400, detail="Cursor does not match sort order")
+    if value_type is not None and not isinstance(value, value_type):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return value, last_id
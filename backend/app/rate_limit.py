@@ -1,15 +1,211 @@
-from slowapi import Limiter
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
-from fastapi import Request, Response
+"""
+Rate limiting condiviso tra i worker.
+
+I limiti sono finestre fisse ("100/hour") contate su Redis con uno script Lua
+atomico. Per evitare un round trip a ogni richiesta ogni worker prenota i
+permessi a blocchi (RATE_LIMIT_SYNC_BATCH) e li consuma localmente: il limite
+globale non viene mai superato, al più qualche permesso prenotato resta inutilizzato
+a fine finestra.
+
+Senza RATE_LIMIT_REDIS, o se Redis non risponde, i contatori restano nel
+processo (limite applicato per worker) e le richieste non vengono bloccate
+per l'indisponibilità di Redis.
+"""
+import logging
+import re
+import time
+from typing import NamedTuple
+import jwt
+from starlette.responses import JSONResponse
 from .config import get_settings
+from .security import ALGORITHM
 
 settings = get_settings()
-limiter = Limiter(key_func=get_remote_address, default_limits=[settings.RATE_LIMIT])
-
-async def rate_limit_middleware(request: Request, call_next):
-    try:
-        response = await call_next(request)
-        return response
-    except RateLimitExceeded as e:
-        return Response(status_code=429, content="Rate limit exceeded")
+logger = logging.getLogger(__name__)
+
+# Percorsi esclusi dal limite (health check e scraping delle metriche)
+EXEMPT_PATHS = {"/health", "/metrics", "/metrics/db"}
+# Dopo un errore Redis si usano i contatori locali per questo numero di secondi
+REDIS_RETRY_SECONDS = 5
+MAX_LOCAL_KEYS = 10000
+
+UNITS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+class RateLimit(NamedTuple):
+    amount: int
+    seconds: int
+
+    def __str__(self):
+        return f"{self.amount} per {self.seconds}s"
+
+def parse_limit(value: str) -> RateLimit:
+    """Interpreta limiti nel formato "100/hour", "10/minute" o "5/15 minutes" """
+    match = re.fullmatch(r"\s*(\d+)\s*(?:/|per)\s*(\d+)?\s*(second|minute|hour|day)s?\s*", value)
+    if not match:
+        raise ValueError(f"Limite non valido: {value!r}")
+    amount, count, unit = match.groups()
+    return RateLimit(int(amount), int(count or 1) * UNITS[unit])
+
+def parse_route_limits(value: str) -> dict[str, RateLimit]:
+    """RATE_LIMIT_ROUTES: "percorso=limite" separati da ";" """
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(";"))):
+        path, _, limit = item.partition("=")
+        limits[path.strip()] = parse_limit(limit)
+    return limits
+
+# Lua: concede fino a ARGV[1] permessi senza superare ARGV[2] nella finestra
+RESERVE_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local grant = math.min(tonumber(ARGV[1]), tonumber(ARGV[2]) - current)
+if grant <= 0 then
+    return 0
+end
+if redis.call('INCRBY', KEYS[1], grant) == grant then
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+end
+return grant
+"""
+
+class RateLimiter:
+    """Permessi per (limite, identità) prenotati a blocchi da Redis o contati localmente"""
+
+    PREFIX = "mykeymanager:rate-limit"
+
+    def __init__(self, redis_url: str | None, sync_batch: int):
+        self.redis_url = redis_url
+        self.sync_batch = max(sync_batch, 1)
+        self._client = None
+        self._script = None
+        self._redis_down_until = 0.0
+        # chiave -> [fine finestra, permessi prenotati rimasti, finestra esaurita]
+        self._buckets: dict[str, list] = {}
+        # chiave -> [fine finestra, richieste contate] se Redis non è usato
+        self._local: dict[str, list] = {}
+
+    def _redis(self):
+        if self._client is None:
+            import redis.asyncio as redis
+            self._client = redis.Redis.from_url(self.redis_url, socket_timeout=1, socket_connect_timeout=1)
+            self._script = self._client.register_script(RESERVE_SCRIPT)
+        return self._client
+
+    def _batch(self, limit: RateLimit) -> int:
+        # Limiti piccoli (es. login) vengono contati uno per uno, in modo esatto
+        return max(1, min(self.sync_batch, limit.amount // 10))
+
+    @staticmethod
+    def _prune(buckets: dict, now: float):
+        if len(buckets) > MAX_LOCAL_KEYS:
+            for key in [k for k, v in buckets.items() if v[0] <= now]:
+                del buckets[key]
+
+    def _hit_local(self, key: str, limit: RateLimit, now: float, window_end: float) -> bool:
+        entry = self._local.get(key)
+        if entry is None or entry[0] != window_end:
+            self._prune(self._local, now)
+            entry = self._local[key] = [window_end, 0]
+        if entry[1] >= limit.amount:
+            return False
+        entry[1] += 1
+        return True
+
+    async def hit(self, name: str, limit: RateLimit, identity: str) -> tuple[bool, int]:
+        """Consuma un permesso; restituisce (consentito, secondi alla fine della finestra)"""
+        now = time.time()
+        window = int(now // limit.seconds)
+        window_end = (window + 1) * limit.seconds
+        retry_after = max(1, int(window_end - now))
+        key = f"{name}:{identity}"
+
+        if self.redis_url is None or now < self._redis_down_until:
+            return self._hit_local(key, limit, now, window_end), retry_after
+
+        bucket = self._buckets.get(key)
+        if bucket is None or bucket[0] != window_end:
+            self._prune(self._buckets, now)
+            bucket = self._buckets[key] = [window_end, 0, False]
+        if bucket[1] > 0:
+            bucket[1] -= 1
+            return True, retry_after
+        if bucket[2]:
+            return False, retry_after
+
+        try:
+            self._redis()
+            granted = await self._script(
+                keys=[f"{self.PREFIX}:{key}:{window}"],
+                args=[self._batch(limit), limit.amount, limit.seconds + 1],
+            )
+        except Exception as e:
+            # Fail open: senza Redis si torna ai contatori del processo
+            logger.warning("Rate limit su Redis non disponibile, uso contatori locali: %s", e)
+            self._redis_down_until = now + REDIS_RETRY_SECONDS
+            return self._hit_local(key, limit, now, window_end), retry_after
+        if not granted:
+            bucket[2] = True
+            return False, retry_after
+        bucket[1] += int(granted) - 1
+        return True, retry_after
+
+limiter = RateLimiter(
+    settings.REDIS_URL if settings.RATE_LIMIT_REDIS else None,
+    sync_batch=settings.RATE_LIMIT_SYNC_BATCH,
+)
+
+def _client_ip(scope) -> str:
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+def _token_subject(scope) -> str | None:
+    """Utente del token bearer, se valido (nessun accesso al database)"""
+    for name, value in scope.get("headers", ()):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "bearer" or not token:
+                return None
+            try:
+                return jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+            except jwt.PyJWTError:
+                return None
+    return None
+
+class RateLimitMiddleware:
+    """Middleware ASGI: limite generale per utente (o IP se anonimo) e limiti per percorso.
+
+    Il limite generale vale per tutte le richieste; i percorsi in route_limits
+    hanno in più un contatore dedicato per IP (es. tentativi di login).
+    """
+
+    def __init__(self, app, rate_limiter: RateLimiter = limiter):
+        self.app = app
+        self.limiter = rate_limiter
+        self.default_limit = parse_limit(settings.RATE_LIMIT)
+        self.route_limits = {
+            f"{settings.API_V1_PREFIX}/auth/login": parse_limit(settings.RATE_LIMIT_LOGIN),
+            f"{settings.API_V1_PREFIX}/auth/login-json": parse_limit(settings.RATE_LIMIT_LOGIN),
+            **parse_route_limits(settings.RATE_LIMIT_ROUTES),
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or scope["path"] in EXEMPT_PATHS:
+            return await self.app(scope, receive, send)
+
+        ip = _client_ip(scope)
+        checks = []
+        route_limit = self.route_limits.get(scope["path"])
+        if route_limit is not None:
+            checks.append((f"route:{scope['path']}", route_limit, ip))
+        subject = _token_subject(scope)
+        checks.append(("user", self.default_limit, f"user:{subject}") if subject else ("ip", self.default_limit, ip))
+
+        for name, limit, identity in checks:
+            allowed, retry_after = await self.limiter.hit(name, limit, identity)
+            if not allowed:
+                response = JSONResponse(
+                    status_code=429,
+                    content={"detail": f"Rate limit exceeded: {limit}"},
+                    headers={"Retry-After": str(retry_after)},
+                )
+                return await response(scope, receive, send)
+        return await self.app(scope, receive, send)
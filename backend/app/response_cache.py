@@ -0,0 +1,268 @@
+"""
+Cache delle risposte di lista con ETag e GET condizionali.
+
+L'ETag di una risposta deriva dalla versione dei dati da cui dipende e dai
+parametri della richiesta: se il client invia lo stesso ETag in If-None-Match
+si risponde 304 senza eseguire la query, altrimenti il corpo serializzato
+viene riusato finché la versione non cambia.
+
+- Senza Redis la versione è l'ultimo valore della sequenza di sincronizzazione
+  visibile nel database (sync.high_water_statement, una SELECT su indice).
+  Il processo la riusa per RESPONSE_CACHE_VERSION_MS: un 304 non interroga il
+  database finché la versione è in memoria. Ogni commit di una sessione del
+  processo la scarta (evento after_commit), quindi le modifiche del worker
+  sono visibili subito; quelle degli altri worker, o scritte fuori da una
+  Session, al più dopo RESPONSE_CACHE_VERSION_MS.
+- Con RESPONSE_CACHE_REDIS ogni tabella ha un contatore su Redis incrementato
+  dagli handler che la modificano (dopo il commit); contatori e corpi sono
+  condivisi tra i worker e un 304 non interroga il database. Le richieste
+  servite da una replica usano comunque la versione letta dalla replica.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+import orjson
+from fastapi import Request, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from .config import get_settings
+from .cache import TTLCache
+from .sync import high_water_statement
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+CATEGORIES = "categories"
+LICENSES = "licenses"
+# Generazione di LocalVersion all'inizio della transazione della sessione (Session.info)
+GENERATION_KEY = "response_cache_generation"
+
+class RedisBackend:
+    """Contatori (INCR) e corpi delle risposte condivisi su Redis"""
+
+    PREFIX = "mykeymanager:response-cache"
+
+    def __init__(self, url: str, ttl: int):
+        self.url = url
+        self.ttl = ttl
+        self._client = None
+
+    def _redis(self):
+        if self._client is None:
+            import redis
+            self._client = redis.Redis.from_url(self.url, socket_timeout=1, socket_connect_timeout=1)
+        return self._client
+
+    def get(self, tables: tuple[str, ...]) -> str:
+        values = self._redis().mget([f"{self.PREFIX}:version:{t}" for t in tables])
+        return ".".join((v or b"0").decode() for v in values)
+
+    def bump(self, tables: tuple[str, ...]):
+        pipe = self._redis().pipeline(transaction=False)
+        for table in tables:
+            pipe.incr(f"{self.PREFIX}:version:{table}")
+        pipe.execute()
+
+    def load(self, etag: str):
+        data = self._redis().get(f"{self.PREFIX}:body:{etag}")
+        if not data:
+            return None
+        headers, body = data.split(b"\n", 1)
+        return body, json.loads(headers)
+
+    def store(self, etag: str, entry: tuple[bytes, dict]):
+        body, headers = entry
+        self._redis().set(f"{self.PREFIX}:body:{etag}", json.dumps(headers).encode() + b"\n" + body, ex=self.ttl)
+
+class LocalVersion:
+    """Versione letta dal database, riusata nel processo fino al prossimo commit o alla scadenza.
+
+    Una lettura fatta in una transazione iniziata prima dell'ultimo commit
+    (snapshot SQLite) potrebbe essere già vecchia: viene salvata solo se la
+    generazione non è cambiata dall'inizio della transazione.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.generation = 0
+        self._value: str | None = None
+        self._expires = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> str | None:
+        with self._lock:
+            if self._value is not None and time.monotonic() < self._expires:
+                return self._value
+            return None
+
+    def set(self, value: str, generation: int | None):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if generation == self.generation:
+                self._value = value
+                self._expires = time.monotonic() + self.ttl
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+            self._value = None
+
+class ResponseCache:
+    """Versioni condivise (solo con Redis) e corpi serializzati indicizzati per ETag.
+
+    Gli errori di Redis non bloccano le richieste: la risposta viene calcolata
+    normalmente, senza ETag.
+    """
+
+    def __init__(self, redis_url: str | None, ttl: int, size: int, version_ttl: float):
+        self.redis = RedisBackend(redis_url, ttl) if redis_url else None
+        self.bodies = TTLCache(maxsize=size, ttl=ttl)
+        self.local_version = LocalVersion(version_ttl)
+
+    def shared_version(self, tables: tuple[str, ...]) -> str | None:
+        """Versione delle tabelle su Redis, o None se non disponibile"""
+        try:
+            return self.redis.get(tables)
+        except Exception as e:
+            logger.warning("Versioni cache risposte non disponibili: %s", e)
+            return None
+
+    def etag(self, request: Request, version: str) -> str:
+        variant = f"{request.url.path}?{sorted(request.query_params.multi_items())}"
+        digest = hashlib.sha1(f"{version}|{variant}".encode()).hexdigest()
+        return f'"{digest}"'
+
+    def get(self, etag: str) -> tuple[bytes, dict] | None:
+        entry = self.bodies.get(etag)
+        if entry is None and self.redis is not None:
+            try:
+                entry = self.redis.load(etag)
+            except Exception as e:
+                logger.warning("Lettura cache risposte da Redis non riuscita: %s", e)
+            if entry is not None:
+                self.bodies.set(etag, entry)
+        return entry
+
+    def set(self, etag: str, body: bytes, headers: dict):
+        entry = (body, headers)
+        self.bodies.set(etag, entry)
+        if self.redis is not None:
+            try:
+                self.redis.store(etag, entry)
+            except Exception as e:
+                logger.warning("Scrittura cache risposte su Redis non riuscita: %s", e)
+
+    def bump(self, *tables: str):
+        if self.redis is None:
+            return  # la versione letta dal database è già cambiata con il commit
+        try:
+            self.redis.bump(tables)
+        except Exception as e:
+            # Senza l'incremento gli altri worker servirebbero dati vecchi fino alla scadenza
+            logger.error("Incremento versione cache risposte non riuscito: %s", e)
+            self.bodies.clear()
+
+response_cache = ResponseCache(
+    settings.REDIS_URL if settings.RESPONSE_CACHE_REDIS else None,
+    ttl=settings.RESPONSE_CACHE_TTL,
+    size=settings.RESPONSE_CACHE_SIZE,
+    version_ttl=settings.RESPONSE_CACHE_VERSION_MS / 1000,
+)
+
+@event.listens_for(Session, "after_begin")
+def _remember_generation(session: Session, transaction, connection):
+    session.info[GENERATION_KEY] = response_cache.local_version.generation
+
+@event.listens_for(Session, "after_commit")
+def _drop_local_version(session: Session):
+    response_cache.local_version.invalidate()
+
+def invalidate(*tables: str):
+    """Da chiamare dopo il commit di ogni modifica alle tabelle indicate"""
+    response_cache.bump(*tables)
+
+async def invalidate_async(*tables: str):
+    if response_cache.redis is not None:
+        await run_in_threadpool(response_cache.bump, *tables)
+    else:
+        response_cache.bump(*tables)
+
+def _not_modified(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in (tag.strip() for tag in header.split(","))
+
+def rows_json(rows) -> bytes:
+    """Corpo JSON da righe di una select() su colonne: nessun oggetto ORM né modello pydantic"""
+    return orjson.dumps([row._asdict() for row in rows])
+
+def _response(etag: str | None, body: bytes, headers: dict) -> Response:
+    headers = dict(headers)
+    if etag:
+        headers["ETag"] = etag
+        # Il browser può conservare la risposta ma deve sempre rivalidarla
+        headers["Cache-Control"] = "private, no-cache"
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def _from_replica(db) -> bool:
+    """La sessione (sincrona o AsyncSession) legge da una replica (vedi database.RoutingSession)"""
+    return getattr(getattr(db, "sync_session", db), "replica", None) is not None
+
+def cached_json(request: Request, db, tables: tuple[str, ...], build) -> Response:
+    """Risposta JSON con ETag; `build()` restituisce (corpo, header) ed è chiamata solo se serve.
+
+    `db` è la sessione della richiesta. Senza Redis la versione viene letta da
+    lì quando non è in memoria. Le sessioni su replica la leggono sempre dalla
+    replica e non la salvano: una replica in ritardo produce un corpo vecchio,
+    che non deve finire sotto la versione del primario (su Redis o nel processo).
+    """
+    cache = response_cache
+    if _from_replica(db):
+        version = f"seq:{db.scalar(high_water_statement())}"
+    elif cache.redis is not None:
+        version = cache.shared_version(tables)
+    else:
+        version = cache.local_version.get()
+        if version is None:
+            version = f"seq:{db.scalar(high_water_statement())}"
+            cache.local_version.set(version, db.info.get(GENERATION_KEY))
+    etag = cache.etag(request, version) if version is not None else None
+    if etag and _not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+    entry = cache.get(etag) if etag else None
+    if entry is None:
+        entry = build()
+        if etag:
+            cache.set(etag, *entry)
+    return _response(etag, *entry)
+
+async def cached_json_async(request: Request, db, tables: tuple[str, ...], build) -> Response:
+    """Come cached_json, con sessione asincrona e `build` coroutine; le chiamate a Redis vanno nel threadpool"""
+    cache = response_cache
+    if _from_replica(db):
+        version = f"seq:{await db.scalar(high_water_statement())}"
+    elif cache.redis is not None:
+        version = await run_in_threadpool(cache.shared_version, tables)
+    else:
+        version = cache.local_version.get()
+        if version is None:
+            version = f"seq:{await db.scalar(high_water_statement())}"
+            cache.local_version.set(version, db.info.get(GENERATION_KEY))
+    etag = cache.etag(request, version) if version is not None else None
+    if etag and _not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+    call = run_in_threadpool if cache.redis is not None else _call
+    entry = await call(cache.get, etag) if etag else None
+    if entry is None:
+        entry = await build()
+        if etag:
+            await call(cache.set, etag, *entry)
+    return _response(etag, *entry)
+
+async def _call(fn, *args):
+    return fn(*args)
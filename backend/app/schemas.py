@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, validator
-from datetime import datetime
+from datetime import date, datetime
 from typing import Optional
 import re
 
@@ -12,6 +12,11 @@ class CategoryRead(CategoryCreate):
     class Config:
         orm_mode = True
 
+class CategorySummary(CategoryRead):
+    license_count: int
+    vendor_count: int
+    last_used_at: Optional[datetime] = None
+
 class LicenseBase(BaseModel):
     category_id: int
     product_name: str
@@ -55,6 +60,12 @@ class LicenseRead(LicenseBase):
     class Config:
         orm_mode = True
 
+class LicenseSearchHit(BaseModel):
+    license: LicenseRead
+    score: float
+    # Posizioni [inizio, fine) dei termini trovati, per campo
+    highlights: dict[str, list[tuple[int, int]]] = {}
+
 class UserCreate(BaseModel):
     username: str
     password: str
@@ -104,6 +115,10 @@ class Token(BaseModel):
     access_token: str
     token_type: str = "bearer"
 
+class EventsToken(BaseModel):
+    token: str
+    expires_in: int  # secondi
+
 class LoginRequest(BaseModel):
     username: str  # Può essere username o email
     password: str
@@ -111,6 +126,49 @@ class LoginRequest(BaseModel):
 class LicenseUseRequest(BaseModel):
     iso_download: bool = True
 
+class LicenseBatchUseRequest(BaseModel):
+    ids: list[int] = Field(min_length=1, max_length=500)
+    iso_download: bool = True
+
+class LicenseBatchUseResult(BaseModel):
+    licenses: list[LicenseRead]
+    missing: list[int] = []
+
+class SyncDeleted(BaseModel):
+    licenses: list[int] = []
+    categories: list[int] = []
+
+class SyncChanges(BaseModel):
+    token: str  # da passare come `since` alla richiesta successiva
+    reset: bool  # True: lo stato locale va sostituito con le righe ricevute
+    has_more: bool  # altre modifiche da scaricare subito con il nuovo token
+    licenses: list[LicenseRead]
+    categories: list[CategoryRead]
+    deleted: SyncDeleted
+
+class UsageRow(BaseModel):
+    start: date  # primo giorno del periodo
+    id: int  # licenza o categoria, secondo il raggruppamento
+    count: int
+
+class UsageReport(BaseModel):
+    bucket: str  # day | week | month
+    group: str  # license | category
+    rows: list[UsageRow]
+
 class ChangePasswordRequest(BaseModel):
     current_password: str
     new_password: str
+
+class BulkImportRow(BaseModel):
+    row: int
+    status: str  # inserted | duplicate | invalid
+    id: Optional[int] = None
+    license_key: Optional[str] = None
+    errors: Optional[list[str]] = None
+
+class BulkImportReport(BaseModel):
+    inserted: int = 0
+    duplicates: int = 0
+    invalid: int = 0
+    rows: list[BulkImportRow] = []
@@ -0,0 +1,256 @@
+"""
+Ricerca full-text e fuzzy sulle licenze.
+
+Su PostgreSQL usa le colonne generate search_vector (tsvector, indice GIN) e
+search_text (indice GIN pg_trgm) create dalla migrazione license_search_index.
+Con altri database (SQLite) usa un indice invertito in memoria, aggiornato in
+modo incrementale quando cambia il contenuto della tabella.
+"""
+import bisect
+import re
+import threading
+from decimal import Decimal
+from sqlalchemy import Numeric, cast, func, literal, literal_column, select, text, tuple_
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+from . import models
+from .pagination import encode_cursor, decode_cursor
+
+# Campi indicizzati e peso nel punteggio (A/B/C/C nel tsvector)
+FIELD_WEIGHTS = {"product_name": 1.0, "vendor": 0.6, "edition": 0.4, "version": 0.4}
+FIELDS = list(FIELD_WEIGHTS)
+# Similarità trigram minima per un termine fuzzy
+FUZZY_THRESHOLD = 0.4
+TOKEN_PATTERN = re.compile(r"\w+")
+# Chiave dei cursori di ricerca (ordinati per punteggio), vedi pagination
+SEARCH_CURSOR_KEY = "score"
+# Cifre decimali del punteggio su PostgreSQL: ts_rank è float4 mentre il cursore
+# lo trasporta come float8, quindi ordinamento e cursore usano lo stesso numeric arrotondato
+SCORE_DIGITS = 6
+
+def tokenize(value: str | None) -> list[str]:
+    return TOKEN_PATTERN.findall(value.lower()) if value else []
+
+def trigrams(token: str) -> set[str]:
+    """Trigrammi come in pg_trgm: parola con due spazi iniziali e uno finale"""
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def similarity(a: str, b: str) -> float:
+    ta, tb = trigrams(a), trigrams(b)
+    return len(ta & tb) / len(ta | tb)
+
+def term_matches(term: str, token: str, prefix: bool, fuzzy: bool) -> bool:
+    if token == term or (prefix and token.startswith(term)):
+        return True
+    return fuzzy and similarity(term, token) >= FUZZY_THRESHOLD
+
+def highlight(lic, terms: list[str], prefix: bool, fuzzy: bool) -> dict[str, list[tuple[int, int]]]:
+    """Posizioni [inizio, fine) dei termini trovati in ciascun campo"""
+    result = {}
+    for field in FIELDS:
+        value = getattr(lic, field)
+        if not value:
+            continue
+        spans = [
+            match.span()
+            for match in TOKEN_PATTERN.finditer(value)
+            if any(term_matches(term, match.group().lower(), prefix, fuzzy) for term in terms)
+        ]
+        if spans:
+            result[field] = spans
+    return result
+
+def create_postgres_index(conn: Connection):
+    """DDL per la ricerca su PostgreSQL (usato dalla migrazione license_search_index)"""
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    conn.execute(text(
+        "ALTER TABLE licenses ADD COLUMN IF NOT EXISTS search_text text GENERATED ALWAYS AS ("
+        "lower(coalesce(product_name, '') || ' ' || coalesce(vendor, '') || ' ' || "
+        "coalesce(edition, '') || ' ' || coalesce(version, ''))) STORED"
+    ))
+    conn.execute(text(
+        "ALTER TABLE licenses ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+        "setweight(to_tsvector('simple', coalesce(product_name, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(vendor, '')), 'B') || "
+        "setweight(to_tsvector('simple', coalesce(edition, '')), 'C') || "
+        "setweight(to_tsvector('simple', coalesce(version, '')), 'C')) STORED"
+    ))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_licenses_search_vector ON licenses USING gin (search_vector)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_licenses_search_text_trgm ON licenses USING gin (search_text gin_trgm_ops)"))
+
+def _postgres_search(db: Session, terms: list[str], prefix: bool, fuzzy: bool,
+                     category_id: int | None, limit: int, cursor: str | None):
+    search_vector = literal_column("licenses.search_vector")
+    search_text = literal_column("licenses.search_text")
+    # I token contengono solo caratteri \w, quindi possono essere quotati così
+    suffix = ":*" if prefix else ""
+    tsquery = func.to_tsquery("simple", " & ".join(f"'{t}'{suffix}" for t in terms))
+    query = " ".join(terms)
+
+    condition = search_vector.op("@@")(tsquery)
+    score = func.ts_rank(search_vector, tsquery)
+    if fuzzy:
+        condition = condition | literal(query).op("<%")(search_text)
+        score = score + func.word_similarity(query, search_text)
+    score = func.round(cast(score, Numeric), SCORE_DIGITS).label("score")
+
+    stmt = select(models.License, score).where(condition)
+    if category_id is not None:
+        stmt = stmt.where(models.License.category_id == category_id)
+    if cursor:
+        value, last_id = decode_cursor(cursor, SEARCH_CURSOR_KEY, (int, float))
+        # repr del float restituisce esattamente il numeric con SCORE_DIGITS cifre
+        bound = tuple_(literal(Decimal(repr(value)), Numeric), last_id)
+        stmt = stmt.where(tuple_(score, models.License.id) < bound)
+    stmt = stmt.order_by(score.desc(), models.License.id.desc()).limit(limit + 1)
+    return [(lic, float(s)) for lic, s in db.execute(stmt)]
+
+class LicenseSearchIndex:
+    """Indice invertito in memoria per i database senza ricerca full-text.
+
+    Prima di ogni ricerca confronta (numero righe, max updated_at, max id) con
+    lo stato indicizzato: le righe modificate vengono reindicizzate, e se il
+    conteggio non torna (cancellazioni) l'indice viene ricostruito.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self._fingerprint = None
+        self._docs: dict[int, tuple[int, dict[str, float]]] = {}
+        self._postings: dict[str, set[int]] = {}
+        self._trigrams: dict[str, set[str]] = {}
+        self._sorted_tokens: list[str] | None = None
+
+    def _add(self, lic_id: int, category_id: int, values: dict):
+        self._remove(lic_id)
+        weights = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(values[field]):
+                weights[token] = max(weights.get(token, 0), weight)
+        self._docs[lic_id] = (category_id, weights)
+        for token in weights:
+            if token not in self._postings:
+                self._postings[token] = set()
+                for trigram in trigrams(token):
+                    self._trigrams.setdefault(trigram, set()).add(token)
+                self._sorted_tokens = None
+            self._postings[token].add(lic_id)
+
+    def _remove(self, lic_id: int):
+        doc = self._docs.pop(lic_id, None)
+        if doc is None:
+            return
+        for token in doc[1]:
+            self._postings[token].discard(lic_id)
+
+    def _load(self, db: Session, updated_since=None):
+        License = models.License
+        stmt = select(License.id, License.category_id, *(getattr(License, f) for f in FIELDS))
+        if updated_since is not None:
+            stmt = stmt.where(License.updated_at >= updated_since)
+        for row in db.execute(stmt):
+            self._add(row.id, row.category_id, {f: getattr(row, f) for f in FIELDS})
+
+    def refresh(self, db: Session):
+        License = models.License
+        # Sottoquery separate: SQLite risolve ciascuna con un solo accesso all'indice
+        fingerprint = tuple(db.execute(select(
+            select(func.count()).select_from(License).scalar_subquery(),
+            select(func.max(License.updated_at)).scalar_subquery(),
+            select(func.max(License.id)).scalar_subquery(),
+        )).one())
+        with self._lock:
+            if fingerprint == self._fingerprint:
+                return
+            if self._fingerprint is not None and fingerprint[1] is not None:
+                self._load(db, updated_since=self._fingerprint[1])
+            if len(self._docs) != fingerprint[0]:
+                self._clear()
+                self._load(db)
+            if self._sorted_tokens is None:
+                self._sorted_tokens = sorted(self._postings)
+            self._fingerprint = fingerprint
+
+    def _matching_tokens(self, term: str, prefix: bool, fuzzy: bool) -> dict[str, float]:
+        """Token indicizzati corrispondenti al termine, con il relativo punteggio"""
+        matches = {}
+        if self._postings.get(term):
+            matches[term] = 1.0
+        if prefix:
+            tokens = self._sorted_tokens
+            i = bisect.bisect_left(tokens, term)
+            while i < len(tokens) and tokens[i].startswith(term):
+                matches.setdefault(tokens[i], 0.8)
+                i += 1
+        if fuzzy and len(term) > 2:
+            candidates = set()
+            for trigram in trigrams(term):
+                candidates |= self._trigrams.get(trigram, set())
+            for token in candidates - matches.keys():
+                sim = similarity(term, token)
+                if sim >= FUZZY_THRESHOLD:
+                    matches[token] = 0.7 * sim
+        return matches
+
+    def search(self, terms: list[str], prefix: bool, fuzzy: bool, category_id: int | None) -> list[tuple[float, int]]:
+        """(punteggio, id) dei documenti che contengono tutti i termini"""
+        with self._lock:
+            scores = None
+            for term in terms:
+                term_scores = {}
+                for token, quality in self._matching_tokens(term, prefix, fuzzy).items():
+                    for lic_id in self._postings[token]:
+                        if scores is not None and lic_id not in scores:
+                            continue
+                        score = quality * self._docs[lic_id][1][token]
+                        if score > term_scores.get(lic_id, 0):
+                            term_scores[lic_id] = score
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {lic_id: scores[lic_id] + s for lic_id, s in term_scores.items()}
+                if not scores:
+                    return []
+            if category_id is not None:
+                scores = {i: s for i, s in scores.items() if self._docs[i][0] == category_id}
+        return [(s, i) for i, s in scores.items()]
+
+fallback_index = LicenseSearchIndex()
+
+def _fallback_search(db: Session, terms: list[str], prefix: bool, fuzzy: bool,
+                     category_id: int | None, limit: int, cursor: str | None):
+    fallback_index.refresh(db)
+    hits = fallback_index.search(terms, prefix, fuzzy, category_id)
+    if cursor:
+        bound = decode_cursor(cursor, SEARCH_CURSOR_KEY, (int, float))
+        hits = [hit for hit in hits if hit < bound]
+    hits.sort(reverse=True)
+    hits = hits[:limit + 1]
+    rows = {lic.id: lic for lic in db.scalars(
+        select(models.License).where(models.License.id.in_([i for _, i in hits]))
+    )}
+    return [(rows[i], s) for s, i in hits if i in rows]
+
+def search_licenses(db: Session, query: str, prefix: bool, fuzzy: bool, category_id: int | None,
+                    limit: int, cursor: str | None) -> tuple[list[dict], str | None]:
+    """Risultati ordinati per rilevanza e cursore della pagina successiva"""
+    terms = tokenize(query)
+    if not terms:
+        return [], None
+    search = _postgres_search if db.get_bind().dialect.name == "postgresql" else _fallback_search
+    hits = search(db, terms, prefix, fuzzy, category_id, limit, cursor)
+
+    next_cursor = None
+    if len(hits) > limit:
+        hits = hits[:limit]
+        last, score = hits[-1]
+        next_cursor = encode_cursor(score, last.id, SEARCH_CURSOR_KEY)
+    results = [
+        {"license": lic, "score": round(score, 4), "highlights": highlight(lic, terms, prefix, fuzzy)}
+        for lic, score in hits
+    ]
+    return results, next_cursor
@@ -1,21 +1,149 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta
 from passlib.context import CryptContext
 import jwt
 from .config import get_settings
+from . import metrics
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 settings = get_settings()
+# min/max_rounds uguali al costo configurato: needs_update() segnala gli hash
+# con un costo diverso, che vengono rigenerati al login successivo
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__max_rounds=settings.BCRYPT_ROUNDS,
+)
 
 ALGORITHM = "HS256"
 
-def get_password_hash(password: str) -> str:
+class PasswordHasherBusy(Exception):
+    """Troppe operazioni bcrypt in coda: la richiesta va respinta (503)"""
+
+# Funzioni eseguite nei processi del pool: devono essere a livello di modulo
+def _hash(password: str) -> str:
     return pwd_context.hash(password)
 
+def _verify_and_update(plain_password: str, hashed: str) -> tuple[bool, str | None]:
+    return pwd_context.verify_and_update(plain_password, hashed)
+
+class PasswordHasher:
+    """Esegue hash e verifica bcrypt in un pool di processi dedicato.
+
+    Un processo separato evita che il calcolo bcrypt contenda il GIL con le
+    altre richieste; oltre `workers + max_queue` operazioni in corso le nuove
+    vengono rifiutate subito con PasswordHasherBusy invece di accodarsi.
+    Con workers=0 il calcolo avviene nel thread chiamante.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: il fork di un processo con thread attivi può bloccarsi
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._pending -= 1
+
+    def submit(self, fn, *args) -> Future:
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                raise PasswordHasherBusy()
+            self._pending += 1
+
+        if self.workers <= 0:
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self._release()
+            return future
+
+        try:
+            with self._lock:
+                try:
+                    future = self._get_executor().submit(fn, *args)
+                except BrokenProcessPool:
+                    # Un processo del pool è terminato: ricrea il pool
+                    self._executor = None
+                    future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+password_hasher = PasswordHasher(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_QUEUE)
+
+def get_password_hash(password: str) -> str:
+    return password_hasher.submit(_hash, password).result()
+
+def verify_and_update_password(plain_password: str, hashed: str) -> tuple[bool, str | None]:
+    """Verifica la password; se l'hash usa un costo superato restituisce anche il nuovo hash"""
+    start = time.perf_counter()
+    try:
+        return password_hasher.submit(_verify_and_update, plain_password, hashed).result()
+    finally:
+        metrics.PASSWORD_VERIFY_SECONDS.observe(time.perf_counter() - start)
+
 def verify_password(plain_password: str, hashed: str) -> bool:
-    return pwd_context.verify(plain_password, hashed)
+    return verify_and_update_password(plain_password, hashed)[0]
+
+async def get_password_hash_async(password: str) -> str:
+    return await asyncio.wrap_future(password_hasher.submit(_hash, password))
+
+async def verify_and_update_password_async(plain_password: str, hashed: str) -> tuple[bool, str | None]:
+    start = time.perf_counter()
+    try:
+        return await asyncio.wrap_future(password_hasher.submit(_verify_and_update, plain_password, hashed))
+    finally:
+        metrics.PASSWORD_VERIFY_SECONDS.observe(time.perf_counter() - start)
+
+async def verify_password_async(plain_password: str, hashed: str) -> bool:
+    return (await verify_and_update_password_async(plain_password, hashed))[0]
 
 def create_access_token(sub: str, expires_minutes: int | None = None) -> str:
     to_encode = {"sub": sub, "iat": datetime.utcnow()}
     expire = datetime.utcnow() + timedelta(minutes=expires_minutes or settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, settings.SECRET_KEY, algorithm=ALGORITHM)
+
+# Token valido solo per il feed /events (vedi deps.get_stream_subject)
+EVENTS_SCOPE = "events"
+
+def create_events_token(sub: str) -> str:
+    """Token breve per EventSource, che non può inviare l'header Authorization.
+
+    Viaggia nella query string (e quindi nei log dei proxy): scade dopo
+    EVENTS_TOKEN_EXPIRE_SECONDS e non è accettato dagli altri endpoint.
+    """
+    now = datetime.utcnow()
+    return jwt.encode(
+        {"sub": sub, "scope": EVENTS_SCOPE, "iat": now,
+         "exp": now + timedelta(seconds=settings.EVENTS_TOKEN_EXPIRE_SECONDS)},
+        settings.SECRET_KEY, algorithm=ALGORITHM,
+    )
@@ -0,0 +1,210 @@
+"""
+Sincronizzazione incrementale di licenze e categorie.
+
+Ogni INSERT o UPDATE su licenses e categories assegna alla riga un nuovo
+valore di una sequenza unica (change_seq); ogni DELETE, anche in cascata,
+aggiunge una riga a sync_tombstones con il proprio valore della sequenza.
+Entrambi sono scritti da trigger del database, quindi coprono tutti i
+percorsi di scrittura (import massivo, uso di più licenze, eliminazioni).
+
+Il token di sincronizzazione (opaco) contiene l'ultimo valore della sequenza
+visto dal client: /sync?since=<token> restituisce solo le righe con change_seq
+successivo e le eliminazioni avvenute dopo, a pagine ordinate per sequenza.
+
+Su PostgreSQL i trigger prendono un advisory lock di transazione prima di
+assegnare la sequenza: le transazioni che modificano licenze o categorie
+fanno commit nell'ordine dei valori assegnati e un client non può saltare
+una modifica committata dopo di quelle che ha già visto. SQLite ha un solo
+scrittore alla volta e non ne ha bisogno.
+
+Le eliminazioni più vecchie di SYNC_TOMBSTONE_DAYS si rimuovono con
+`python -m app.migrate prune-tombstones`; un client con un token precedente
+riceve di nuovo tutto l'inventario (reset).
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import (
+    BigInteger, Column, Integer, MetaData, Table, delete, func, insert, select, text, union_all, update,
+)
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+from .models import CATEGORY_COLUMNS, LICENSE_COLUMNS, Category, License, SyncTombstone
+from .pagination import decode_cursor, encode_cursor
+
+# Chiave dell'advisory lock che ordina i commit con la sequenza (PostgreSQL)
+SYNC_LOCK_KEY = 727_100_002
+MAX_SYNC_PAGE = 5000
+PLURAL = {"license": "licenses", "category": "categories"}
+
+# SQLite non ha sequenze: contatore in una tabella di una riga
+sync_metadata = MetaData()
+sync_sequence = Table(
+    "sync_sequence", sync_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("value", BigInteger, nullable=False),
+)
+
+POSTGRES_DDL = [
+    "CREATE SEQUENCE IF NOT EXISTS sync_change_seq",
+    f"""
+    CREATE OR REPLACE FUNCTION sync_change_seq_assign() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_advisory_xact_lock({SYNC_LOCK_KEY});
+        NEW.change_seq := nextval('sync_change_seq');
+        RETURN NEW;
+    END $$ LANGUAGE plpgsql
+    """,
+    f"""
+    CREATE OR REPLACE FUNCTION sync_tombstone_add() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_advisory_xact_lock({SYNC_LOCK_KEY});
+        INSERT INTO sync_tombstones (seq, entity, entity_id, deleted_at)
+        VALUES (nextval('sync_change_seq'), TG_ARGV[0], OLD.id, now() AT TIME ZONE 'utc');
+        RETURN OLD;
+    END $$ LANGUAGE plpgsql
+    """,
+]
+
+def _postgres_triggers(table: str, entity: str) -> list[str]:
+    return [
+        f"DROP TRIGGER IF EXISTS {table}_sync_seq ON {table}",
+        f"DROP TRIGGER IF EXISTS {table}_sync_tombstone ON {table}",
+        f"CREATE TRIGGER {table}_sync_seq BEFORE INSERT OR UPDATE ON {table} "
+        "FOR EACH ROW EXECUTE FUNCTION sync_change_seq_assign()",
+        f"CREATE TRIGGER {table}_sync_tombstone AFTER DELETE ON {table} "
+        f"FOR EACH ROW EXECUTE FUNCTION sync_tombstone_add('{entity}')",
+    ]
+
+_SQLITE_NEXT = "UPDATE sync_sequence SET value = value + 1 WHERE id = 1;"
+_SQLITE_CURRENT = "(SELECT value FROM sync_sequence WHERE id = 1)"
+
+def _sqlite_triggers(table: str, entity: str) -> list[str]:
+    assign = f"{_SQLITE_NEXT} UPDATE {table} SET change_seq = {_SQLITE_CURRENT} WHERE id = NEW.id;"
+    return [
+        f"DROP TRIGGER IF EXISTS {table}_sync_insert",
+        f"DROP TRIGGER IF EXISTS {table}_sync_update",
+        f"DROP TRIGGER IF EXISTS {table}_sync_delete",
+        f"CREATE TRIGGER {table}_sync_insert AFTER INSERT ON {table} BEGIN {assign} END",
+        # La condizione evita di rientrare nel trigger con l'UPDATE di change_seq
+        f"CREATE TRIGGER {table}_sync_update AFTER UPDATE ON {table} "
+        f"WHEN NEW.change_seq IS OLD.change_seq BEGIN {assign} END",
+        f"CREATE TRIGGER {table}_sync_delete AFTER DELETE ON {table} BEGIN {_SQLITE_NEXT} "
+        f"INSERT INTO sync_tombstones (seq, entity, entity_id, deleted_at) "
+        f"VALUES ({_SQLITE_CURRENT}, '{entity}', OLD.id, CURRENT_TIMESTAMP); END",
+    ]
+
+def install(conn: Connection):
+    """Colonne, indici, tombstone e trigger; le righe esistenti ricevono una sequenza iniziale"""
+    from .migrate import add_column_if_missing
+
+    for table in ("licenses", "categories"):
+        add_column_if_missing(conn, table, "change_seq", "BIGINT")
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_change_seq ON {table} (change_seq)"))
+    SyncTombstone.__table__.create(conn, checkfirst=True)
+
+    # Sequenza iniziale prima dei trigger: licenze per id, poi categorie
+    licenses, categories = License.__table__, Category.__table__
+    conn.execute(update(licenses).values(change_seq=licenses.c.id))
+    offset = conn.execute(select(func.coalesce(func.max(licenses.c.id), 0))).scalar()
+    conn.execute(update(categories).values(change_seq=categories.c.id + offset))
+    last = conn.execute(select(func.coalesce(func.max(categories.c.change_seq), offset))).scalar()
+
+    if conn.dialect.name == "postgresql":
+        statements = POSTGRES_DDL + [f"SELECT setval('sync_change_seq', {last + 1}, false)"]
+        statements += _postgres_triggers("licenses", "license") + _postgres_triggers("categories", "category")
+    else:
+        sync_metadata.create_all(conn)
+        conn.execute(delete(sync_sequence))
+        conn.execute(insert(sync_sequence).values(id=1, value=last))
+        statements = _sqlite_triggers("licenses", "license") + _sqlite_triggers("categories", "category")
+    for statement in statements:
+        conn.execute(text(statement))
+
+def high_water_statement():
+    """SELECT dell'ultimo valore della sequenza visibile nei dati committati.
+
+    Massimo tra change_seq di licenze e categorie e seq delle tombstone (tre
+    letture su indice): cresce a ogni modifica committata, su qualsiasi worker.
+    """
+    parts = union_all(
+        select(func.max(License.change_seq).label("seq")),
+        select(func.max(Category.change_seq)),
+        select(func.max(SyncTombstone.seq)),
+    ).subquery()
+    return select(func.coalesce(func.max(parts.c.seq), 0))
+
+def prune_tombstones(conn: Connection, days: int) -> int:
+    """Elimina le tombstone più vecchie di `days` giorni lasciando un marcatore "pruned".
+
+    I token precedenti al marcatore non possono più vedere tutte le eliminazioni.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    tombstones = SyncTombstone.__table__
+    last = conn.execute(
+        select(func.max(tombstones.c.seq)).where(tombstones.c.deleted_at < cutoff)
+    ).scalar()
+    if last is None:
+        return 0
+    removed = conn.execute(delete(tombstones).where(tombstones.c.seq <= last)).rowcount
+    conn.execute(insert(tombstones).values(seq=last, entity="pruned", entity_id=0, deleted_at=cutoff))
+    return removed
+
+def changes(db: Session, token: str | None, limit: int) -> dict:
+    """Modifiche successive al token, al più `limit` in ordine di sequenza.
+
+    Il token codifica (ultima sequenza vista, reset in corso): le pagine
+    successive di un reset non vengono confrontate con le tombstone rimosse,
+    che riguardano solo righe eliminate prima dell'inizio del reset.
+    """
+    since, resuming = decode_cursor(token, value_type=int) if token else (0, 0)
+    # Letti prima delle pagine: tutto ciò che ha sequenza <= high_water è già committato
+    floor, high_water = db.execute(select(
+        select(func.max(SyncTombstone.seq)).where(SyncTombstone.entity == "pruned").scalar_subquery(),
+        high_water_statement().scalar_subquery(),
+    )).one()
+    floor = floor or 0
+    reset = not token or (not resuming and since < floor)
+    if reset:
+        since = 0
+
+    def page(stmt, seq_column):
+        return db.execute(stmt.where(seq_column > since).order_by(seq_column).limit(limit + 1)).all()
+
+    licenses = page(select(License.change_seq, *LICENSE_COLUMNS), License.change_seq)
+    categories = page(select(Category.change_seq, *CATEGORY_COLUMNS), Category.change_seq)
+    deleted = [] if reset else page(
+        select(SyncTombstone.seq, SyncTombstone.entity, SyncTombstone.entity_id)
+        .where(SyncTombstone.entity != "pruned"),
+        SyncTombstone.seq,
+    )
+
+    # Le prime `limit` modifiche tra i tre elenchi; il token è l'ultima inclusa
+    merged = sorted(
+        [(row[0], "license", row) for row in licenses]
+        + [(row[0], "category", row) for row in categories]
+        + [(row[0], "deleted", row) for row in deleted],
+        key=lambda item: item[0],
+    )
+    included, has_more = merged[:limit], len(merged) > limit
+    last = included[-1][0] if included else since
+    if not has_more:
+        # Client aggiornato: il token parte dall'ultima sequenza assegnata anche
+        # senza modifiche restituite (database vuoto, righe eliminate durante un
+        # reset), così la richiesta successiva non è di nuovo un reset. Include
+        # il marcatore delle tombstone rimosse, che non servono più al client.
+        last = max(last, high_water)
+    result = {
+        "token": encode_cursor(last, int(has_more and (reset or resuming))),
+        "reset": reset,
+        "has_more": has_more,
+        "licenses": [],
+        "categories": [],
+        "deleted": {"licenses": [], "categories": []},
+    }
+    for _, kind, row in included:
+        if kind == "deleted":
+            result["deleted"][PLURAL[row.entity]].append(row.entity_id)
+        else:
+            data = row._asdict()
+            del data["change_seq"]
+            result[PLURAL[kind]].append(data)
+    return result
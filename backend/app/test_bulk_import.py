@@ -0,0 +1,85 @@
+"""
+Import CSV in streaming: i campi tra virgolette possono contenere degli a capo,
+e un upload lento non blocca le altre scritture
+"""
+import asyncio
+import httpx
+from sqlalchemy import select
+from . import models
+from .bulk_import import _csv_chunks
+from .database import SessionLocal
+
+API = "/api/v1"
+CSV_BODY = (
+    'category_id,product_name,license_key,edition\r\n'
+    '{category},"Office\r\n2021","KEY-MULTI-0001","Pro, ""Plus"""\r\n'
+    '\r\n'
+    '{category},Windows,KEY-MULTI-0002,\r\n'
+)
+
+async def _split(body: bytes, size: int):
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+
+async def _collect(body: bytes, read_size: int, chunk_size: int):
+    return [chunk async for chunk in _csv_chunks(_split(body, read_size), chunk_size)]
+
+def test_csv_chunks_keep_multiline_fields_across_reads():
+    body = CSV_BODY.format(category=1).encode()
+    for read_size in (1, 7, len(body)):
+        chunks = asyncio.run(_collect(body, read_size, 2))
+        assert chunks == [
+            [["category_id", "product_name", "license_key", "edition"],
+             ["1", "Office\r\n2021", "KEY-MULTI-0001", 'Pro, "Plus"']],
+            [["1", "Windows", "KEY-MULTI-0002", ""]],
+        ]
+
+def test_csv_import_with_multiline_field(client, auth_headers, seed_licenses):
+    seed_licenses(1)
+    db = SessionLocal()
+    try:
+        category = db.scalars(select(models.Category).order_by(models.Category.id.desc())).first()
+        response = client.post(
+            f"{API}/licenses/bulk",
+            content=CSV_BODY.format(category=category.id).encode(),
+            headers={**auth_headers, "Content-Type": "text/csv"},
+        )
+        assert response.status_code == 200, response.text
+        assert response.json()["inserted"] == 2
+        db.rollback()  # nuovo snapshot: la lettura della categoria ha aperto una transazione
+        names = set(db.scalars(select(models.License.product_name).where(
+            models.License.license_key.in_(["KEY-MULTI-0001", "KEY-MULTI-0002"])
+        )))
+        assert names == {"Office\r\n2021", "Windows"}
+    finally:
+        db.close()
+
+def test_stalled_upload_does_not_block_writers(client, auth_headers, seed_licenses):
+    first, second = seed_licenses(2)
+    with SessionLocal() as db:
+        category_id = db.get(models.License, first).category_id
+    resume = asyncio.Event()
+
+    async def upload():
+        yield b"category_id,product_name,license_key\r\n"
+        yield f"{category_id},Stalled,KEY-STALLED-{category_id}\r\n".encode()
+        await resume.wait()
+
+    async def run():
+        transport = httpx.ASGITransport(app=client.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            headers = {**auth_headers, "Content-Type": "text/csv"}
+            importing = asyncio.create_task(http.post(f"{API}/licenses/bulk", content=upload(), headers=headers))
+            await asyncio.sleep(0.2)  # l'import ha letto il primo blocco e aspetta il resto
+            try:
+                update = await asyncio.wait_for(
+                    http.put(f"{API}/licenses/{second}", json={"vendor": "Concurrent"}, headers=auth_headers), 10,
+                )
+            finally:
+                resume.set()
+            return update, await importing
+
+    update, imported = asyncio.run(run())
+    assert update.status_code == 200, update.text
+    assert imported.status_code == 200, imported.text
+    assert imported.json()["inserted"] == 1
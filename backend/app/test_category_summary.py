@@ -0,0 +1,68 @@
+"""
+Riepilogo per categoria: la tabella materializzata dai trigger deve
+coincidere con la GROUP BY su licenses dopo ogni tipo di modifica
+"""
+import pytest
+from sqlalchemy import select, update
+from .category_summary import install, uninstall, summary_statement
+from .database import engine
+from .models import License
+
+API = "/api/v1"
+
+def _summaries(materialized: bool) -> list[tuple]:
+    with engine.connect() as conn:
+        return [tuple(row) for row in conn.execute(summary_statement(materialized))]
+
+@pytest.fixture
+def summary_triggers():
+    """Trigger installati solo per il test: il database di test è condiviso"""
+    with engine.begin() as conn:
+        install(conn)
+    yield
+    with engine.begin() as conn:
+        uninstall(conn)
+
+def _license_counts(*category_ids: int) -> list[int]:
+    counts = {row[0]: row[3] for row in _summaries(True)}
+    return [counts[category_id] for category_id in category_ids]
+
+def _move(license_id: int, category_id: int):
+    """Spostamento di categoria: nessun endpoint lo espone, basta un UPDATE per i trigger"""
+    with engine.begin() as conn:
+        conn.execute(update(License).where(License.id == license_id).values(category_id=category_id))
+
+def test_summary_endpoint(client, auth_headers, seed_licenses):
+    ids = seed_licenses(3)
+    client.post(f"{API}/licenses/{ids[0]}/use", json={"iso_download": False}, headers=auth_headers)
+
+    response = client.get(f"{API}/categories/summary", headers=auth_headers)
+    assert response.status_code == 200, response.text
+    [summary] = [s for s in response.json() if s["license_count"] == 3]
+    assert summary["vendor_count"] == 1
+    assert summary["last_used_at"] is not None
+
+def test_materialized_summary_matches_group_by(client, auth_headers, seed_licenses, summary_triggers):
+    assert _summaries(True) == _summaries(False)
+
+    first, second, third = seed_licenses(3)
+    with engine.connect() as conn:
+        category_id = conn.execute(select(License.category_id).where(License.id == third)).scalar_one()
+    other = client.post(f"{API}/categories/", json={"name": "Summary other"}, headers=auth_headers).json()
+    steps = [
+        ("post", f"{API}/licenses/use", {"ids": [first, second], "iso_download": False}),
+        ("put", f"{API}/licenses/{second}", {"vendor": "Other vendor"}),
+        ("put", f"{API}/licenses/{third}", {"vendor": ""}),
+        ("move", third, other["id"]),
+        ("delete", f"{API}/licenses/{first}", None),
+        ("delete", f"{API}/categories/{other['id']}", None),
+    ]
+    for method, path, body in steps:
+        if method == "move":
+            assert _license_counts(category_id, other["id"]) == [3, 0]
+            _move(path, body)
+            assert _license_counts(category_id, other["id"]) == [2, 1]
+        else:
+            response = client.request(method, path, json=body, headers=auth_headers)
+            assert response.status_code == 200, response.text
+        assert _summaries(True) == _summaries(False), (method, path)
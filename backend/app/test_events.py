@@ -0,0 +1,90 @@
+"""
+Feed /events: eventi consegnati ai client solo dopo il commit
+"""
+import asyncio
+import json
+from fastapi.dependencies.utils import get_flat_dependant
+from . import deps, events
+from .database import SessionLocal, get_async_db, get_db
+from .models import Category
+from .security import create_access_token
+
+API = "/api/v1"
+
+def _collect(client, call):
+    """Esegue `call(client)` con un client SSE iscritto e restituisce gli eventi ricevuti"""
+    async def scenario():
+        subscription = events.broker.subscribe()
+        try:
+            await asyncio.to_thread(call, client)
+            # Consegna via call_soon_threadsafe: lascia girare il loop
+            await asyncio.sleep(0.05)
+            received = []
+            while not subscription.queue.empty():
+                received.append(subscription.queue.get_nowait())
+            return received
+        finally:
+            events.broker.unsubscribe(subscription)
+    return asyncio.run(scenario())
+
+def test_mutations_emit_events(client, auth_headers, seed_licenses):
+    (license_id,) = seed_licenses(1)
+
+    def mutate(client):
+        client.put(f"{API}/licenses/{license_id}", json={"vendor": "Events"}, headers=auth_headers)
+        client.post(f"{API}/licenses/{license_id}/use", json={"iso_download": False}, headers=auth_headers)
+        client.delete(f"{API}/licenses/999999999", headers=auth_headers)  # 404: nessun evento
+        client.delete(f"{API}/licenses/{license_id}", headers=auth_headers)
+
+    received = _collect(client, mutate)
+    assert [(e["type"], e["entity"], e["ids"]) for e in received] == [
+        ("updated", "license", [license_id]),
+        ("used", "license", [license_id]),
+        ("deleted", "license", [license_id]),
+    ]
+    assert all(e["user"] == "admin" for e in received)
+
+def test_rollback_discards_events(client):
+    def write_and_rollback(client):
+        with SessionLocal() as db:
+            db.add(Category(name="Events rollback"))
+            db.flush()
+            events.publish(db, "created", "category", [1])
+            db.rollback()
+            db.commit()
+
+    received = _collect(client, write_and_rollback)
+    assert received == []
+
+def test_stream_format():
+    async def scenario():
+        stream = events.stream()
+        assert await stream.__anext__() == "retry: 5000\n\n"
+        pending = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0)
+        events.broker.dispatch({"type": "created", "entity": "license", "ids": [7]})
+        chunk = await asyncio.wait_for(pending, 5)
+        await stream.aclose()
+        return chunk
+
+    chunk = asyncio.run(scenario())
+    header, data, end = chunk.split("\n", 2)
+    assert header == "event: created"
+    assert json.loads(data.removeprefix("data: "))["ids"] == [7]
+    assert end == "\n"
+
+def test_events_token_for_event_source(client, auth_headers):
+    response = client.post(f"{API}/events/token", headers=auth_headers)
+    assert response.status_code == 200, response.text
+    token = response.json()["token"]
+    assert deps.get_stream_subject(None, token) == "admin"
+
+    # Il token del feed non vale come token di accesso, e viceversa
+    assert client.get(f"{API}/users/me", headers={"Authorization": f"Bearer {token}"}).status_code == 401
+    assert client.get(f"{API}/events/", params={"token": create_access_token("admin")}).status_code == 401
+    assert client.get(f"{API}/events/").status_code == 401
+
+def test_event_stream_holds_no_session(client):
+    (route,) = [r for r in client.app.routes if getattr(r, "path", None) == f"{API}/events/"]
+    calls = {dependency.call for dependency in get_flat_dependant(route.dependant).dependencies}
+    assert not calls & {get_db, get_async_db}
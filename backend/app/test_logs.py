@@ -0,0 +1,61 @@
+"""
+Log strutturati: id della richiesta nell'header e nei record, campionamento
+"""
+import io
+import json
+import logging
+from logging.handlers import QueueListener
+import queue
+from .logs import JSONFormatter, RequestContextFilter, _QueueHandler, request_id_var
+
+API = "/api/v1"
+
+def _pipeline():
+    """Coda e listener come configure_logging, su un buffer"""
+    buffer = io.StringIO()
+    output = logging.StreamHandler(buffer)
+    output.setFormatter(JSONFormatter())
+    handler = _QueueHandler(queue.SimpleQueue())
+    handler.addFilter(RequestContextFilter())
+    logger = logging.getLogger("app.test_logs")
+    logger.propagate = False
+    logger.addHandler(handler)
+    return logger, handler, QueueListener(handler.queue, output), buffer
+
+def test_records_carry_request_id_and_extra():
+    logger, handler, listener, buffer = _pipeline()
+    listener.start()
+    token = request_id_var.set("abc123")
+    try:
+        logger.warning("Invio %s", "fallito", extra={"outbox_id": 7})
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logger.exception("Errore")
+    finally:
+        request_id_var.reset(token)
+        listener.stop()
+        logger.removeHandler(handler)
+    first, second = [json.loads(line) for line in buffer.getvalue().splitlines()]
+    assert first["message"] == "Invio fallito"
+    assert first["request_id"] == "abc123"
+    assert first["outbox_id"] == 7
+    assert "ValueError: boom" in second["exception"]
+
+def test_sampled_records_are_dropped():
+    logger, handler, listener, buffer = _pipeline()
+    listener.start()
+    try:
+        logger.info("mai", extra={"sample_rate": 0.0})
+        logger.info("sempre", extra={"sample_rate": 1.0})
+    finally:
+        listener.stop()
+        logger.removeHandler(handler)
+    assert [json.loads(line)["message"] for line in buffer.getvalue().splitlines()] == ["sempre"]
+
+def test_request_id_header(client):
+    generated = client.get(f"{API}/health").headers["X-Request-ID"]
+    assert len(generated) == 16
+    assert client.get(f"{API}/health", headers={"X-Request-ID": "proxy-42"}).headers["X-Request-ID"] == "proxy-42"
+    # Valori non validi dal client vengono sostituiti
+    assert client.get(f"{API}/health", headers={"X-Request-ID": "a b\tc"}).headers["X-Request-ID"] != "a b\tc"
@@ -0,0 +1,58 @@
+"""
+Paginazione keyset delle licenze: il cursore vale solo per l'ordinamento che l'ha prodotto
+"""
+from sqlalchemy import update
+from . import models
+from .database import SessionLocal
+from .pagination import encode_cursor
+
+API = "/api/v1"
+
+def test_cursor_pages_cover_all_rows(client, auth_headers, seed_licenses):
+    ids = set(seed_licenses(5))
+    seen, cursor = [], None
+    while True:
+        params = {"sort": "product_name", "limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = client.get(f"{API}/licenses/", params=params, headers=auth_headers)
+        assert response.status_code == 200, response.text
+        seen += [row["id"] for row in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert ids <= set(seen)
+    assert len(seen) == len(set(seen))
+
+def test_cursor_from_other_sort_is_rejected(client, auth_headers, seed_licenses):
+    seed_licenses(3)
+    response = client.get(f"{API}/licenses/", params={"sort": "-updated_at", "limit": 1}, headers=auth_headers)
+    cursor = response.headers["X-Next-Cursor"]
+
+    response = client.get(f"{API}/licenses/", params={"sort": "id", "limit": 1, "cursor": cursor}, headers=auth_headers)
+    assert response.status_code == 400
+
+def test_cursor_with_wrong_value_type_is_rejected(client, auth_headers):
+    cursor = encode_cursor("not-a-date", 1, "-updated_at")
+    response = client.get(f"{API}/licenses/", params={"limit": 1, "cursor": cursor}, headers=auth_headers)
+    assert response.status_code == 400
+
+def test_search_pages_with_tied_scores(client, auth_headers, seed_licenses):
+    ids = seed_licenses(5)
+    db = SessionLocal()
+    try:
+        # Stesso testo: stesso punteggio per tutte, i pareggi cadono sul confine di pagina
+        db.execute(update(models.License).where(models.License.id.in_(ids)).values(product_name="Zyxtied Suite"))
+        db.commit()
+    finally:
+        db.close()
+
+    seen, cursor = [], None
+    while True:
+        params = {"q": "zyxtied", "limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = client.get(f"{API}/licenses/search", params=params, headers=auth_headers)
+        assert response.status_code == 200, response.text
+        assert len({hit["score"] for hit in response.json()}) <= 1
+        seen += [hit["license"]["id"] for hit in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert sorted(seen) == sorted(ids)
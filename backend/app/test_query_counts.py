@@ -0,0 +1,50 @@
+"""
+Budget di query SQL per route: un N+1 fa crescere il numero di query con il
+numero di righe e fa fallire questi test.
+"""
+import pytest
+
+API = "/api/v1"
+
+# (metodo, percorso, corpo JSON, budget) a cache fredde; {ids} = licenze create dal test.
+# Le liste in cache leggono anche la versione dei dati (response_cache): utente, versione, dati
+ROUTE_BUDGETS = [
+    ("GET", f"{API}/categories/", None, 3),
+    ("GET", f"{API}/categories/summary", None, 3),
+    ("GET", f"{API}/licenses/", None, 3),
+    ("GET", f"{API}/licenses/?limit=10", None, 3),
+    ("GET", f"{API}/licenses/search?q=product", None, 4),
+    ("GET", f"{API}/licenses/export", None, 2),
+    ("GET", f"{API}/licenses/usage?bucket=week&group=category", None, 3),
+    ("GET", f"{API}/sync/?limit=50", None, 4),
+    ("GET", f"{API}/users/me", None, 1),
+    ("POST", f"{API}/licenses/{{first}}/use", {"iso_download": False}, 6),
+    ("POST", f"{API}/licenses/use", {"ids": "{ids}", "iso_download": False}, 6),
+]
+
+def _request(client, headers, method, path, body, ids):
+    path = path.format(first=ids[0])
+    if body and body.get("ids") == "{ids}":
+        body = {**body, "ids": ids}
+    response = client.request(method, path, json=body, headers=headers)
+    assert response.status_code == 200, response.text
+    return response
+
+@pytest.mark.parametrize("method,path,body,budget", ROUTE_BUDGETS)
+def test_route_query_budget(client, auth_headers, query_counter, seed_licenses, method, path, body, budget):
+    ids = seed_licenses(20)
+    with query_counter.count(budget, f"{method} {path}"):
+        _request(client, auth_headers, method, path, body, ids)
+
+@pytest.mark.parametrize("method,path,body,budget", ROUTE_BUDGETS)
+def test_route_queries_do_not_grow_with_rows(client, auth_headers, query_counter, seed_licenses, method, path, body, budget):
+    few, many = seed_licenses(3), seed_licenses(30)
+    # Prima richiesta a vuoto: l'indice di ricerca in memoria viene costruito una volta
+    _request(client, auth_headers, method, path, body, few)
+
+    with query_counter.count():
+        _request(client, auth_headers, method, path, body, few)
+    small = len(query_counter.statements)
+    with query_counter.count():
+        _request(client, auth_headers, method, path, body, many)
+    assert len(query_counter.statements) == small, query_counter.statements
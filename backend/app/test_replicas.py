@@ -0,0 +1,77 @@
+"""
+Letture su replica: endpoint di sola lettura a turno sulle repliche
+disponibili, scritture e letture dopo una modifica sul primario
+"""
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import create_async_engine
+from . import database, models
+from .config import get_settings
+
+API = "/api/v1"
+
+class StatementLog:
+    def __init__(self, engines):
+        self.statements = []
+        self.engines = engines
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def close(self):
+        for engine in self.engines:
+            event.remove(engine, "before_cursor_execute", self._record)
+
+def test_routing_session_switches_to_primary_after_write(client):
+    replicas = database.ReplicaSet([get_settings().sqlalchemy_database_uri])
+    db = database.RoutingSession(bind=database.engine, replicas=replicas)
+    try:
+        db.use_replica()
+        assert db.get_bind(clause=select(models.Category)) is replicas.engines[0]
+        db.add(models.Category(name="Replica routing"))
+        db.flush()
+        assert db.get_bind(clause=select(models.Category)) is database.engine
+    finally:
+        db.rollback()
+        db.close()
+
+def test_unreachable_replica_is_ejected():
+    url = get_settings().sqlalchemy_database_uri
+    replicas = database.ReplicaSet([url, "sqlite:////nonexistent/replica.db"])
+    replicas.check()
+    assert [r["available"] for r in replicas.status()] == [True, False]
+    assert {replicas.choose() for _ in range(4)} == {replicas.engines[0]}
+
+def test_reads_stick_to_primary_after_write(client, auth_headers, seed_licenses, monkeypatch):
+    replicas = database.ReplicaSet([get_settings().sqlalchemy_database_uri])
+    monkeypatch.setattr(database, "replicas", replicas)
+    monkeypatch.setitem(database.SessionLocal.kw, "replicas", replicas)
+    if database.AsyncSessionLocal is not None:
+        replicas.add_async_engines(create_async_engine)
+        monkeypatch.setitem(database.AsyncSessionLocal.kw, "replicas", replicas)
+    log = StatementLog(replicas.engines + [e.sync_engine for e in replicas.async_engines])
+    (license_id,) = seed_licenses(1)
+    client.cookies.clear()
+    database.primary_stickiness.local.clear()
+    try:
+        assert client.get(f"{API}/licenses/search", params={"q": "x"}, headers=auth_headers).status_code == 200
+        assert log.statements, "la ricerca deve leggere dalla replica"
+
+        log.statements.clear()
+        response = client.put(f"{API}/licenses/{license_id}", json={"vendor": "Primary"}, headers=auth_headers)
+        assert database.PRIMARY_COOKIE in response.cookies
+        assert client.get(f"{API}/licenses/search", params={"q": "y"}, headers=auth_headers).status_code == 200
+        assert log.statements == []
+
+        # Client Bearer senza cookie: fissato sul primario tramite il soggetto del token
+        client.cookies.clear()
+        assert client.get(f"{API}/licenses/search", params={"q": "z"}, headers=auth_headers).status_code == 200
+        assert log.statements == []
+        database.primary_stickiness.local.clear()
+        assert client.get(f"{API}/licenses/search", params={"q": "w"}, headers=auth_headers).status_code == 200
+        assert log.statements
+    finally:
+        client.cookies.clear()
+        database.primary_stickiness.local.clear()
+        log.close()
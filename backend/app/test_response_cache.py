@@ -0,0 +1,56 @@
+"""
+Cache delle risposte senza Redis: la versione viene dal database, quindi una
+modifica fatta da una sessione che non chiama invalidate cambia subito l'ETag;
+la versione resta in memoria, così un 304 non interroga il database
+"""
+from sqlalchemy import event, update
+from . import database, models
+from .database import SessionLocal, engine
+from .response_cache import LocalVersion
+
+API = "/api/v1"
+
+def test_etag_follows_writes_from_other_workers(client, auth_headers, seed_licenses):
+    (license_id,) = seed_licenses(1)
+    first = client.get(f"{API}/licenses/", headers=auth_headers)
+    etag = first.headers["ETag"]
+    assert client.get(f"{API}/licenses/", headers={**auth_headers, "If-None-Match": etag}).status_code == 304
+
+    db = SessionLocal()
+    try:
+        db.execute(update(models.License).where(models.License.id == license_id).values(vendor="Other worker"))
+        db.commit()
+    finally:
+        db.close()
+
+    response = client.get(f"{API}/licenses/", headers={**auth_headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert {"id": license_id, "vendor": "Other worker"}.items() <= next(
+        row for row in response.json() if row["id"] == license_id
+    ).items()
+
+def test_not_modified_without_queries(client, auth_headers, seed_licenses):
+    seed_licenses(1)
+    etag = client.get(f"{API}/licenses/", headers=auth_headers).headers["ETag"]
+    statements = []
+    engines = [engine] + ([database.async_engine.sync_engine] if database.async_engine else [])
+    record = lambda conn, cursor, statement, *args: statements.append(statement)
+    for target in engines:
+        event.listen(target, "before_cursor_execute", record)
+    try:
+        response = client.get(f"{API}/licenses/", headers={**auth_headers, "If-None-Match": etag})
+    finally:
+        for target in engines:
+            event.remove(target, "before_cursor_execute", record)
+    assert response.status_code == 304
+    assert statements == []
+
+def test_local_version_ignores_reads_older_than_a_commit():
+    version = LocalVersion(ttl=60)
+    generation = version.generation  # inizio della transazione che legge la versione
+    version.invalidate()  # commit di un'altra sessione nel frattempo
+    version.set("seq:1", generation)
+    assert version.get() is None
+    version.set("seq:2", version.generation)
+    assert version.get() == "seq:2"
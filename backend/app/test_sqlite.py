@@ -0,0 +1,114 @@
+"""
+SQLite: pragma di ogni connessione e coda delle scritture del processo
+"""
+import threading
+import time
+import pytest
+from sqlalchemy import event, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from .database import SQLiteWriteQueue, engine
+from . import database
+
+API = "/api/v1"
+
+pytestmark = pytest.mark.skipif(engine.dialect.name != "sqlite", reason="solo SQLite")
+
+def test_connection_pragmas():
+    with engine.connect() as conn:
+        pragma = lambda name: conn.execute(text(f"PRAGMA {name}")).scalar()
+        assert pragma("journal_mode") == "wal"
+        assert pragma("synchronous") == 1  # NORMAL
+        assert pragma("foreign_keys") == 1
+
+def test_write_requests_begin_immediate(client, auth_headers, seed_licenses):
+    """Le richieste che modificano dati prendono il lock di scrittura al BEGIN (niente SQLITE_BUSY_SNAPSHOT)"""
+    license_id = seed_licenses(1)[0]
+    statements = []
+    begins = lambda: [statement for statement in statements if statement.startswith("BEGIN")]
+    engines = [engine] + ([database.async_engine.sync_engine] if database.async_engine else [])
+    record = lambda conn, cursor, statement, *args: statements.append(statement)
+    for target in engines:
+        event.listen(target, "before_cursor_execute", record)
+    try:
+        assert client.get(f"{API}/categories/", headers=auth_headers).status_code == 200
+        assert begins() and set(begins()) == {"BEGIN DEFERRED"}
+        statements.clear()
+        response = client.put(f"{API}/licenses/{license_id}", json={"vendor": "Immediate"}, headers=auth_headers)
+        assert response.status_code == 200, response.text
+        assert begins() and set(begins()) == {"BEGIN IMMEDIATE"}
+        statements.clear()
+        # Il login non tiene il lock durante bcrypt
+        response = client.post(f"{API}/auth/login-json", json={"username": "admin", "password": "ChangeMe!123"})
+        assert response.status_code == 200, response.text
+        assert "BEGIN IMMEDIATE" not in begins()
+        statements.clear()
+        # Cambio password: bcrypt nella transazione di lettura, l'UPDATE in una IMMEDIATE
+        response = client.post(
+            f"{API}/users/change-password",
+            json={"current_password": "ChangeMe!123", "new_password": "ChangeMe!123"},
+            headers=auth_headers,
+        )
+        assert response.status_code == 200, response.text
+        assert begins()[0] == "BEGIN DEFERRED"
+        update = next(i for i, statement in enumerate(statements) if statement.startswith("UPDATE users"))
+        assert [s for s in statements[:update] if s.startswith("BEGIN")][-1] == "BEGIN IMMEDIATE"
+    finally:
+        for target in engines:
+            event.remove(target, "before_cursor_execute", record)
+
+def test_write_queue_serves_writers_in_order():
+    queue = SQLiteWriteQueue(timeout=5)
+    order = []
+    queue.acquire()
+
+    def writer(n):
+        queue.acquire()
+        order.append(n)
+        queue.release()
+
+    threads = []
+    for n in range(3):
+        threads.append(threading.Thread(target=writer, args=(n,)))
+        threads[-1].start()
+        time.sleep(0.05)  # ordine di arrivo deterministico
+    queue.release()
+    for thread in threads:
+        thread.join(5)
+    assert order == [0, 1, 2]
+
+    assert queue.wait_stats.snapshot()["checkouts"] == 4
+
+def test_write_queue_timeout():
+    queue = SQLiteWriteQueue(timeout=0.05)
+    queue.acquire()
+    with pytest.raises(PoolTimeoutError):
+        queue.acquire()
+    assert queue.wait_stats.snapshot()["timeouts"] == 1
+    queue.release()
+    queue.acquire()
+
+def test_concurrent_upgrades_apply_migrations_once(tmp_path):
+    from sqlalchemy import create_engine
+    from .migrate import LATEST_VERSION, MIGRATIONS, current_version, upgrade
+
+    url = f"sqlite:///{tmp_path}/concurrent.db"
+    engines = [create_engine(url, connect_args={"timeout": 30}) for _ in range(2)]
+    results, errors = [], []
+
+    def run(target):
+        try:
+            results.append(upgrade(target))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(target,)) for target in engines]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    assert errors == []
+    assert sorted(len(applied) for applied in results) == [0, len(MIGRATIONS)]
+    with engines[0].connect() as conn:
+        assert current_version(conn) == LATEST_VERSION
+    for target in engines:
+        target.dispose()
@@ -0,0 +1,71 @@
+"""
+Sincronizzazione incrementale: solo le righe modificate dopo il token,
+eliminazioni comprese, anche a pagine
+"""
+from .pagination import encode_cursor
+
+API = "/api/v1"
+
+def _sync(client, headers, since=None, limit=1000):
+    params = {"limit": limit}
+    if since:
+        params["since"] = since
+    response = client.get(f"{API}/sync/", params=params, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def _drain(client, headers, since, limit=1000):
+    pages = [_sync(client, headers, since, limit)]
+    while pages[-1]["has_more"]:
+        pages.append(_sync(client, headers, pages[-1]["token"], limit))
+    return pages
+
+def test_sync_returns_only_changes(client, auth_headers, seed_licenses):
+    created, updated, used, deleted, untouched = seed_licenses(5)
+    full = _drain(client, auth_headers, None)
+    assert full[0]["reset"]
+    assert {created, untouched} <= {lic["id"] for page in full for lic in page["licenses"]}
+    token = full[-1]["token"]
+
+    assert _sync(client, auth_headers, token)["licenses"] == []
+
+    client.put(f"{API}/licenses/{updated}", json={"vendor": "Changed"}, headers=auth_headers)
+    client.post(f"{API}/licenses/{used}/use", json={"iso_download": False}, headers=auth_headers)
+    client.delete(f"{API}/licenses/{deleted}", headers=auth_headers)
+    category = client.post(f"{API}/categories/", json={"name": "Sync new"}, headers=auth_headers).json()
+    client.delete(f"{API}/categories/{category['id']}", headers=auth_headers)
+
+    delta = _sync(client, auth_headers, token)
+    assert not delta["reset"] and not delta["has_more"]
+    assert {lic["id"] for lic in delta["licenses"]} == {updated, used}
+    assert delta["deleted"]["licenses"] == [deleted]
+    # Categoria creata ed eliminata dopo il token: solo l'eliminazione
+    assert delta["categories"] == []
+    assert delta["deleted"]["categories"] == [category["id"]]
+
+    # Stesse modifiche una alla volta
+    pages = _drain(client, auth_headers, token, limit=1)
+    assert len(pages) == 4
+    assert {lic["id"] for page in pages for lic in page["licenses"]} == {updated, used}
+    assert _sync(client, auth_headers, pages[-1]["token"])["licenses"] == []
+
+def test_empty_inventory_token_is_not_a_reset(tmp_path):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from .migrate import upgrade
+    from .sync import changes
+
+    engine = create_engine(f"sqlite:///{tmp_path}/empty.db")
+    upgrade(engine)
+    try:
+        with Session(engine) as db:
+            first = changes(db, None, 100)
+            assert first["reset"] and first["licenses"] == []
+            assert not changes(db, first["token"], 100)["reset"]
+    finally:
+        engine.dispose()
+
+def test_malformed_token_is_rejected(client, auth_headers):
+    for token in (encode_cursor("10", 0), encode_cursor(None, 0), "not-a-token"):
+        response = client.get(f"{API}/sync/", params={"since": token}, headers=auth_headers)
+        assert response.status_code == 400, response.text
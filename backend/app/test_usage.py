@@ -0,0 +1,36 @@
+"""
+Storico utilizzi: eventi e rollup scritti dall'uso delle licenze
+"""
+from datetime import date, timedelta
+
+API = "/api/v1"
+
+def test_usage_buckets(client, auth_headers, seed_licenses):
+    first, second = seed_licenses(2)
+    client.post(f"{API}/licenses/{first}/use", json={"iso_download": False}, headers=auth_headers)
+    client.post(f"{API}/licenses/use", json={"ids": [first, second], "iso_download": False}, headers=auth_headers)
+
+    today = date.today()
+    monday = today - timedelta(days=today.weekday())
+    expected = {
+        "day": today,
+        "week": monday,
+        "month": today.replace(day=1),
+    }
+    for bucket, start in expected.items():
+        response = client.get(f"{API}/licenses/usage", params={"bucket": bucket, "since": today.isoformat()}, headers=auth_headers)
+        assert response.status_code == 200, response.text
+        counts = {row["id"]: (row["start"], row["count"]) for row in response.json()["rows"]}
+        assert counts[first] == (start.isoformat(), 2)
+        assert counts[second] == (start.isoformat(), 1)
+
+def test_usage_by_category(client, auth_headers, seed_licenses):
+    ids = seed_licenses(3)
+    client.post(f"{API}/licenses/use", json={"ids": ids, "iso_download": True}, headers=auth_headers)
+
+    single = client.get(f"{API}/licenses/usage", params={"group": "category", "license_id": ids[0]}, headers=auth_headers)
+    [row] = single.json()["rows"]
+    assert row["count"] == 1
+
+    category = client.get(f"{API}/licenses/usage", params={"group": "category", "category_id": row["id"]}, headers=auth_headers)
+    assert [r["count"] for r in category.json()["rows"]] == [3]
@@ -0,0 +1,158 @@
+"""
+Storico degli utilizzi delle licenze.
+
+Ogni uso aggiunge un evento a license_usage (solo inserimenti) e incrementa
+il rollup giornaliero license_usage_daily nella stessa transazione: le
+statistiche per giorno, settimana o mese leggono solo i rollup, mai gli eventi.
+
+Con USAGE_PARTITIONING su PostgreSQL license_usage è partizionata per mese
+su used_at; le partizioni dei mesi successivi vanno create in anticipo
+(es. da cron, una volta al mese):
+
+    python -m app.migrate partitions
+"""
+from datetime import date, datetime
+from sqlalchemy import Date, Integer, cast, func, insert, select, text, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+from .config import get_settings
+from .database import upsert_insert
+from .models import LicenseUsage, LicenseUsageDaily
+
+settings = get_settings()
+
+BUCKETS = ("day", "week", "month")
+GROUPS = ("license", "category")
+# Partizioni mensili create in anticipo oltre al mese corrente
+PARTITION_MONTHS_AHEAD = 2
+
+def record_usage(db: Session, licenses, user_id: int | None, iso_download: bool, used_at: datetime | None = None):
+    """Registra l'uso di `licenses` (oggetti con id e category_id): due istruzioni in tutto.
+
+    Non esegue il commit: gli eventi restano nella transazione dell'uso.
+    """
+    used_at = used_at or datetime.utcnow()
+    events = [
+        {"license_id": lic.id, "category_id": lic.category_id, "user_id": user_id,
+         "used_at": used_at, "iso_download": iso_download}
+        for lic in licenses
+    ]
+    if not events:
+        return
+    db.execute(insert(LicenseUsage), events)
+
+    day = used_at.date()
+    rollups = [{"day": day, "license_id": e["license_id"], "category_id": e["category_id"], "count": 1} for e in events]
+    dialect_insert = upsert_insert(db)
+    if dialect_insert is not None:
+        stmt = dialect_insert(LicenseUsageDaily).values(rollups)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[LicenseUsageDaily.day, LicenseUsageDaily.license_id],
+            set_={"count": LicenseUsageDaily.count + stmt.excluded.count, "category_id": stmt.excluded.category_id},
+        ))
+        return
+    for row in rollups:
+        updated = db.execute(
+            update(LicenseUsageDaily)
+            .where(LicenseUsageDaily.day == day, LicenseUsageDaily.license_id == row["license_id"])
+            .values(count=LicenseUsageDaily.count + 1)
+        )
+        if updated.rowcount == 0:
+            db.execute(insert(LicenseUsageDaily).values(row))
+
+def _bucket_start(bucket: str, dialect: str):
+    day = LicenseUsageDaily.day
+    if bucket == "day":
+        return day
+    if dialect == "postgresql":
+        return cast(func.date_trunc(bucket, day), Date)
+    if bucket == "week":
+        # Settimane da lunedì, come date_trunc('week') di PostgreSQL
+        offset = (cast(func.strftime("%w", day), Integer) + 6) % 7
+        return func.date(day, func.printf("-%d days", offset))
+    return func.strftime("%Y-%m-01", day)
+
+def usage_statement(
+    dialect: str,
+    bucket: str,
+    group: str,
+    since: date | None = None,
+    until: date | None = None,
+    license_id: int | None = None,
+    category_id: int | None = None,
+):
+    """Conteggi per (inizio periodo, licenza o categoria) dai rollup giornalieri.
+
+    `since` e `until` (incluso) filtrano i giorni: il primo e l'ultimo periodo
+    possono quindi essere parziali.
+    """
+    start = _bucket_start(bucket, dialect).label("start")
+    key = (LicenseUsageDaily.license_id if group == "license" else LicenseUsageDaily.category_id).label("id")
+    stmt = select(start, key, func.sum(LicenseUsageDaily.count).label("count"))
+    if since is not None:
+        stmt = stmt.where(LicenseUsageDaily.day >= since)
+    if until is not None:
+        stmt = stmt.where(LicenseUsageDaily.day <= until)
+    if license_id is not None:
+        stmt = stmt.where(LicenseUsageDaily.license_id == license_id)
+    if category_id is not None:
+        stmt = stmt.where(LicenseUsageDaily.category_id == category_id)
+    return stmt.group_by(start, key).order_by(start, key)
+
+def usage_rows(rows) -> list[dict]:
+    """Normalizza l'inizio periodo a date (SQLite lo restituisce come testo)"""
+    return [
+        {"start": r.start if isinstance(r.start, date) else date.fromisoformat(str(r.start)[:10]),
+         "id": r.id, "count": int(r.count)}
+        for r in rows
+    ]
+
+def _add_months(day: date, months: int) -> date:
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+def create_partitioned_table(conn: Connection):
+    """license_usage partizionata per mese su used_at (solo PostgreSQL).
+
+    La chiave primaria deve includere la colonna di partizionamento; la
+    partizione DEFAULT raccoglie gli eventi dei mesi senza partizione.
+    """
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS license_usage ("
+        " id SERIAL,"
+        " license_id INTEGER NOT NULL REFERENCES licenses(id) ON DELETE CASCADE,"
+        " category_id INTEGER NOT NULL,"
+        " user_id INTEGER REFERENCES users(id) ON DELETE SET NULL,"
+        " used_at TIMESTAMP NOT NULL,"
+        " iso_download BOOLEAN NOT NULL DEFAULT false,"
+        " PRIMARY KEY (id, used_at)"
+        ") PARTITION BY RANGE (used_at)"
+    ))
+    conn.execute(text("CREATE TABLE IF NOT EXISTS license_usage_default PARTITION OF license_usage DEFAULT"))
+    for index in LicenseUsage.__table__.indexes:
+        index.create(conn, checkfirst=True)
+    ensure_partitions(conn)
+
+def ensure_partitions(conn: Connection, months_ahead: int = PARTITION_MONTHS_AHEAD) -> list[str]:
+    """Crea le partizioni mensili dal mese corrente a `months_ahead` mesi avanti"""
+    created = []
+    first = date.today().replace(day=1)
+    for i in range(months_ahead + 1):
+        start, end = _add_months(first, i), _add_months(first, i + 1)
+        name = f"license_usage_{start:%Y%m}"
+        exists = conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar()
+        if exists is None:
+            conn.execute(text(
+                f"CREATE TABLE {name} PARTITION OF license_usage "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            ))
+            created.append(name)
+    return created
+
+def create_tables(conn: Connection):
+    """Tabelle dello storico utilizzi, partizionate se richiesto e supportato"""
+    if settings.USAGE_PARTITIONING and conn.dialect.name == "postgresql":
+        create_partitioned_table(conn)
+    else:
+        LicenseUsage.__table__.create(conn, checkfirst=True)
+    LicenseUsageDaily.__table__.create(conn, checkfirst=True)
@@ -0,0 +1,175 @@
+"""
+Load test degli endpoint principali: latenza p50/p99 e throughput.
+
+Scenari: login, list (paginazione keyset), search, create, use e bulk (100
+righe per richiesta). Senza --url l'applicazione viene chiamata nel processo
+via ASGI su un database SQLite in benchmarks/data, popolato con il dataset
+richiesto; con --url si misura un server già avviato (es. il container con
+PostgreSQL, popolato prima con benchmarks.seed).
+
+Per confrontare SQLite (WAL, coda di scrittura) con PostgreSQL sugli stessi
+scenari basta cambiare DATABASE_URL, o le variabili SQLITE_* per misurare
+l'effetto dei singoli pragma.
+
+    cd backend && python -m benchmarks.bench_api --size 100k
+    python -m benchmarks.bench_api --url http://localhost:8000 --concurrency 16 --scenarios list,search
+
+I risultati vengono salvati in JSON (vedi benchmarks.compare).
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import time
+from pathlib import Path
+from .common import print_table, summarize, write_results
+from .seed import PRODUCTS, parse_size
+
+API = "/api/v1"
+DATA_DIR = Path(__file__).parent / "data"
+BULK_ROWS = 100
+
+class Context:
+    def __init__(self, username: str, password: str):
+        self.username = username
+        self.password = password
+        self.run = f"{int(time.time())}"
+        self.license_ids: list[int] = []
+        self.category_id: int | None = None
+
+    def new_license(self, key: str) -> dict:
+        return {
+            "category_id": self.category_id,
+            "product_name": f"Benchmark {key}",
+            "vendor": "Benchmark",
+            "license_key": f"BENCH-{self.run}-{key}",
+        }
+
+async def login(client, ctx: Context, i: int, state: dict):
+    return await client.post(f"{API}/auth/login-json", json={"username": ctx.username, "password": ctx.password})
+
+async def list_page(client, ctx: Context, i: int, state: dict):
+    # Ogni worker scorre le pagine con il cursore: richieste sempre diverse, niente cache
+    params = {"limit": 100, "sort": "-updated_at"}
+    if state.get("cursor"):
+        params["cursor"] = state["cursor"]
+    response = await client.get(f"{API}/licenses/", params=params)
+    state["cursor"] = response.headers.get("X-Next-Cursor")
+    return response
+
+async def search(client, ctx: Context, i: int, state: dict):
+    terms = [PRODUCTS[i % len(PRODUCTS)].lower(), str(i % 1000)]
+    mode = "prefix" if i % 2 else "full"
+    return await client.get(f"{API}/licenses/search", params={"q": " ".join(terms), "mode": mode})
+
+async def create(client, ctx: Context, i: int, state: dict):
+    return await client.post(f"{API}/licenses/", json=ctx.new_license(f"c{i}"))
+
+async def use(client, ctx: Context, i: int, state: dict):
+    license_id = random.choice(ctx.license_ids)
+    return await client.post(f"{API}/licenses/{license_id}/use", json={"iso_download": False})
+
+async def bulk(client, ctx: Context, i: int, state: dict):
+    rows = [ctx.new_license(f"b{i}-{n}") for n in range(BULK_ROWS)]
+    return await client.post(f"{API}/licenses/bulk", json=rows)
+
+# nome -> (richieste di default, funzione)
+SCENARIOS = {
+    "login": (50, login),
+    "list": (500, list_page),
+    "search": (500, search),
+    "create": (200, create),
+    "use": (500, use),
+    "bulk": (20, bulk),
+}
+
+async def run_scenario(client, ctx: Context, scenario, requests: int, concurrency: int) -> dict:
+    for i in range(min(5, requests)):  # riscaldamento
+        await scenario(client, ctx, -i - 1, {})
+    latencies: list[float] = []
+    errors = 0
+    counter = itertools.count()
+
+    async def worker():
+        nonlocal errors
+        state: dict = {}
+        while (i := next(counter)) < requests:
+            t0 = time.perf_counter()
+            response = await scenario(client, ctx, i, state)
+            latencies.append(time.perf_counter() - t0)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+async def prepare(client, ctx: Context):
+    response = await client.post(f"{API}/auth/login-json", json={"username": ctx.username, "password": ctx.password})
+    response.raise_for_status()
+    client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+    page = await client.get(f"{API}/licenses/", params={"limit": 500})
+    page.raise_for_status()
+    licenses = page.json()
+    if not licenses:
+        raise SystemExit("Nessuna licenza nel database: eseguire prima benchmarks.seed")
+    ctx.license_ids = [lic["id"] for lic in licenses]
+    ctx.category_id = licenses[0]["category_id"]
+
+def in_process_app(size: int):
+    """Configura l'ambiente prima di importare l'applicazione"""
+    DATA_DIR.mkdir(exist_ok=True)
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{DATA_DIR}/bench-{size}.db")
+    # Il benchmark misura gli endpoint, non il rate limiter
+    os.environ.setdefault("RATE_LIMIT", "100000000/hour")
+    os.environ.setdefault("RATE_LIMIT_LOGIN", "100000000/hour")
+
+    from app.database import engine
+    from app.main import app
+    from .seed import ensure_dataset
+    ensure_dataset(engine, size)
+    return app, engine.dialect.name
+
+async def main(args):
+    import httpx
+
+    size = parse_size(args.size)
+    if args.url:
+        transport, base_url, dialect = None, args.url, None
+    else:
+        app, dialect = in_process_app(size)
+        transport, base_url = httpx.ASGITransport(app=app), "http://bench"
+
+    ctx = Context(args.username, args.password)
+    names = args.scenarios.split(",") if args.scenarios else list(SCENARIOS)
+    results = {}
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=120) as client:
+        await prepare(client, ctx)
+        for name in names:
+            default_requests, scenario = SCENARIOS[name]
+            requests = max(1, int(default_requests * args.scale))
+            results[name] = await run_scenario(client, ctx, scenario, requests, args.concurrency)
+            print(f"{name}: {results[name]['p50_ms']:.2f} ms p50")
+
+    print_table(results)
+    params = {"size": size, "url": args.url, "dialect": dialect, "concurrency": args.concurrency, "scale": args.scale}
+    if dialect == "sqlite":
+        # Pragma e coda di scrittura: confrontabili tra esecuzioni con impostazioni diverse
+        from app.config import get_settings
+        params["sqlite"] = {
+            key: value for key, value in get_settings().model_dump().items() if key.startswith("SQLITE_")
+        }
+    print(f"Risultati: {write_results('api', results, params, args.output)}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", default="1k", help="dataset: 1k, 100k, 1m (solo in processo)")
+    parser.add_argument("--url", help="server da misurare invece dell'applicazione nel processo")
+    parser.add_argument("--scenarios", help=f"sottoinsieme di {','.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--scale", type=float, default=1.0, help="moltiplicatore del numero di richieste")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="ChangeMe!123")
+    parser.add_argument("--output", help="file JSON dei risultati")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,55 @@
+"""
+Micro-benchmark dell'autenticazione: verify_password (bcrypt al costo
+BCRYPT_ROUNDS, tramite il pool di PASSWORD_HASH_WORKERS), create_access_token,
+decodifica del JWT in get_current_user e get_current_user con l'utente in cache.
+
+    cd backend && python -m benchmarks.bench_auth [--iterations N]
+"""
+import argparse
+import os
+
+# Nessun accesso al database: basta che app.database sia importabile
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from fastapi.security import HTTPAuthorizationCredentials
+from app.cache import user_cache
+from app.config import get_settings
+from app.deps import USER_COLUMNS, get_current_user, get_token_subject
+from app.security import _hash, create_access_token, password_hasher, verify_password
+from .common import print_table, time_calls, write_results
+
+PASSWORD = "ChangeMe!123"
+# bcrypt è lento per costruzione: meno iterazioni
+BCRYPT_ITERATIONS = 20
+
+def main(iterations: int, output: str | None):
+    settings = get_settings()
+    hashed = _hash(PASSWORD)
+    token = create_access_token("benchmark")
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+    user_cache.set("benchmark", {key: None for key in USER_COLUMNS} | {"id": 1, "username": "benchmark"})
+
+    results = {
+        "verify_password": time_calls(lambda: verify_password(PASSWORD, hashed), BCRYPT_ITERATIONS, warmup=2),
+        "create_access_token": time_calls(lambda: create_access_token("benchmark"), iterations),
+        "jwt_decode": time_calls(lambda: get_token_subject(credentials), iterations),
+        "get_current_user_cached": time_calls(
+            lambda: get_current_user(get_token_subject(credentials), db=None), iterations
+        ),
+    }
+    password_hasher.shutdown()
+
+    print_table(results)
+    params = {
+        "iterations": iterations,
+        "bcrypt_rounds": settings.BCRYPT_ROUNDS,
+        "password_hash_workers": settings.PASSWORD_HASH_WORKERS,
+    }
+    print(f"Risultati: {write_results('auth', results, params, output)}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--output", help="file JSON dei risultati")
+    args = parser.parse_args()
+    main(args.iterations, args.output)
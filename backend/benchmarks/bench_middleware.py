@@ -0,0 +1,91 @@
+"""
+Overhead per richiesta dei middleware degli header di sicurezza.
+
+Confronta lo stack precedente (due BaseHTTPMiddleware) con il middleware ASGI
+di app.security_headers, chiamando l'applicazione direttamente via ASGI
+(niente rete né server) su un endpoint che restituisce un piccolo JSON.
+
+    cd backend && python -m benchmarks.bench_middleware [--requests N]
+"""
+import argparse
+import asyncio
+import time
+from starlette.applications import Starlette
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from app.security_headers import SECURITY_HEADERS, SecurityHeadersMiddleware
+
+async def endpoint(request):
+    return JSONResponse({"status": "ok"})
+
+def plain_app():
+    return Starlette(routes=[Route("/", endpoint)])
+
+def legacy_app():
+    """I due middleware rimossi: classe BaseHTTPMiddleware e funzione @app.middleware("http")"""
+    app = plain_app()
+
+    async def class_middleware(request, call_next):
+        response = await call_next(request)
+        for name, value in SECURITY_HEADERS.items():
+            response.headers[name] = value
+        return response
+
+    async def function_middleware(request, call_next):
+        response = await call_next(request)
+        for name, value in SECURITY_HEADERS.items():
+            response.headers.setdefault(name, value)
+        return response
+
+    app.add_middleware(BaseHTTPMiddleware, dispatch=class_middleware)
+    app.add_middleware(BaseHTTPMiddleware, dispatch=function_middleware)
+    return app
+
+def asgi_app():
+    app = plain_app()
+    app.add_middleware(SecurityHeadersMiddleware)
+    return app
+
+SCOPE = {
+    "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+    "scheme": "http", "path": "/", "raw_path": b"/", "root_path": "", "query_string": b"",
+    "headers": [(b"host", b"testserver")], "client": ("127.0.0.1", 1234), "server": ("testserver", 80),
+}
+
+async def request(app):
+    body_sent = False
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Il client resta connesso: chi attende la disconnessione viene cancellato
+        await asyncio.Future()
+
+    async def send(message):
+        pass
+
+    await app(dict(SCOPE), receive, send)
+
+async def run(app, requests: int) -> float:
+    for _ in range(200):  # riscaldamento
+        await request(app)
+    start = time.perf_counter()
+    for _ in range(requests):
+        await request(app)
+    return (time.perf_counter() - start) / requests * 1e6
+
+async def main(requests: int):
+    results = {}
+    for name, factory in (("nessun middleware", plain_app), ("BaseHTTPMiddleware x2", legacy_app), ("ASGI", asgi_app)):
+        results[name] = await run(factory(), requests)
+    baseline = results["nessun middleware"]
+    for name, micros in results.items():
+        print(f"{name:<24} {micros:8.1f} µs/richiesta  (+{micros - baseline:.1f} µs)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    asyncio.run(main(parser.parse_args().requests))
@@ -0,0 +1,103 @@
+"""
+Righe al secondo serializzate dalla lista licenze (query + JSON).
+
+Confronta, su un database SQLite in memoria:
+
+  - ORM + LicenseRead + json: oggetti ORM validati uno per uno e codificati con
+    jsonable_encoder e json.dumps, come faceva FastAPI con response_model;
+  - ORM + TypeAdapter: oggetti ORM validati e serializzati da pydantic-core;
+  - colonne + orjson: select() sulle sole colonne di LicenseRead e orjson
+    (il percorso attuale di routes_licenses).
+
+    cd backend && python -m benchmarks.bench_serialization [--rows N] [--repeat N]
+"""
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+# Solo SQLite in memoria: app.database non deve puntare a PostgreSQL
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import Session
+from app import models, schemas
+from app.response_cache import rows_json
+
+LICENSE_COLUMNS = [getattr(models.License, name) for name in schemas.LicenseRead.model_fields]
+LICENSE_LIST = TypeAdapter(list[schemas.LicenseRead])
+
+def seed(engine, count: int):
+    models.Base.metadata.create_all(engine, tables=[models.Category.__table__, models.License.__table__])
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(insert(models.Category.__table__).values(id=1, name="Software"))
+        conn.execute(insert(models.License.__table__), [
+            {
+                "category_id": 1,
+                "product_name": f"Product {i}",
+                "edition": "Professional" if i % 2 else None,
+                "vendor": f"Vendor {i % 50}",
+                "version": f"{i % 20}.0",
+                "license_key": f"KEY-{i:08d}-ABCDE-FGHIJ",
+                "iso_url": f"https://downloads.example.com/{i}.iso" if i % 3 else None,
+                "last_used_at": now - timedelta(minutes=i) if i % 4 else None,
+                "created_at": now - timedelta(days=i % 365, microseconds=i),
+                "updated_at": now - timedelta(seconds=i),
+            }
+            for i in range(count)
+        ])
+
+def orm_json(session: Session) -> bytes:
+    licenses = session.scalars(select(models.License)).all()
+    data = [schemas.LicenseRead.model_validate(lic, from_attributes=True) for lic in licenses]
+    return json.dumps(jsonable_encoder(data)).encode()
+
+def orm_type_adapter(session: Session) -> bytes:
+    licenses = session.scalars(select(models.License)).all()
+    return LICENSE_LIST.dump_json(LICENSE_LIST.validate_python(licenses, from_attributes=True))
+
+def columns_orjson(session: Session) -> bytes:
+    return rows_json(session.execute(select(*LICENSE_COLUMNS)).all())
+
+PATHS = {
+    "ORM + LicenseRead + json": orm_json,
+    "ORM + TypeAdapter": orm_type_adapter,
+    "colonne + orjson": columns_orjson,
+}
+
+def measure(engine, path, repeat: int) -> float:
+    """Tempo migliore su `repeat` esecuzioni, ognuna con una sessione nuova"""
+    best = float("inf")
+    for _ in range(repeat):
+        with Session(engine) as session:
+            start = time.perf_counter()
+            path(session)
+            best = min(best, time.perf_counter() - start)
+    return best
+
+def main(rows: int, repeat: int):
+    engine = create_engine("sqlite://")
+    seed(engine, rows)
+
+    # Stesso documento JSON da tutti i percorsi
+    with Session(engine) as session:
+        expected = json.loads(orm_json(session))
+        for name, path in PATHS.items():
+            assert json.loads(path(session)) == expected, name
+
+    baseline = None
+    for name, path in PATHS.items():
+        seconds = measure(engine, path, repeat)
+        baseline = baseline or seconds
+        print(f"{name:<26} {rows / seconds:>10,.0f} righe/s  {seconds * 1000:8.1f} ms  x{baseline / seconds:.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    main(args.rows, args.repeat)
@@ -0,0 +1,80 @@
+"""
+Funzioni condivise dai benchmark: statistiche di latenza e salvataggio dei
+risultati in JSON, confrontabili tra commit con benchmarks.compare.
+"""
+import json
+import platform
+import subprocess
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """Percentile con interpolazione lineare su valori già ordinati"""
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100
+    low = int(k)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (k - low)
+
+def summarize(latencies: list[float], elapsed: float, errors: int = 0) -> dict:
+    """Latenze in secondi -> p50/p99/media in millisecondi e richieste al secondo"""
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "errors": errors,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        "throughput_rps": round(len(values) / elapsed, 1) if elapsed else 0.0,
+    }
+
+def time_calls(fn, iterations: int, warmup: int = 10) -> dict:
+    """Micro-benchmark: latenza di ogni chiamata a `fn()`"""
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t0)
+    return summarize(latencies, time.perf_counter() - start)
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def write_results(benchmark: str, results: dict, params: dict, output: str | None = None) -> Path:
+    """Salva i risultati in benchmarks/results/<benchmark>-<commit>-<data>.json (o in `output`)"""
+    commit = git_commit()
+    now = datetime.now(timezone.utc)
+    document = {
+        "benchmark": benchmark,
+        "commit": commit,
+        "created_at": now.isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": params,
+        "results": results,
+    }
+    if output:
+        path = Path(output)
+    else:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        path = RESULTS_DIR / f"{benchmark}-{commit or 'nocommit'}-{now:%Y%m%dT%H%M%S}.json"
+    path.write_text(json.dumps(document, indent=2) + "\n")
+    return path
+
+def print_table(results: dict):
+    print(f"{'':<28} {'n':>6} {'err':>4} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>9}")
+    for name, r in results.items():
+        print(f"{name:<28} {r['count']:>6} {r['errors']:>4} {r['p50_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['throughput_rps']:>9.1f}")
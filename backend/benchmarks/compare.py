@@ -0,0 +1,51 @@
+"""
+Confronta due file di risultati (es. prima e dopo una modifica) e segnala
+le regressioni di p50/p99 oltre la soglia.
+
+    cd backend && python -m benchmarks.compare results/api-abc123-....json results/api-def456-....json [--threshold 10]
+
+Esce con codice 1 se almeno una metrica peggiora oltre la soglia.
+"""
+import argparse
+import json
+import sys
+
+METRICS = ("p50_ms", "p99_ms")
+
+def compare(before: dict, after: dict, threshold: float) -> list[str]:
+    regressions = []
+    print(f"{before.get('commit')} -> {after.get('commit')}")
+    for name, new in after["results"].items():
+        old = before["results"].get(name)
+        if old is None:
+            continue
+        changes = []
+        for metric in METRICS:
+            if not old[metric]:
+                continue
+            delta = (new[metric] - old[metric]) / old[metric] * 100
+            changes.append(f"{metric} {old[metric]:.2f} -> {new[metric]:.2f} ({delta:+.1f}%)")
+            if delta > threshold:
+                regressions.append(f"{name} {metric} {delta:+.1f}%")
+        print(f"  {name:<28} " + "  ".join(changes))
+    return regressions
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10.0, help="peggioramento massimo in percentuale")
+    args = parser.parse_args(argv)
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    regressions = compare(before, after, args.threshold)
+    if regressions:
+        print("Regressioni: " + ", ".join(regressions))
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
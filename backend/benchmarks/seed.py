@@ -0,0 +1,92 @@
+"""
+Dataset di licenze per i benchmark (1k, 100k o 1M righe).
+
+Usa DATABASE_URL come l'applicazione: un file SQLite locale oppure il
+PostgreSQL del container. Le licenze generate hanno chiave "SEED-..."; quelle
+create durante i benchmark ("BENCH-...") vengono eliminate a ogni esecuzione,
+così lo stesso dataset è riusabile tra un commit e l'altro.
+
+    cd backend && DATABASE_URL=sqlite:///bench.db python -m benchmarks.seed --size 100k
+    docker compose exec backend python -m benchmarks.seed --size 1m
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.engine import Engine
+
+SIZES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+SEED_PREFIX = "SEED-"
+BENCH_PREFIX = "BENCH-"
+CATEGORY_PREFIX = "Bench "
+CATEGORIES = 20
+CHUNK_SIZE = 10_000
+
+PRODUCTS = [
+    "Office", "Windows Server", "Photoshop", "AutoCAD", "Visual Studio",
+    "SQL Server", "Illustrator", "Acrobat", "Premiere", "Exchange",
+]
+VENDORS = ["Microsoft", "Adobe", "Autodesk", "JetBrains", "Oracle", "VMware"]
+EDITIONS = [None, "Standard", "Professional", "Enterprise"]
+
+def parse_size(value: str) -> int:
+    return SIZES[value.lower()] if value.lower() in SIZES else int(value)
+
+def license_rows(start: int, stop: int, category_ids: list[int], now: datetime):
+    for i in range(start, stop):
+        yield {
+            "category_id": category_ids[i % len(category_ids)],
+            "product_name": f"{PRODUCTS[i % len(PRODUCTS)]} {i % 1000}",
+            "edition": EDITIONS[i % len(EDITIONS)],
+            "vendor": VENDORS[i % len(VENDORS)],
+            "version": f"{2015 + i % 10}",
+            "license_key": f"{SEED_PREFIX}{i:09d}",
+            "iso_url": None,
+            "last_used_at": now - timedelta(hours=i % 5000) if i % 3 else None,
+            "created_at": now - timedelta(minutes=i),
+            "updated_at": now - timedelta(seconds=i),
+        }
+
+def ensure_dataset(engine: Engine, count: int) -> bool:
+    """Porta il database a `count` licenze di seed; restituisce True se le ha (ri)create"""
+    from app import models
+    from app.migrate import upgrade
+
+    upgrade(engine)
+    licenses = models.License.__table__
+    categories = models.Category.__table__
+    with engine.begin() as conn:
+        conn.execute(delete(licenses).where(licenses.c.license_key.startswith(BENCH_PREFIX)))
+        seeded = conn.execute(
+            select(func.count()).select_from(licenses).where(licenses.c.license_key.startswith(SEED_PREFIX))
+        ).scalar()
+    if seeded == count:
+        return False
+
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        conn.execute(delete(licenses).where(licenses.c.license_key.startswith(SEED_PREFIX)))
+        conn.execute(delete(categories).where(categories.c.name.startswith(CATEGORY_PREFIX)))
+        conn.execute(insert(categories), [{"name": f"{CATEGORY_PREFIX}{i}"} for i in range(CATEGORIES)])
+        category_ids = list(conn.scalars(
+            select(categories.c.id).where(categories.c.name.startswith(CATEGORY_PREFIX)).order_by(categories.c.id)
+        ))
+    now = datetime.utcnow()
+    for chunk_start in range(0, count, CHUNK_SIZE):
+        # Una transazione per blocco: memoria costante anche con 1M righe
+        with engine.begin() as conn:
+            conn.execute(insert(licenses), list(license_rows(chunk_start, min(chunk_start + CHUNK_SIZE, count), category_ids, now)))
+    print(f"Dataset: {count} licenze create in {time.perf_counter() - start:.1f} s")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", default="1k", help="1k, 100k, 1m o un numero di licenze")
+    args = parser.parse_args()
+
+    from app.database import engine
+    if not ensure_dataset(engine, parse_size(args.size)):
+        print("Dataset già presente")
+
+if __name__ == "__main__":
+    main()